@@ -0,0 +1,79 @@
+"""
+Бенчмарк батчинга эмбеддингов на синтетическом корпусе смешанной длины.
+
+Сравнивает фиксированные батчи в исходном порядке (как раньше делал
+update_embeddings) с батчами, сгруппированными по длине в токенах.
+
+Запуск:
+    python -m benchmarks.embedding_batching --articles 2000
+"""
+import argparse
+import random
+import time
+
+from search.embeddings import model, encode_texts
+from utils.config import EMBEDDING_BATCH_SIZE, EMBEDDING_TOKEN_BUDGET
+
+WORDS = (
+    "модель данные нейросеть обучение трансформер датасет инференс метрика "
+    "python pytorch gpu кластер запрос эмбеддинг поиск генерация статья релиз "
+    "исследование бенчмарк архитектура слой внимание токен контекст"
+).split()
+
+
+def make_corpus(size, short_share=0.7, seed=42):
+    """Короткие посты как в Telegram вперемешку с длинными статьями как на Хабре."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        if rng.random() < short_share:
+            words = rng.randint(8, 30)
+        else:
+            words = rng.randint(150, 400)
+        corpus.append(' '.join(rng.choice(WORDS) for _ in range(words)))
+    return corpus
+
+
+def encode_fixed(texts, batch_size):
+    """Старое поведение: батчи фиксированного размера в исходном порядке."""
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        model.encode(batch, batch_size=len(batch), show_progress_bar=False,
+                     convert_to_numpy=True)
+
+
+def measure(name, func, texts):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<20} {elapsed:8.2f} s  {len(texts) / elapsed:8.1f} статей/с")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--articles', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument('--token-budget', type=int,
+                        default=EMBEDDING_TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    texts = make_corpus(args.articles)
+    print(f"Корпус: {len(texts)} текстов, batch_size={args.batch_size}, "
+          f"token_budget={args.token_budget}, устройство: {model.device}")
+
+    # Прогрев, чтобы не учитывать ленивую инициализацию
+    model.encode(texts[:8], show_progress_bar=False)
+
+    fixed = measure("fixed batches", lambda: encode_fixed(texts, args.batch_size),
+                    texts)
+    bucketed = measure(
+        "length-bucketed",
+        lambda: encode_texts(texts, batch_size=args.batch_size,
+                             token_budget=args.token_budget),
+        texts)
+    print(f"Ускорение: {fixed / bucketed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Сравнение ключа эмбеддингов TEXT (news.link) и INTEGER (news.id).
+
+Строит копию article_embeddings с ключом по ссылке, как было до перехода
+на news_id, и сравнивает размер таблиц и индексов, а также латентность
+горячего запроса find_similar_articles (поиск + join с news) для обоих
+вариантов.
+
+Запуск (нужна БД из config.yml с заполненными эмбеддингами):
+    python -m benchmarks.embedding_keys --queries 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import asyncpg
+from pgvector.asyncpg import register_vector
+
+from utils.config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
+
+LINK_TABLE = 'bench_embeddings_by_link'
+
+QUERIES = {
+    'news_id (INTEGER)': """
+        SELECT n.id, n.title, n.link, 1 - (ae.embedding <=> $1) AS similarity
+        FROM article_embeddings ae
+        JOIN news n ON ae.news_id = n.id
+        ORDER BY ae.embedding <=> $1
+        LIMIT $2
+    """,
+    'link (TEXT)': f"""
+        SELECT n.id, n.title, n.link, 1 - (ae.embedding <=> $1) AS similarity
+        FROM {LINK_TABLE} ae
+        JOIN news n ON ae.article_id = n.link
+        ORDER BY ae.embedding <=> $1
+        LIMIT $2
+    """,
+}
+
+
+async def build_link_table(conn):
+    await conn.execute(f"DROP TABLE IF EXISTS {LINK_TABLE}")
+    await conn.execute(f"""
+        CREATE TABLE {LINK_TABLE} AS
+        SELECT n.link AS article_id, ae.embedding
+        FROM article_embeddings ae JOIN news n ON n.id = ae.news_id
+    """)
+    await conn.execute(f"ALTER TABLE {LINK_TABLE} ADD PRIMARY KEY (article_id)")
+    await conn.execute(f"VACUUM ANALYZE {LINK_TABLE}")
+    await conn.execute("VACUUM ANALYZE article_embeddings")
+
+
+async def sizes(conn, table):
+    row = await conn.fetchrow("""
+        SELECT pg_table_size($1::regclass) AS heap,
+               pg_indexes_size($1::regclass) AS indexes
+    """, table)
+    return row['heap'], row['indexes']
+
+
+async def latency(conn, sql, vectors, k):
+    timings = []
+    for vector in vectors:
+        async with conn.transaction():
+            # Сравниваем стоимость соединения при точном поиске
+            await conn.execute("SET LOCAL enable_indexscan = off")
+            start = time.perf_counter()
+            await conn.fetch(sql, vector, k)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), sorted(timings)[int(len(timings) * 0.95) - 1]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('-k', type=int, default=15)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(user=DB_USER, password=DB_PASSWORD,
+                                 host=DB_HOST, port=DB_PORT, database=DB_NAME,
+                                 command_timeout=None)
+    try:
+        await register_vector(conn)
+        await build_link_table(conn)
+        vectors = [row['embedding'] for row in await conn.fetch(
+            "SELECT embedding FROM article_embeddings ORDER BY random() LIMIT $1",
+            args.queries)]
+        if not vectors:
+            print("В article_embeddings нет данных")
+            return
+
+        print(f"{'ключ':<18} {'таблица МБ':>11} {'индексы МБ':>11} {'p50 мс':>8} {'p95 мс':>8}")
+        for (label, sql), table in zip(QUERIES.items(),
+                                       ('article_embeddings', LINK_TABLE)):
+            heap, indexes = await sizes(conn, table)
+            p50, p95 = await latency(conn, sql, vectors, args.k)
+            print(f"{label:<18} {heap / 2**20:>11.1f} {indexes / 2**20:>11.1f} "
+                  f"{p50:>8.2f} {p95:>8.2f}")
+    finally:
+        await conn.execute(f"DROP TABLE IF EXISTS {LINK_TABLE}")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
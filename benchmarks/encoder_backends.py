@@ -0,0 +1,97 @@
+"""
+Проверка и бенчмарк бэкендов модели эмбеддингов.
+
+Для каждого бэкенда считает косинусную близость его векторов к эталонным
+векторам PyTorch float32 на одном и том же корпусе, латентность одиночного
+запроса и пропускную способность батчевого кодирования.
+
+Запуск:
+    python -m benchmarks.encoder_backends --backends torch-int8 onnx onnx-int8
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from benchmarks.embedding_batching import make_corpus
+from search.encoder import BACKENDS, load_encoder
+from utils.config import EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE
+
+
+def query_latency_ms(model, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        model.encode(query, convert_to_numpy=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def batch_throughput(model, texts, batch_size):
+    start = time.perf_counter()
+    vectors = model.encode(texts, batch_size=batch_size,
+                           show_progress_bar=False, convert_to_numpy=True)
+    return vectors, len(texts) / (time.perf_counter() - start)
+
+
+def cosine_rows(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return np.sum(a * b, axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS[1:]),
+                        choices=BACKENDS)
+    parser.add_argument('--model', default=EMBEDDING_MODEL)
+    parser.add_argument('--articles', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument('--min-cosine', type=float, default=0.99,
+                        help="Порог средней косинусной близости к float32")
+    args = parser.parse_args()
+
+    texts = make_corpus(args.articles)
+    queries = [text[:60] for text in texts[:args.queries]]
+
+    baseline = load_encoder('torch', args.model)
+    baseline.encode(texts[:8], show_progress_bar=False)
+    reference, base_rate = batch_throughput(baseline, texts, args.batch_size)
+    base_median, base_max = query_latency_ms(baseline, queries)
+
+    print(f"{'backend':<12} {'dim':>4} {'cos mean':>9} {'cos min':>8} "
+          f"{'query p50 ms':>13} {'query max ms':>13} {'batch/s':>9} {'speedup':>8}")
+    print(f"{'torch':<12} {reference.shape[1]:>4} {1.0:>9.4f} {1.0:>8.4f} "
+          f"{base_median:>13.2f} {base_max:>13.2f} {base_rate:>9.1f} {1.0:>7.2f}x")
+
+    failed = []
+    for backend in args.backends:
+        if backend == 'torch':
+            continue
+        try:
+            # Без fallback: иначе под именем бэкенда проверялся бы torch
+            model = load_encoder(backend, args.model, fallback=False)
+        except Exception as e:
+            print(f"{backend:<12} не загружен: {e}")
+            failed.append(backend)
+            continue
+        model.encode(texts[:8], show_progress_bar=False)
+        vectors, rate = batch_throughput(model, texts, args.batch_size)
+        median, worst = query_latency_ms(model, queries)
+        cosine = cosine_rows(reference, vectors)
+
+        print(f"{backend:<12} {vectors.shape[1]:>4} {cosine.mean():>9.4f} "
+              f"{cosine.min():>8.4f} {median:>13.2f} {worst:>13.2f} "
+              f"{rate:>9.1f} {rate / base_rate:>7.2f}x")
+        if vectors.shape[1] != reference.shape[1] or cosine.mean() < args.min_cosine:
+            failed.append(backend)
+
+    if failed:
+        print(f"Не загружены или не прошли проверку согласованности: {', '.join(failed)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
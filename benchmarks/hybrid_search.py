@@ -0,0 +1,86 @@
+"""
+Латентность гибридного поиска по сравнению с чисто векторным.
+
+Для набора запросов (по умолчанию — заголовки случайных статей из БД
+и несколько запросов с точными названиями) измеряется время:
+    vector     — эмбеддинг запроса + поиск похожих статей
+    lexical    — полнотекстовый поиск по news.search_tsv
+    hybrid     — оба поиска параллельно + reciprocal rank fusion
+    sequential — те же два поиска последовательно (для сравнения)
+    prefilter  — векторный поиск среди статей, подходящих по тексту
+
+Запуск (нужна БД из config.yml с заполненными эмбеддингами):
+    python -m benchmarks.hybrid_search --queries 100
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from database.db_manager import init_db_pool, find_articles_by_text
+from search.lm_search import semantic_search, hybrid_search, reciprocal_rank_fusion
+
+NAMED_QUERIES = ['PyTorch 2.0', 'GPT-4', 'Llama 3', 'pandas DataFrame',
+                 'Kubernetes operator', 'Яндекс', 'Сбер GigaChat']
+
+
+async def sequential_search(query, pool, top_k):
+    lexical = await find_articles_by_text(pool, query, limit=50)
+    vector = await semantic_search(query, pool, top_k=50, mode='vector')
+    return reciprocal_rank_fusion([vector, lexical])[:top_k]
+
+
+MODES = {
+    'vector': lambda q, pool, k: semantic_search(q, pool, top_k=k, mode='vector'),
+    'lexical': lambda q, pool, k: find_articles_by_text(pool, q, limit=k),
+    'hybrid': lambda q, pool, k: hybrid_search(q, pool, top_k=k),
+    'sequential': sequential_search,
+    'prefilter': lambda q, pool, k: semantic_search(q, pool, top_k=k, mode='vector',
+                                                    text_filter=q),
+}
+
+
+async def sample_queries(pool, count):
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT title FROM news WHERE title <> '' ORDER BY random() LIMIT $1",
+            count)
+    return NAMED_QUERIES + [row['title'] for row in rows]
+
+
+async def run(args):
+    pool = await init_db_pool()
+    try:
+        queries = await sample_queries(pool, args.queries)
+        # Прогрев модели и кэша страниц
+        for mode in MODES.values():
+            await mode(queries[0], pool, args.top_k)
+
+        print(f"{'mode':>10} {'p50 ms':>9} {'p95 ms':>9} {'found':>7}")
+        for name, mode in MODES.items():
+            timings = []
+            found = 0
+            for query in queries:
+                started = time.perf_counter()
+                results = await mode(query, pool, args.top_k)
+                timings.append((time.perf_counter() - started) * 1000)
+                found += len(results)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"{name:>10} {statistics.median(timings):>9.1f} {p95:>9.1f} "
+                  f"{found / len(queries):>7.1f}")
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Гибридный поиск против векторного")
+    parser.add_argument('--queries', type=int, default=100,
+                        help="Сколько заголовков статей взять запросами")
+    parser.add_argument('--top-k', type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Холодный старт индекса векторов из снимка на диске.
+
+Генерирует N случайных нормированных векторов, пишет снимок (один сегмент
+плюс дописанный сегмент с обновлениями) и измеряет время записи, открытия
+снимка через memory map, первого поиска (с подкачкой страниц) и поиска
+в установившемся режиме, с окном дат и без.
+
+Запуск (БД не нужна):
+    python -m benchmarks.snapshot_cold_start --sizes 100000 1000000
+    python -m benchmarks.snapshot_cold_start --format arrow
+"""
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from search.snapshot import (write_snapshot, append_segment, read_snapshot,
+                             normalize, SEGMENT_FORMATS)
+from search.vector_index import VectorIndex
+
+DIM = 384
+APPEND_ROWS = 10000
+
+
+def make_segment(rng, ids):
+    vectors = normalize(rng.standard_normal((len(ids), DIM), dtype=np.float32))
+    published = rng.integers(1_600_000_000, 1_750_000_000, len(ids))
+    return ids, vectors, published
+
+
+def search_latency(index, queries, **window):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, 20, **window)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def run(size, fmt, queries, directory):
+    rng = np.random.default_rng(0)
+    path = Path(directory) / f"snapshot-{size}"
+    now = datetime.now(timezone.utc)
+
+    ids, vectors, published = make_segment(rng, np.arange(1, size + 1))
+    started = time.perf_counter()
+    write_snapshot(path, 'bench', ids, vectors, published, now, fmt=fmt)
+    write_s = time.perf_counter() - started
+    del vectors
+
+    updated = rng.choice(size, APPEND_ROWS, replace=False) + 1
+    append_segment(path, 'bench', *make_segment(rng, np.sort(updated)), now, fmt=fmt)
+
+    started = time.perf_counter()
+    index = VectorIndex.from_snapshot(read_snapshot(path))
+    open_ms = (time.perf_counter() - started) * 1000
+
+    query_vectors = normalize(rng.standard_normal((queries, DIM), dtype=np.float32))
+    started = time.perf_counter()
+    index.search(query_vectors[0], 20)
+    first_ms = (time.perf_counter() - started) * 1000
+
+    full_ms = search_latency(index, query_vectors)
+    window_ms = search_latency(index, query_vectors,
+                               start=1_740_000_000, end=1_750_000_000)
+    print(f"{size:>9} {fmt:>5} {write_s:>9.1f}s {open_ms:>9.1f} {first_ms:>10.1f} "
+          f"{full_ms:>9.2f} {window_ms:>10.2f}")
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--format', choices=SEGMENT_FORMATS, default='npy')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--dir', default=None,
+                        help="Каталог для снимков (по умолчанию временный)")
+    args = parser.parse_args()
+
+    print(f"{'vectors':>9} {'fmt':>5} {'write':>10} {'open ms':>9} {'first ms':>10} "
+          f"{'p50 ms':>9} {'p50 win ms':>10}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for size in args.sizes:
+            run(size, args.format, args.queries, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Бенчмарк точного и ANN-поиска pgvector на синтетических векторах.
+
+Для каждого размера корпуса создается временная таблица со случайными
+кластеризованными векторами, строится индекс (HNSW или IVFFlat) и
+сравниваются латентность и recall@k точного поиска (seq scan) и ANN-поиска
+при разных значениях ef_search / probes.
+
+Запуск (нужна БД из config.yml):
+    python -m benchmarks.vector_search --sizes 10000 100000 1000000
+    python -m benchmarks.vector_search --method ivfflat --knobs 1 10 40
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import asyncpg
+import numpy as np
+from pgvector.asyncpg import register_vector
+
+from utils.config import (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME,
+                          VECTOR_INDEX_M, VECTOR_INDEX_EF_CONSTRUCTION)
+
+DIM = 384
+CHUNK = 50_000
+
+
+def synthetic_vectors(rng, count, centers):
+    """Нормированные векторы вокруг случайных центров, как у тематических статей."""
+    labels = rng.integers(0, len(centers), size=count)
+    vectors = centers[labels] + rng.normal(scale=0.35, size=(count, DIM))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+async def load_table(conn, table, size, rng, centers):
+    await conn.execute(f"DROP TABLE IF EXISTS {table}")
+    await conn.execute(
+        f"CREATE UNLOGGED TABLE {table} (id INTEGER PRIMARY KEY, embedding vector({DIM}))")
+    for start in range(0, size, CHUNK):
+        count = min(CHUNK, size - start)
+        vectors = synthetic_vectors(rng, count, centers)
+        await conn.copy_records_to_table(
+            table, records=((start + i, vectors[i]) for i in range(count)),
+            columns=['id', 'embedding'])
+    await conn.execute(f"ANALYZE {table}")
+
+
+async def build_index(conn, table, method, lists):
+    if method == 'hnsw':
+        options = (f"WITH (m = {VECTOR_INDEX_M}, "
+                   f"ef_construction = {VECTOR_INDEX_EF_CONSTRUCTION})")
+    else:
+        options = f"WITH (lists = {lists})"
+    start = time.perf_counter()
+    await conn.execute(
+        f"CREATE INDEX ON {table} USING {method} (embedding vector_cosine_ops) {options}",
+        timeout=None)
+    return time.perf_counter() - start
+
+
+async def run_queries(conn, table, queries, k, settings):
+    timings = []
+    results = []
+    for query in queries:
+        async with conn.transaction():
+            for setting in settings:
+                await conn.execute(setting)
+            start = time.perf_counter()
+            rows = await conn.fetch(
+                f"SELECT id FROM {table} ORDER BY embedding <=> $1 LIMIT $2",
+                query, k)
+            timings.append((time.perf_counter() - start) * 1000)
+        results.append({row['id'] for row in rows})
+    return results, timings
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q))
+
+
+async def bench_size(conn, size, args, rng, centers):
+    table = f"bench_vectors_{size}"
+    print(f"\n=== {size} векторов ===")
+    start = time.perf_counter()
+    await load_table(conn, table, size, rng, centers)
+    print(f"Загрузка: {time.perf_counter() - start:.1f} с")
+
+    queries = synthetic_vectors(rng, args.queries, centers)
+    exact, exact_ms = await run_queries(
+        conn, table, queries, args.k,
+        ["SET LOCAL enable_indexscan = off", "SET LOCAL enable_bitmapscan = off"])
+
+    lists = max(10, size // 1000)
+    build = await build_index(conn, table, args.method, lists)
+    print(f"Индекс {args.method}: {build:.1f} с")
+
+    print(f"{'режим':<22} {'p50 мс':>8} {'p95 мс':>8} {'recall@' + str(args.k):>10}")
+    print(f"{'exact':<22} {statistics.median(exact_ms):>8.2f} "
+          f"{percentile(exact_ms, 95):>8.2f} {1.0:>10.3f}")
+
+    knob = 'hnsw.ef_search' if args.method == 'hnsw' else 'ivfflat.probes'
+    for value in args.knobs:
+        found, ann_ms = await run_queries(
+            conn, table, queries, args.k, [f"SET LOCAL {knob} = {int(value)}"])
+        recall = statistics.mean(
+            len(a & e) / len(e) for a, e in zip(found, exact) if e)
+        label = f"{args.method} {knob.split('.')[1]}={value}"
+        print(f"{label:<22} {statistics.median(ann_ms):>8.2f} "
+              f"{percentile(ann_ms, 95):>8.2f} {recall:>10.3f}")
+
+    if not args.keep:
+        await conn.execute(f"DROP TABLE {table}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--method', choices=['hnsw', 'ivfflat'], default='hnsw')
+    parser.add_argument('--knobs', type=int, nargs='+', default=[20, 40, 100, 200],
+                        help="Значения ef_search (hnsw) или probes (ivfflat)")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--keep', action='store_true',
+                        help="Не удалять таблицы после прогона")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    centers = rng.normal(size=(args.clusters, DIM))
+
+    conn = await asyncpg.connect(user=DB_USER, password=DB_PASSWORD,
+                                 host=DB_HOST, port=DB_PORT, database=DB_NAME,
+                                 command_timeout=None)
+    try:
+        await register_vector(conn)
+        await conn.execute("SET maintenance_work_mem = '1GB'")
+        for size in args.sizes:
+            await bench_size(conn, size, args, rng, centers)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
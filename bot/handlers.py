@@ -9,9 +9,11 @@ from bot.keyboards import (
     get_admin_menu_text,
     get_channels_menu_text,
     get_admin_management_menu_text,
+    get_post_pool_menu_text,
     ADMIN_COMMANDS_MAP,
     CHANNEL_COMMANDS_MAP,
-    ADMIN_MANAGEMENT_MAP
+    ADMIN_MANAGEMENT_MAP,
+    POST_POOL_COMMANDS_MAP
 )
 from parsers.main_parser import run_parsing
 from parsers.html_parser import parse_single_article_content
@@ -19,14 +21,18 @@ from search.embeddings import update_embeddings
 from search.lm_search import semantic_search
 from rag.weekly_summary import create_weekly_summary
 from database.db_manager import (
-    set_setting, get_setting, get_db_status,
+    set_setting, get_setting, get_db_stats,
     save_article, add_channel, get_channels, remove_channel,
-    get_admins, add_admin, remove_admin
+    get_admins, add_admin, remove_admin, get_embedding_migration_status,
+    get_post_candidates, count_post_candidates
 )
 from scheduler.jobs import (scheduled_parsing, scheduled_embedding_update,
                             scheduled_post_publication,
                             scheduled_weekly_summary, scheduled_weekly_theme)
 from utils.telegram_web import send_web_message, get_chat_info
+from utils import metrics
+from database.pools import workload
+from scheduler.candidates import build_candidate_pool, start_rendering
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +45,7 @@ class UserState:
     MAIN_MENU = "main_menu"
     CHANNELS_MENU = "channels_menu"
     ADMIN_MANAGEMENT_MENU = "admin_management_menu"
+    POST_POOL_MENU = "post_pool_menu"
     ADDING_ADMIN = "adding_admin"
     REMOVING_ADMIN = "removing_admin"
     ADDING_CHANNEL = "adding_channel"
@@ -177,13 +184,26 @@ async def handle_status(event, pool):
         await event.respond('Собираю информацию о статусе системы...')
         current_theme = await get_setting(pool,
                                           'weekly_theme') or 'не установлена'
-        stats = await get_db_status(pool)
+        stats = await get_db_stats(pool)
+        tables = stats['tables']
         status_message = (
             f"**Статус системы**\n\n"
             f"- **Тема недели:** {current_theme}\n"
-            f"- **Статей в базе:** {stats['news']}\n"
-            f"- **Эмбеддингов создано:** {stats['article_embeddings']}\n"
+            f"- **Статей в базе:** {_format_rows(tables.get('news'))}\n"
+            f"- **Эмбеддингов создано:** "
+            f"{_format_rows(tables.get('article_embeddings'))}\n"
+            f"- **Без эмбеддинга:** ~{stats['embedding_backlog']}\n"
+            f"- **Статей в пуле постов:** {await count_post_candidates(pool)}\n"
+            f"- **Последний сбор:** {_format_time(stats['last_ingest'])}\n"
         )
+        # Оценки планировщика: точный подсчет — соединение двух таблиц
+        # эмбеддингов, его выполняет задание миграции
+        migration = await get_embedding_migration_status(pool, exact=False)
+        if migration:
+            status_message += (
+                f"- **Миграция эмбеддингов на {migration['model_id']}:** "
+                f"~{migration['done']}/~{migration['total']}\n"
+            )
         await event.respond(status_message)
     except Exception as e:
         await event.respond(f'Ошибка при получении статуса: {e}')
@@ -203,8 +223,18 @@ async def handle_set_theme_confirm(event, pool, client):
         return
 
     await set_setting(pool, 'weekly_theme', new_theme)
+    # Теги прежней темы к новой теме не относятся
+    await set_setting(pool, 'weekly_theme_tags', '')
     await event.respond(f'Тема недели обновлена: "{new_theme}"')
     set_user_state(event.sender_id, UserState.MAIN_MENU)
+    try:
+        with workload('batch'):
+            count = await build_candidate_pool(pool, new_theme, tags=[])
+        start_rendering(pool)
+        await event.respond(f'Пул постов сформирован: {count} статей.')
+    except Exception as e:
+        logger.error(f"Error building candidate pool: {e}", exc_info=True)
+        await event.respond(f'Ошибка при формировании пула постов: {e}')
 
 
 async def handle_add_article(event, pool, client):
@@ -334,7 +364,8 @@ async def handle_search_confirm(event, pool, client):
 async def handle_parsing(event, pool, client):
     await event.respond('Запускаю парсинг...')
     try:
-        await run_parsing(client, pool)
+        with workload('ingest'):
+            await run_parsing(client, pool)
         await event.respond('Парсинг завершен.')
     except Exception as e:
         await event.respond(f'Ошибка во время парсинга: {e}')
@@ -343,8 +374,12 @@ async def handle_parsing(event, pool, client):
 async def handle_embeddings(event, pool):
     await event.respond('Запускаю генерацию эмбеддингов...')
     try:
-        await update_embeddings(pool)
-        await event.respond('Генерация эмбеддингов завершена.')
+        with workload('batch'):
+            stats = await update_embeddings(pool)
+        await event.respond(
+            f"Генерация эмбеддингов завершена.\n"
+            f"Обработано: {stats['processed']}, ошибок: {stats['errors']}, "
+            f"переиспользовано по хэшу текста: {stats['reused']}")
     except Exception as e:
         await event.respond(f'Ошибка во время генерации эмбеддингов: {e}')
 
@@ -362,18 +397,82 @@ async def handle_summary_confirm(event, pool, client):
     set_user_state(event.sender_id, UserState.MAIN_MENU)
 
 
+def _format_rows(table):
+    """Число строк таблицы; оценки помечаются тильдой."""
+    if not table:
+        return 'нет данных'
+    return f"{table['rows']}" if table['exact'] else f"~{table['rows']}"
+
+
+def _format_size(size):
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+def _format_time(value):
+    return value.strftime('%d.%m.%Y %H:%M') if value else 'нет данных'
+
+
 async def handle_db_status(event, pool):
     try:
         await event.respond('Получаю статистику базы данных...')
-        stats = await get_db_status(pool)
+        stats = await get_db_stats(pool)
         stats_message = "**Состояние базы данных:**\n\n"
-        for table, count in stats.items():
-            stats_message += f"- **{table.replace('_', ' ').capitalize()}:** {count}\n"
+        for table_name, table in stats['tables'].items():
+            stats_message += (f"- **{table_name.replace('_', ' ').capitalize()}:** "
+                              f"{_format_rows(table)} ({_format_size(table['size'])})\n")
+        stats_message += (f"\n- **Статей без эмбеддинга:** ~{stats['embedding_backlog']}\n"
+                          f"- **Последний сбор:** {_format_time(stats['last_ingest'])}\n")
+        if stats['sources']:
+            stats_message += "\n**Источники:**\n"
+            for source in stats['sources']:
+                stats_message += (f"- {source['source']}: ~{source['articles']}, "
+                                  f"последняя статья {_format_time(source['last_ingest'])}\n")
         await event.respond(stats_message)
     except Exception as e:
         await event.respond(f'Ошибка при получении состояния базы: {e}')
 
 
+def _format_ms(seconds):
+    if seconds is None:
+        return '-'
+    if seconds == float('inf'):
+        return '>30 с'
+    return f"{seconds * 1000:g} мс"
+
+
+async def handle_metrics(event, pool):
+    lines = ["**Пулы соединений**"]
+    waits = metrics.get_histograms('db_pool_acquire_seconds')
+    for name, stats in pool.stats().items():
+        wait = waits.get(name)
+        lines.append(
+            f"- **{name}:** занято {stats['in_use']} из {stats['size']} "
+            f"(максимум {stats['max_size']}), свободно {stats['idle']}, "
+            f"ожидание p95 {_format_ms(wait.quantile(0.95) if wait else None)}")
+
+    histograms = metrics.get_histograms('db_query_seconds')
+    lines.append("\n**Запросы к базе с момента запуска**")
+    if not histograms:
+        lines.append("Запросов еще не было.")
+    else:
+        lines.append("(p50/p95/p99 — верхняя граница корзины гистограммы)")
+    for name, histogram in sorted(histograms.items(),
+                                  key=lambda item: item[1].sum, reverse=True):
+        rows = metrics.get_counter('db_query_rows', name)
+        lines.append(
+            f"- **{name}:** {histogram.count} раз, "
+            f"среднее {histogram.sum / histogram.count * 1000:.1f} мс, "
+            f"p50 {_format_ms(histogram.quantile(0.5))}, "
+            f"p95 {_format_ms(histogram.quantile(0.95))}, "
+            f"p99 {_format_ms(histogram.quantile(0.99))}, "
+            f"строк в среднем {rows / histogram.count:.1f}")
+    await event.respond("\n".join(lines))
+
+
 async def handle_view_logs(event):
     try:
         log_file = 'app.log'
@@ -598,6 +697,70 @@ async def handle_channel_command(event, pool, client):
         await event.respond(get_channels_menu_text())
 
 
+# --- Post Pool Handlers ---
+
+POST_POOL_LIST_LIMIT = 20
+
+async def handle_post_pool_menu(event, pool, client):
+    """Показывает меню пула постов"""
+    set_user_state(event.sender_id, UserState.POST_POOL_MENU)
+    await event.respond(get_post_pool_menu_text())
+
+
+async def handle_list_post_pool(event, pool):
+    """Показывает статьи-кандидаты в порядке публикации"""
+    try:
+        theme = await get_setting(pool, 'candidate_pool_theme')
+        candidates = await get_post_candidates(pool)
+        if not candidates:
+            await event.respond('Пул постов пуст.')
+            return
+
+        # Сообщение Telegram ограничено 4096 символами
+        lines = [f'{i}. {"✅ " if row["rendered"] else ""}{row["title"]} '
+                 f'({row["similarity"]:.2f})\n   {row["link"]}'
+                 for i, row in enumerate(candidates[:POST_POOL_LIST_LIMIT], 1)]
+        if len(candidates) > POST_POOL_LIST_LIMIT:
+            lines.append(f'... и еще {len(candidates) - POST_POOL_LIST_LIMIT}')
+        await event.respond(
+            f'**Пул постов по теме «{theme}»** (✅ — саммари готово):\n\n'
+            + '\n'.join(lines),
+            link_preview=False)
+    except Exception as e:
+        logger.error(f'Ошибка при получении пула постов: {e}')
+        await event.respond('Произошла ошибка при получении пула постов.')
+
+
+async def handle_regenerate_post_pool(event, pool):
+    """Перестраивает пул по текущей теме недели"""
+    await event.respond('Формирую пул постов...')
+    try:
+        with workload('batch'):
+            count = await build_candidate_pool(pool)
+        start_rendering(pool)
+        await event.respond(f'Пул постов сформирован: {count} статей.')
+    except Exception as e:
+        logger.error(f"Error building candidate pool: {e}", exc_info=True)
+        await event.respond(f'Ошибка при формировании пула постов: {e}')
+
+
+async def handle_post_pool_command(event, pool, client):
+    """Обработчик команд меню пула постов"""
+    command = event.text.strip()
+
+    if command == '1':  # Показать пул
+        await handle_list_post_pool(event, pool)
+    elif command == '2':  # Перегенерировать пул
+        await handle_regenerate_post_pool(event, pool)
+    elif command == '0':  # Назад
+        set_user_state(event.sender_id, UserState.MAIN_MENU)
+        await event.respond(get_admin_menu_text())
+    else:
+        await event.respond(
+            'Неизвестная команда. Пожалуйста, выберите действие из меню.')
+        await event.respond(get_post_pool_menu_text())
+
+
 # --- Main Handler Registration ---
 
 async def register_handlers(client, pool):
@@ -660,6 +823,15 @@ async def register_handlers(client, pool):
                 await event.respond(get_channels_menu_text())
             return
 
+        if current_state == UserState.POST_POOL_MENU:
+            if command in POST_POOL_COMMANDS_MAP:
+                await handle_post_pool_command(event, pool, client)
+            else:
+                await event.respond(
+                    "Пожалуйста, используйте команды из текущего меню")
+                await event.respond(get_post_pool_menu_text())
+            return
+
         if current_state == UserState.ADMIN_MANAGEMENT_MENU:
             if command in ADMIN_MANAGEMENT_MAP:
                 await handle_admin_command(event, pool, client)
@@ -701,10 +873,14 @@ async def register_handlers(client, pool):
             await handle_view_logs(event)
         elif command_name == "Тренировка недельного сценария":
             await handle_weekly_training(event, pool, client)
+        elif command_name == "Метрики":
+            await handle_metrics(event, pool)
         elif command_name == "Управление каналами":
             await handle_channels_menu(event, pool, client)
         elif command_name == "Управление админами":
             await handle_admin_management_menu(event, pool, client)
+        elif command_name == "Управление пулом постов":
+            await handle_post_pool_menu(event, pool, client)
         elif command_name == "Назад":
             set_user_state(event.sender_id, UserState.MAIN_MENU)
             await event.respond(get_admin_menu_text())
@@ -10,7 +10,9 @@ ADMIN_COMMANDS_MAP = {
     "9": "Создать саммари",
     "10": "Состояние базы",
     "11": "Просмотр логов",
-    "12": "Тренировка недельного сценария"
+    "12": "Тренировка недельного сценария",
+    "13": "Метрики",
+    "14": "Управление пулом постов"
 }
 
 CHANNEL_COMMANDS_MAP = {
@@ -20,6 +22,12 @@ CHANNEL_COMMANDS_MAP = {
     "0": "Назад в главное меню"
 }
 
+POST_POOL_COMMANDS_MAP = {
+    "1": "Показать пул",
+    "2": "Перегенерировать пул",
+    "0": "Назад в главное меню"
+}
+
 ADMIN_MANAGEMENT_MAP = {
     "1": "Список админов",
     "2": "Добавить админа",
@@ -51,3 +59,12 @@ def get_admin_management_menu_text():
     menu_text += "Выберите действие, отправив его номер:\n"
     menu_text += "\n".join(menu_items)
     return menu_text
+
+
+def get_post_pool_menu_text():
+    """Генерирует текстовое представление меню пула постов."""
+    menu_items = [f"{num}. {name}" for num, name in POST_POOL_COMMANDS_MAP.items()]
+    menu_text = "Пул статей-кандидатов для постов по теме недели\n\n"
+    menu_text += "Выберите действие, отправив его номер:\n"
+    menu_text += "\n".join(menu_items)
+    return menu_text
@@ -1,36 +1,100 @@
+import asyncio
+import json
 import logging
+from datetime import datetime, timezone
 import asyncpg
 from pgvector.asyncpg import register_vector
-from utils.config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
+from database import queries
+from database.queries import PreparedConnection, statement
+from database.pools import DatabasePools, WORKLOADS
+from utils.config import (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME,
+                          VECTOR_INDEX_METHOD, VECTOR_INDEX_M,
+                          VECTOR_INDEX_EF_CONSTRUCTION, VECTOR_INDEX_LISTS,
+                          VECTOR_SEARCH_EF_SEARCH, VECTOR_SEARCH_PROBES,
+                          VECTOR_SEARCH_EXACT_MAX_ROWS,
+                          VECTOR_SEARCH_MAX_EF_SEARCH, STATS_EXACT_COUNTS,
+                          DB_POOLS, STORAGE_PARTITIONS_AHEAD,
+                          STORAGE_RETENTION_MONTHS, STORAGE_SNIPPET_CHARS,
+                          STORAGE_BODY_COMPRESSION)
 
 logger = logging.getLogger(__name__)
 
 # Список разрешенных таблиц для запросов статуса
-SAFE_TABLES = ['news', 'article_embeddings', 'published_links', 'settings',
-               'admins', 'channels']
+SAFE_TABLES = ['news', 'article_embeddings', 'article_bodies', 'published_links',
+               'settings', 'admins', 'channels']
+
+# Таблицы, для которых ведутся точные счетчики строк (stats.exact_counts)
+COUNTED_TABLES = ['news', 'article_embeddings']
+
+# Таблицы эмбеддингов и статус модели, векторы которой в них лежат.
+# article_embeddings_next заполняется новой моделью во время миграции.
+ACTIVE_EMBEDDINGS_TABLE = 'article_embeddings'
+NEXT_EMBEDDINGS_TABLE = 'article_embeddings_next'
+EMBEDDING_TABLES = {
+    ACTIVE_EMBEDDINGS_TABLE: 'active',
+    NEXT_EMBEDDINGS_TABLE: 'building',
+}
+
+VECTOR_INDEX_METHODS = ('hnsw', 'ivfflat')
+INDEX_BUILD_TIMEOUT = 6 * 3600  # Построение индекса на большой таблице может быть долгим
+
+# Сжатие полных текстов статей (storage.body_compression): значения
+# attcompression и attstorage столбца article_bodies.body
+BODY_COMPRESSION = {
+    'pglz': ('p', 'x'),
+    'lz4': ('l', 'x'),
+    'none': ('', 'e'),
+}
+
+# Кэш таблицы settings. Сбрасывается по NOTIFY из set_setting любого
+# экземпляра бота; пока LISTEN-соединения нет, кэш не используется.
+SETTINGS_CHANNEL = 'settings_changed'
+SETTINGS_LISTENER_RETRY = 30  # секунд между попытками переподключения
+_settings_cache = None
+_settings_generation = 0
+_settings_listener = None
+_settings_reconnect_task = None
+
+
+async def init_db_pool(workloads=WORKLOADS):
+    """
+    Initializes the connection pools (one per workload class, see
+    database.pools) with pgvector support.
 
+    Args:
+        workloads: Workload classes to create pools for; command line tools
+            only need 'batch'
 
-async def init_db_pool():
-    """Initializes the database connection pool with pgvector support."""
+    Returns a DatabasePools object that is used like a single pool.
+    """
     try:
         async def init_connection(conn):
             # Register vector type for each new connection
             await register_vector(conn)
-            # Set a statement timeout to prevent long-running queries
-            await conn.execute('SET statement_timeout = 60000')  # 60 seconds
-
-        # Create the connection pool with our initialization
-        pool = await asyncpg.create_pool(
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            init=init_connection,
-            min_size=1,
-            max_size=10,
-            command_timeout=60.0  # 60 seconds
-        )
+            # Горячие запросы разбираются и планируются один раз на соединение
+            await conn.prepare_statements()
+
+        pools = {}
+        for name in workloads:
+            settings = DB_POOLS[name]
+            timeout = settings['statement_timeout']
+            pools[name] = await asyncpg.create_pool(
+                user=DB_USER,
+                password=DB_PASSWORD,
+                host=DB_HOST,
+                port=DB_PORT,
+                database=DB_NAME,
+                init=init_connection,
+                connection_class=PreparedConnection,
+                min_size=settings['min_size'],
+                max_size=settings['max_size'],
+                # Таймаут задается параметром сессии, поэтому переживает
+                # RESET ALL при возврате соединения в пул
+                server_settings={'statement_timeout': str(int(timeout * 1000)),
+                                 'application_name': f"news-bot-{name}"},
+                command_timeout=timeout or None
+            )
+        pool = DatabasePools(pools)
 
         # Verify the connection works with vector operations
         async with pool.acquire() as conn:
@@ -51,88 +115,96 @@ async def init_db_pool():
         raise
 
 
-async def ensure_database_schema(pool):
-    """Ensures all database tables and extensions are properly set up."""
+async def init_db(pool):
+    """
+    Приводит базу в соответствие с конфигурацией: секции news на ближайшие
+    месяцы, сжатие текстов статей, векторный индекс и точные счетчики строк.
+    Схема создается миграциями (database.migrations).
+    """
     try:
-        async with pool.acquire() as conn:
-            # Create extension if possible
-            try:
-                await conn.execute('CREATE EXTENSION IF NOT EXISTS vector')
-            except Exception as e:
-                logger.warning(
-                    f"Could not create vector extension (it might already exist): {e}")
+        await ensure_news_partitions(pool)
+        await ensure_body_compression(pool)
+        await ensure_vector_index(pool)
+        await ensure_row_counters(pool)
+    except Exception as e:
+        logger.error(f"Ошибка при инициализации базы данных: {e}",
+                     exc_info=True)
+        raise
 
-            # Create tables if they don't exist
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS news (
-                    id SERIAL PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    link TEXT UNIQUE NOT NULL,
-                    description TEXT,
-                    source TEXT,
-                    tags TEXT[],
-                    published TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                );
-                
-                -- Add published column if it doesn't exist
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns 
-                                  WHERE table_name = 'news' AND column_name = 'published') THEN
-                        ALTER TABLE news ADD COLUMN published TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-                        -- Update existing records with current timestamp if published is NULL
-                        UPDATE news SET published = CURRENT_TIMESTAMP WHERE published IS NULL;
-                    END IF;
-                END $$;
-                
-                CREATE TABLE IF NOT EXISTS article_embeddings (
-                    article_id TEXT PRIMARY KEY REFERENCES news(link) ON DELETE CASCADE,
-                    embedding vector(384) NOT NULL
-                );
-                
-                CREATE TABLE IF NOT EXISTS admins (
-                    user_id BIGINT PRIMARY KEY
-                );
-                
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                );
-                
-                CREATE TABLE IF NOT EXISTS published_links (
-                    link TEXT PRIMARY KEY
-                );
-                
-                CREATE TABLE IF NOT EXISTS channels (
-                username TEXT PRIMARY KEY,
-                added_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            );
-                
-                CREATE TABLE IF NOT EXISTS channel_states (
-                    username TEXT PRIMARY KEY,
-                    last_message_id INTEGER NOT NULL
-                );
-            """)
 
-            # Исправляем формат существующих эмбеддингов
-            await fix_existing_embeddings(pool)
+# news разбита на помесячные секции по published (см. миграцию 5), поэтому
+# уникальность ссылки проверяется в save_article, а не ограничением таблицы.
+# Полный текст статьи лежит в article_bodies, в news — фрагмент (миграция 6).
+SAVE_ARTICLE_UPDATE = statement('save_article_update', """
+    UPDATE news
+    SET title = $2, description = news_snippet($3, $6), source = $4, tags = $5,
+        search_tsv = news_search_tsv($2, $3)
+    WHERE link = $1
+    RETURNING id
+""")
+SAVE_ARTICLE_INSERT = statement('save_article_insert', """
+    INSERT INTO news (title, link, description, source, tags, published, search_tsv)
+    VALUES ($1, $2, news_snippet($3, $7), $4, $5, $6, news_search_tsv($1, $3))
+    RETURNING id
+""")
+SAVE_ARTICLE_BODY = statement('save_article_body', """
+    INSERT INTO article_bodies (news_id, body)
+    VALUES ($1, $2)
+    ON CONFLICT (news_id) DO UPDATE SET body = EXCLUDED.body
+    WHERE article_bodies.body IS DISTINCT FROM EXCLUDED.body
+""")
+
+# Секции news, существование которых уже проверено этим процессом
+_news_partitions = set()
+
+
+def add_months(month_start, months):
+    """Shifts the first day of a month by months."""
+    year, month = divmod(month_start.month - 1 + months, 12)
+    return month_start.replace(year=month_start.year + year, month=month + 1)
+
+
+def retention_cutoff(retention_months=STORAGE_RETENTION_MONTHS, now=None):
+    """
+    Начало самого старого хранимого месяца (UTC) или None, если статьи
+    хранятся бессрочно. Хранятся retention_months полных месяцев и текущий.
+    """
+    if retention_months <= 0:
+        return None
+    now = now or datetime.now(timezone.utc)
+    month_start = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    return add_months(month_start, -retention_months)
 
-            logger.info("Database schema verified and ready.")
 
-    except Exception as e:
-        logger.error(f"Error ensuring database schema: {str(e)}",
-                     exc_info=True)
-        raise
+def news_partition_name(ts):
+    """Name of the news partition holding articles published at ts (UTC month)."""
+    return 'news_' + ts.astimezone(timezone.utc).strftime('%Y_%m')
 
 
-async def init_db(pool):
-    """Initializes the database schema and fixes any embedding format issues."""
-    try:
-        await ensure_database_schema(pool)
-    except Exception as e:
-        logger.error(f"Ошибка при инициализации базы данных: {e}",
-                     exc_info=True)
-        raise
+async def ensure_news_partition(conn, ts):
+    """Creates the monthly news partition for ts if it does not exist yet."""
+    name = news_partition_name(ts)
+    if name not in _news_partitions:
+        await conn.execute("SELECT create_news_partition($1)", ts)
+        # Внутри транзакции секция может исчезнуть при откате — в кэш
+        # попадают только закоммиченные секции
+        if not conn.is_in_transaction():
+            _news_partitions.add(name)
+
+
+async def ensure_news_partitions(pool, months_ahead=STORAGE_PARTITIONS_AHEAD):
+    """Creates partitions for the current month and months_ahead next ones."""
+    now = datetime.now(timezone.utc)
+    async with pool.acquire() as conn:
+        for offset in range(months_ahead + 1):
+            year, month = divmod(now.month - 1 + offset, 12)
+            await ensure_news_partition(
+                conn, datetime(now.year + year, month + 1, 1, tzinfo=timezone.utc))
+
+
+def forget_news_partition(name):
+    """Drops a partition from the cache after it was removed by retention."""
+    _news_partitions.discard(name)
 
 
 async def save_article(pool, title, link, description, source, tags,
@@ -144,39 +216,40 @@ async def save_article(pool, title, link, description, source, tags,
         pool: Database connection pool
         title: Article title
         link: Article URL (unique)
-        description: Article description/content
+        description: Article description/content; stored in article_bodies,
+            news keeps a plain-text snippet of it
         source: Source of the article
         tags: List of tags
         published: Optional publication timestamp (defaults to current time if None)
+
+    An existing article with the same link keeps its id and publication date.
+    Articles published before retention_cutoff() are not saved: their
+    partition was dropped by retention and would only be dropped again.
     """
+    if published is None:
+        published = datetime.now(timezone.utc)
+    cutoff = retention_cutoff()
+    if cutoff is not None and published.astimezone(timezone.utc) < cutoff:
+        logger.info(f"Статья старше срока хранения не сохранена: {link}")
+        return
     try:
         async with pool.acquire() as conn:
-            if published is None:
-                # If published date is not provided, use current timestamp
-                await conn.execute("""
-                    INSERT INTO news (title, link, description, source, tags, published)
-                    VALUES ($1, $2, $3, $4, $5, CURRENT_TIMESTAMP)
-                    ON CONFLICT (link) 
-                    DO UPDATE SET 
-                        title = EXCLUDED.title,
-                        description = EXCLUDED.description,
-                        source = EXCLUDED.source,
-                        tags = EXCLUDED.tags,
-                        published = COALESCE(news.published, EXCLUDED.published)
-                """, title, link, description, source, tags)
-            else:
-                # If published date is provided, use it
-                await conn.execute("""
-                    INSERT INTO news (title, link, description, source, tags, published)
-                    VALUES ($1, $2, $3, $4, $5, $6)
-                    ON CONFLICT (link) 
-                    DO UPDATE SET 
-                        title = EXCLUDED.title,
-                        description = EXCLUDED.description,
-                        source = EXCLUDED.source,
-                        tags = EXCLUDED.tags,
-                        published = COALESCE(news.published, EXCLUDED.published)
-                """, title, link, description, source, tags, published)
+            # Секция создается вне транзакции статьи: ошибка вставки не
+            # откатит ее создание
+            await ensure_news_partition(conn, published)
+            async with conn.transaction():
+                # Ссылку ищем по всем секциям; одновременные сохранения одной
+                # ссылки выполняются по очереди
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", link)
+                news_id = await queries.fetchval(conn, SAVE_ARTICLE_UPDATE, link, title,
+                                                 description, source, tags,
+                                                 STORAGE_SNIPPET_CHARS)
+                if news_id is None:
+                    news_id = await queries.fetchval(conn, SAVE_ARTICLE_INSERT, title,
+                                                     link, description, source, tags,
+                                                     published, STORAGE_SNIPPET_CHARS)
+                if description is not None:
+                    await queries.fetchval(conn, SAVE_ARTICLE_BODY, news_id, description)
     except Exception as e:
         logger.error(f"Error saving article: {str(e)}", exc_info=True)
         raise
@@ -191,17 +264,78 @@ async def get_articles_without_embeddings(pool):
     """
     async with pool.acquire() as conn:
         return await conn.fetch("""
-            SELECT n.link, n.title, n.description, n.published 
+            SELECT n.id, n.link, n.title,
+                   COALESCE(b.body, n.description) AS description, n.published
             FROM news n
-            LEFT JOIN article_embeddings ae ON n.link = ae.article_id
-            WHERE ae.article_id IS NULL
+            LEFT JOIN article_bodies b ON b.news_id = n.id
+            LEFT JOIN article_embeddings ae ON ae.news_id = n.id
+            WHERE ae.news_id IS NULL
             ORDER BY n.published DESC;
         """)
 
 
-async def add_embedding(pool, article_id, embedding):
+async def iter_articles_without_embeddings(pool, batch_size=256,
+                                           max_chars=2000, min_id=None,
+                                           max_id=None,
+                                           table=ACTIVE_EMBEDDINGS_TABLE):
+    """
+    Streams articles that do not have an embedding yet in bounded batches.
+
+    Uses keyset pagination on news.id, so each page is a short indexed query
+    and no connection is held between pages. Only the columns needed for
+    embedding are selected, and the description (the full article body)
+    is truncated on the database side.
+
+    Args:
+        pool: Database connection pool
+        batch_size: Maximum number of rows per yielded batch
+        max_chars: Maximum description length returned by the query
+        min_id: Optional lower bound for news.id (inclusive)
+        max_id: Optional upper bound for news.id (inclusive)
+        table: Embeddings table to check against (one of EMBEDDING_TABLES)
+
+    Yields:
+        Lists of records (id, link, title, description, published)
+    """
+    _check_embeddings_table(table)
+    last_id = max_id + 1 if max_id is not None else None
+    while True:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(f"""
+                SELECT n.id, n.link, n.title,
+                       LEFT(COALESCE(b.body, n.description), $1) AS description,
+                       n.published
+                FROM news n
+                LEFT JOIN article_bodies b ON b.news_id = n.id
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {table} ae
+                    WHERE ae.news_id = n.id
+                )
+                AND ($2::int IS NULL OR n.id < $2::int)
+                AND ($4::int IS NULL OR n.id >= $4::int)
+                ORDER BY n.id DESC
+                LIMIT $3
+            """, max_chars, last_id, batch_size, min_id)
+
+        if not rows:
+            return
+
+        yield rows
+
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['id']
+
+
+async def add_embedding(pool, news_id, embedding, model_id,
+                        content_hash=None, table=ACTIVE_EMBEDDINGS_TABLE):
     """
     Добавляет или обновляет эмбеддинг для статьи в правильном формате [1.0, 2.0, 3.0].
+
+    Размерность проверяется типом колонки. Эмбеддинг записывается, только
+    если model_id все еще соответствует таблице (активная или строящаяся
+    модель), поэтому векторы старой модели не попадут в таблицу после
+    переключения.
     """
     try:
         # Проверяем, что embedding - это список чисел
@@ -211,60 +345,495 @@ async def add_embedding(pool, article_id, embedding):
 
         # Убедимся, что все элементы - числа
         embedding_list = [float(x) for x in embedding]
-        if len(embedding_list) != 384:
-            raise ValueError(
-                f"Эмбеддинг должен содержать 384 числа, получено: {len(embedding_list)}")
 
         async with pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO article_embeddings (article_id, embedding)
-                VALUES ($1, $2::vector(384))
-                ON CONFLICT (article_id) 
-                DO UPDATE SET embedding = EXCLUDED.embedding
-            """, article_id, embedding_list)
-            logger.debug(f"Успешно сохранен эмбеддинг для статьи {article_id}")
+            args = (news_id, embedding_list, content_hash, model_id,
+                    EMBEDDING_TABLES[table])
+            if table == ACTIVE_EMBEDDINGS_TABLE:
+                await queries.fetchval(conn, ADD_EMBEDDING, *args)
+            else:
+                # Строящейся таблицы может не быть, заранее ее не подготовить
+                await conn.execute(_upsert_embedding_sql(table), *args)
+            logger.debug(f"Успешно сохранен эмбеддинг для статьи {news_id}")
     except Exception as e:
         logger.error(
-            f"Ошибка при сохранении эмбеддинга для статьи {article_id}: {e}",
+            f"Ошибка при сохранении эмбеддинга для статьи {news_id}: {e}",
             exc_info=True)
         raise
 
 
-async def fix_existing_embeddings(pool):
-    """Исправляет формат существующих эмбеддингов в базе данных."""
-    try:
-        async with pool.acquire() as conn:
-            # Проверяем, есть ли эмбеддинги в неправильном формате
-            count = await conn.fetchval("""
-                SELECT COUNT(*) FROM article_embeddings 
-                WHERE embedding::text LIKE '{%}';
-            """)
+async def get_pending_embedding_ranges(pool, shards,
+                                       table=ACTIVE_EMBEDDINGS_TABLE):
+    """
+    Splits articles without embeddings into id ranges of roughly equal size.
 
-            if count == 0:
-                logger.info("Нет эмбеддингов в неправильном формате.")
-                return 0
+    Args:
+        pool: Database connection pool
+        shards: Number of ranges to produce
+        table: Embeddings table to check against (one of EMBEDDING_TABLES)
+
+    Returns:
+        List of records (min_id, max_id, pending), ordered by id
+    """
+    _check_embeddings_table(table)
+    async with pool.acquire() as conn:
+        return await conn.fetch(f"""
+            SELECT MIN(id) AS min_id, MAX(id) AS max_id, COUNT(*) AS pending
+            FROM (
+                SELECT n.id, ntile($1) OVER (ORDER BY n.id) AS shard
+                FROM news n
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {table} ae
+                    WHERE ae.news_id = n.id
+                )
+            ) pending
+            GROUP BY shard
+            ORDER BY shard
+        """, shards)
+
+
+def _check_embeddings_table(table):
+    if table not in EMBEDDING_TABLES:
+        raise ValueError(f"Неизвестная таблица эмбеддингов: {table}")
+
+
+def _upsert_embedding_sql(table):
+    _check_embeddings_table(table)
+    return f"""
+        INSERT INTO {table} (news_id, embedding, content_hash, model_id)
+        SELECT $1, $2::vector, $3, $4
+        WHERE EXISTS (
+            SELECT 1 FROM embedding_models
+            WHERE model_id = $4 AND status = $5
+        )
+        -- Статья могла быть удалена вместе с секцией, пока считался вектор
+          AND EXISTS (SELECT 1 FROM news WHERE id = $1)
+        ON CONFLICT (news_id) 
+        DO UPDATE SET embedding = EXCLUDED.embedding,
+                      content_hash = EXCLUDED.content_hash,
+                      model_id = EXCLUDED.model_id,
+                      updated_at = CURRENT_TIMESTAMP
+    """
+
+
+ADD_EMBEDDING = statement(
+    'add_embedding', _upsert_embedding_sql(ACTIVE_EMBEDDINGS_TABLE) + " RETURNING news_id")
+
+
+async def add_embeddings_bulk(pool, items, model_id,
+                              table=ACTIVE_EMBEDDINGS_TABLE):
+    """
+    Сохраняет эмбеддинги для нескольких статей одним пакетным запросом.
+
+    Args:
+        pool: Database connection pool
+        items: Список кортежей (news_id, embedding, content_hash)
+        model_id: Модель, которой посчитаны эмбеддинги
+        table: Таблица эмбеддингов (одна из EMBEDDING_TABLES)
+    """
+    status = EMBEDDING_TABLES[table]
+    rows = [(news_id, [float(x) for x in embedding], content_hash,
+             model_id, status)
+            for news_id, embedding, content_hash in items]
+
+    if not rows:
+        return
+
+    async with pool.acquire() as conn:
+        await conn.executemany(_upsert_embedding_sql(table), rows)
+    logger.debug(f"Сохранено {len(rows)} эмбеддингов одним пакетом")
+
+
+async def import_embeddings_bulk(pool, ids, vectors, model_id,
+                                 chunk_size=50000):
+    """
+    Загружает готовые векторы активной модели в article_embeddings через COPY.
+
+    Векторы статей, которых нет в news, пропускаются. content_hash у новых
+    строк остается пустым, у существующих не меняется.
+
+    Args:
+        pool: Database connection pool
+        ids: news.id статей
+        vectors: Матрица эмбеддингов (N, dim)
+        model_id: Модель, которой посчитаны векторы (должна быть активной)
+
+    Returns:
+        Количество записанных строк
+    """
+    written = 0
+    async with pool.acquire() as conn:
+        for start in range(0, len(ids), chunk_size):
+            records = [(int(news_id), vector) for news_id, vector in
+                       zip(ids[start:start + chunk_size],
+                           vectors[start:start + chunk_size])]
+            async with conn.transaction():
+                await conn.execute("""
+                    CREATE TEMP TABLE embeddings_import (
+                        news_id INTEGER, embedding vector
+                    ) ON COMMIT DROP
+                """)
+                await conn.copy_records_to_table(
+                    'embeddings_import', records=records,
+                    columns=['news_id', 'embedding'])
+                result = await conn.execute(f"""
+                    INSERT INTO {ACTIVE_EMBEDDINGS_TABLE} (news_id, embedding, model_id)
+                    SELECT i.news_id, i.embedding, $1
+                    FROM embeddings_import i
+                    JOIN news n ON n.id = i.news_id
+                    WHERE EXISTS (SELECT 1 FROM embedding_models
+                                  WHERE model_id = $1 AND status = 'active')
+                    ON CONFLICT (news_id)
+                    DO UPDATE SET embedding = EXCLUDED.embedding,
+                                  model_id = EXCLUDED.model_id,
+                                  updated_at = CURRENT_TIMESTAMP
+                """, model_id)
+            written += int(result.split()[-1])
+    logger.info(f"Импортировано {written} эмбеддингов модели {model_id}")
+    return written
+
+
+async def get_embeddings_by_hash(pool, hashes, model_id,
+                                 table=ACTIVE_EMBEDDINGS_TABLE):
+    """
+    Ищет уже посчитанные эмбеддинги по хэшам текста.
+
+    Args:
+        pool: Database connection pool
+        hashes: Список хэшей нормализованного текста
+        model_id: Учитываются только векторы этой модели
+        table: Таблица эмбеддингов (одна из EMBEDDING_TABLES)
+
+    Returns:
+        Словарь {content_hash: embedding} для найденных хэшей
+    """
+    _check_embeddings_table(table)
+    if not hashes:
+        return {}
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(f"""
+            SELECT DISTINCT ON (content_hash) content_hash, embedding
+            FROM {table}
+            WHERE content_hash = ANY($1::text[]) AND model_id = $2
+        """, hashes, model_id)
+    return {row['content_hash']: row['embedding'] for row in rows}
+
+
+async def get_embedding_models(pool):
+    """Returns registered embedding models keyed by status."""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT model_id, dim, status, created_at, activated_at
+            FROM embedding_models
+            WHERE status IN ('active', 'building')
+        """)
+    return {row['status']: row for row in rows}
 
-            logger.info(
-                f"Найдено {count} эмбеддингов в неправильном формате, исправляем...")
 
-            # Обновляем формат эмбеддингов
+async def register_active_embedding_model(pool, model_id, dim):
+    """
+    Регистрирует модель существующих эмбеддингов как активную.
+
+    Используется при первом запуске: все векторы без model_id помечаются
+    как посчитанные этой моделью.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
             await conn.execute("""
-                UPDATE article_embeddings 
-                SET embedding = REPLACE(REPLACE(embedding::text, '{', '['), '}', ']')::vector(384)
-                WHERE embedding::text LIKE '{%}';
+                INSERT INTO embedding_models (model_id, dim, status, activated_at)
+                VALUES ($1, $2, 'active', CURRENT_TIMESTAMP)
+                ON CONFLICT (model_id) DO NOTHING
+            """, model_id, dim)
+            await conn.execute(
+                "UPDATE article_embeddings SET model_id = $1 WHERE model_id IS NULL",
+                model_id)
+    logger.info(f"Активная модель эмбеддингов: {model_id} ({dim})")
+
+
+async def start_embedding_migration(pool, model_id, dim):
+    """
+    Начинает фоновую миграцию эмбеддингов на новую модель.
+
+    Создает таблицу article_embeddings_next с колонкой нужной размерности.
+    Повторный вызов для той же модели ничего не меняет, поэтому миграция
+    продолжается после перезапуска.
+    """
+    dim = int(dim)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            models = {row['status']: row['model_id'] for row in await conn.fetch(
+                "SELECT model_id, status FROM embedding_models WHERE status IN ('active', 'building')")}
+            if models.get('active') == model_id:
+                raise ValueError(f"Модель {model_id} уже активна")
+            if models.get('building') not in (None, model_id):
+                raise ValueError(
+                    f"Уже идет миграция на модель {models['building']}")
+
+            await conn.execute("""
+                INSERT INTO embedding_models (model_id, dim, status)
+                VALUES ($1, $2, 'building')
+                ON CONFLICT (model_id) DO UPDATE SET status = 'building', dim = $2
+                WHERE embedding_models.status = 'retired'
+            """, model_id, dim)
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {NEXT_EMBEDDINGS_TABLE} (
+                    news_id INTEGER PRIMARY KEY,
+                    embedding vector({dim}) NOT NULL,
+                    content_hash TEXT,
+                    model_id TEXT
+                );
+                ALTER TABLE {NEXT_EMBEDDINGS_TABLE} ADD COLUMN IF NOT EXISTS updated_at
+                    TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+                CREATE INDEX IF NOT EXISTS idx_article_embeddings_next_content_hash
+                    ON {NEXT_EMBEDDINGS_TABLE} (content_hash);
+                CREATE INDEX IF NOT EXISTS idx_article_embeddings_next_updated_at
+                    ON {NEXT_EMBEDDINGS_TABLE} (updated_at);
             """)
+    logger.info(f"Миграция эмбеддингов на модель {model_id} ({dim}) запущена")
 
-            logger.info(f"Успешно исправлено {count} эмбеддингов.")
-            return count
 
-    except Exception as e:
-        logger.error(f"Ошибка при исправлении формата эмбеддингов: {e}",
-                     exc_info=True)
-        raise
+async def get_embedding_migration_status(pool, exact=True):
+    """
+    Returns progress of the running embedding migration.
+
+    Coverage is measured against the active table: the migration is complete
+    when every article embedded by the active model also has a new vector.
+
+    Args:
+        exact: Count coverage with a join over both tables; otherwise use
+            the planner's row estimates of the two tables (for the admin
+            panel)
+
+    Returns:
+        Dict with model_id, dim, total, done and missing counts,
+        or None if no migration is running
+    """
+    models = await get_embedding_models(pool)
+    building = models.get('building')
+    if not building:
+        return None
+
+    async with pool.acquire() as conn:
+        if exact:
+            row = await conn.fetchrow(f"""
+                SELECT COUNT(*) AS total,
+                       COUNT(nxt.news_id) AS done
+                FROM article_embeddings ae
+                LEFT JOIN {NEXT_EMBEDDINGS_TABLE} nxt ON nxt.news_id = ae.news_id
+            """)
+        else:
+            row = await conn.fetchrow("""
+                SELECT (SELECT GREATEST(reltuples, 0)::bigint FROM pg_class
+                        WHERE oid = to_regclass($1)) AS total,
+                       (SELECT GREATEST(reltuples, 0)::bigint FROM pg_class
+                        WHERE oid = to_regclass($2)) AS done
+            """, ACTIVE_EMBEDDINGS_TABLE, NEXT_EMBEDDINGS_TABLE)
+            row = {'total': row['total'] or 0,
+                   'done': min(row['done'] or 0, row['total'] or 0)}
+    return {
+        'model_id': building['model_id'],
+        'dim': building['dim'],
+        'total': row['total'],
+        'done': row['done'],
+        'missing': row['total'] - row['done'],
+    }
+
+
+async def cutover_embedding_model(pool):
+    """
+    Атомарно переключает поиск на эмбеддинги новой модели.
+
+    В одной транзакции проверяет полноту покрытия, удаляет старые векторы,
+    переименовывает article_embeddings_next в article_embeddings и меняет
+    статусы моделей. Если покрытие неполное, ничего не меняет.
+
+    Returns:
+        model_id новой активной модели или None, если переключение не выполнено
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            building = await conn.fetchval(
+                "SELECT model_id FROM embedding_models WHERE status = 'building'")
+            if not building:
+                return None
+
+            await conn.execute(f"""
+                LOCK TABLE article_embeddings, {NEXT_EMBEDDINGS_TABLE}
+                IN ACCESS EXCLUSIVE MODE
+            """)
+            missing = await conn.fetchval(f"""
+                SELECT COUNT(*) FROM article_embeddings ae
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {NEXT_EMBEDDINGS_TABLE} nxt
+                    WHERE nxt.news_id = ae.news_id
+                )
+            """)
+            if missing:
+                logger.info(f"Переключение отложено: не хватает {missing} эмбеддингов")
+                return None
+
+            await conn.execute(f"""
+                DROP TABLE article_embeddings;
+                ALTER TABLE {NEXT_EMBEDDINGS_TABLE} RENAME TO article_embeddings;
+                ALTER TABLE article_embeddings
+                    RENAME CONSTRAINT {NEXT_EMBEDDINGS_TABLE}_pkey TO article_embeddings_pkey;
+                ALTER INDEX idx_article_embeddings_next_content_hash
+                    RENAME TO idx_article_embeddings_content_hash;
+                ALTER INDEX idx_article_embeddings_next_updated_at
+                    RENAME TO idx_article_embeddings_updated_at;
+                ALTER INDEX IF EXISTS {vector_index_name(NEXT_EMBEDDINGS_TABLE, 'hnsw')}
+                    RENAME TO {vector_index_name(ACTIVE_EMBEDDINGS_TABLE, 'hnsw')};
+                ALTER INDEX IF EXISTS {vector_index_name(NEXT_EMBEDDINGS_TABLE, 'ivfflat')}
+                    RENAME TO {vector_index_name(ACTIVE_EMBEDDINGS_TABLE, 'ivfflat')};
+                UPDATE embedding_models SET status = 'retired' WHERE status = 'active';
+                UPDATE embedding_models
+                SET status = 'active', activated_at = CURRENT_TIMESTAMP
+                WHERE status = 'building';
+            """)
+            if STATS_EXACT_COUNTS:
+                # Триггеры счетчика остались на удаленной таблице
+                await _install_row_counter(conn, ACTIVE_EMBEDDINGS_TABLE)
+    logger.info(f"Поиск переключен на эмбеддинги модели {building}")
+    return building
+
+
+def vector_index_name(table, method):
+    return f"idx_{table}_embedding_{method}"
+
+
+async def ensure_vector_index(pool, table=ACTIVE_EMBEDDINGS_TABLE,
+                              method=VECTOR_INDEX_METHOD, rebuild=False):
+    """
+    Создает ANN-индекс pgvector по косинусному расстоянию для таблицы эмбеддингов.
+
+    Индекс строится через CREATE INDEX CONCURRENTLY, поэтому поиск и запись
+    эмбеддингов не блокируются. Индексы другого метода удаляются после
+    построения нового.
+
+    Args:
+        pool: Database connection pool
+        table: Таблица эмбеддингов (одна из EMBEDDING_TABLES)
+        method: 'hnsw', 'ivfflat' или 'none' (без индекса)
+        rebuild: Пересоздать индекс, например после смены параметров
+    """
+    _check_embeddings_table(table)
+    if method not in VECTOR_INDEX_METHODS + ('none',):
+        raise ValueError(f"Неизвестный метод индекса: {method}")
+
+    if method == 'hnsw':
+        options = (f"WITH (m = {int(VECTOR_INDEX_M)}, "
+                   f"ef_construction = {int(VECTOR_INDEX_EF_CONSTRUCTION)})")
+    else:
+        options = f"WITH (lists = {int(VECTOR_INDEX_LISTS)})"
+
+    async with pool.acquire() as conn:
+        # Обычно индекс уже такой, как нужно: одна проверка по каталогу
+        existing = {row['relname'] for row in await conn.fetch(
+            "SELECT relname FROM pg_class WHERE relname = ANY($1::text[])",
+            [vector_index_name(table, other) for other in VECTOR_INDEX_METHODS])}
+        wanted = {vector_index_name(table, method)} if method != 'none' else set()
+        if existing == wanted and not rebuild:
+            return
+
+        if method != 'none':
+            name = vector_index_name(table, method)
+            if rebuild:
+                await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            # Для построения индекса таймаут запросов не применяется
+            timeout = await conn.fetchval("SHOW statement_timeout")
+            await conn.execute("SET statement_timeout = 0")
+            try:
+                await conn.execute(f"""
+                    CREATE INDEX CONCURRENTLY IF NOT EXISTS {name}
+                    ON {table} USING {method} (embedding vector_cosine_ops)
+                    {options}
+                """, timeout=INDEX_BUILD_TIMEOUT)
+            finally:
+                await conn.execute(
+                    "SELECT set_config('statement_timeout', $1, false)", timeout)
+            logger.info(f"Векторный индекс {name} готов")
+
+        for other in VECTOR_INDEX_METHODS:
+            if other != method:
+                await conn.execute(
+                    f"DROP INDEX CONCURRENTLY IF EXISTS {vector_index_name(table, other)}")
+
+
+async def _set_vector_search_params(conn, limit, ef_search=None, probes=None):
+    """Задает параметры ANN-поиска для текущей транзакции."""
+    ef_search = max(int(ef_search or VECTOR_SEARCH_EF_SEARCH), int(limit))
+    probes = int(probes or VECTOR_SEARCH_PROBES)
+    await conn.execute(f"SET LOCAL hnsw.ef_search = {ef_search}")
+    await conn.execute(f"SET LOCAL ivfflat.probes = {probes}")
+
+
+async def iter_embeddings(pool, batch_size=10000):
+    """
+    Streams all active embeddings with their publication time.
+
+    Uses keyset pagination on news_id, so memory use is bounded by batch_size.
+
+    Yields:
+        Lists of records (news_id, embedding, published, updated_at)
+    """
+    last_id = 0
+    while True:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT ae.news_id, ae.embedding, n.published, ae.updated_at
+                FROM article_embeddings ae
+                JOIN news n ON n.id = ae.news_id
+                WHERE ae.news_id > $1
+                ORDER BY ae.news_id
+                LIMIT $2
+            """, last_id, batch_size)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['news_id']
+
+
+async def get_embeddings_since(pool, since):
+    """
+    Returns active embeddings written after the given time.
+
+    Args:
+        pool: Database connection pool
+        since: Timestamp (exclusive lower bound on updated_at)
+
+    Returns:
+        List of records (news_id, embedding, published, updated_at)
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT ae.news_id, ae.embedding, n.published, ae.updated_at
+            FROM article_embeddings ae
+            JOIN news n ON n.id = ae.news_id
+            WHERE ae.updated_at > $1
+            ORDER BY ae.updated_at
+        """, since)
+
+
+SIMILAR_ARTICLES_SQL = """
+    SELECT n.id, n.title, n.description, n.link,
+           n.source, n.tags, n.published,
+           1 - (ae.embedding <=> $1) as similarity
+    FROM article_embeddings ae
+    JOIN news n ON ae.news_id = n.id
+    WHERE TRUE {filter}
+    ORDER BY ae.embedding <=> $1
+    LIMIT $2
+"""
+SIMILAR_ARTICLES = statement('similar_articles',
+                             SIMILAR_ARTICLES_SQL.format(filter=''))
 
 
 async def find_similar_articles(pool, embedding, limit=5, start_date=None,
-                                end_date=None):
+                                end_date=None, ef_search=None, probes=None,
+                                text_query=None, tags=None, sources=None,
+                                exclude_published=False):
     """
     Finds articles with embeddings similar to the given one, optionally filtered by date range.
 
@@ -274,63 +843,429 @@ async def find_similar_articles(pool, embedding, limit=5, start_date=None,
         limit: Maximum number of results to return
         start_date: Optional start date for filtering articles (inclusive)
         end_date: Optional end date for filtering articles (inclusive)
+        ef_search: HNSW search width (higher is more accurate, slower)
+        probes: IVFFlat lists to scan (higher is more accurate, slower)
+        text_query: Optional full-text query; only articles matching it are
+            ranked by similarity (lexical prefiltering)
+        tags: Optional list of tags; articles must have at least one of them
+        sources: Optional list of source names to restrict the search to
+        exclude_published: Skip articles already in published_links; the
+            limit applies to the remaining articles
 
     Returns:
         List of similar articles with their similarity scores
     """
     try:
-        query = """
-            SELECT ae.article_id, n.title, n.description, n.link,
-                   n.source, n.tags, n.published,
-                   1 - (ae.embedding <=> $1) as similarity
-            FROM article_embeddings ae
-            JOIN news n ON ae.article_id = n.link
-            WHERE 1=1
-        """
+        # Add date, full-text, tag, source and published filtering if provided
+        filters = dict(start_date=start_date, end_date=end_date,
+                       text_query=text_query, tags=tags, sources=sources,
+                       exclude_published=exclude_published)
+        news_filter, filter_params = _news_filter(3, **filters)
 
-        params = [embedding]
-        param_count = 1  # Start from 1 because $1 is already used for embedding
+        async with pool.acquire() as conn:
+            if news_filter:
+                # Набор фильтров переменный; тексты запросов собираются из
+                # фиксированных фрагментов, их планы кэширует asyncpg
+                query = SIMILAR_ARTICLES_SQL.format(filter=news_filter)
+                params = [embedding, limit] + filter_params
+                return await queries.timed(
+                    'similar_articles_filtered',
+                    _filtered_vector_search(conn, query, params, limit, filters,
+                                            ef_search, probes))
+
+            async with conn.transaction():
+                await _set_vector_search_params(conn, limit, ef_search, probes)
+                return await queries.fetch(conn, SIMILAR_ARTICLES, embedding, limit)
 
-        # Add date filtering if dates are provided
-        if start_date:
-            param_count += 1
-            query += f" AND n.published >= ${param_count}::timestamptz"
-            params.append(start_date)
+    except Exception as e:
+        logger.error(f"Error finding similar articles: {str(e)}",
+                     exc_info=True)
+        return []
 
-        if end_date:
-            param_count += 1
-            # Add one day to end_date to include the entire end day
-            query += f" AND n.published < (${param_count}::date + interval '1 day')::timestamptz"
-            params.append(end_date)
 
-        # Add ordering and limit
-        query += " ORDER BY ae.embedding <=> $1"
-        param_count += 1
-        query += f" LIMIT ${param_count}"
-        params.append(limit)
+# Запрос пользователя разбирается обеими конфигурациями, как и search_tsv
+TSQUERY_SQL = ("(websearch_to_tsquery('russian', ${0}) || "
+               "websearch_to_tsquery('english', ${0}))")
+
+
+def _news_filter(first_param, start_date=None, end_date=None, text_query=None,
+                 tags=None, sources=None, exclude_published=False):
+    """Builds conditions on news n (published window, full-text match, tags, source,
+    not yet posted) and their parameters."""
+    query = ""
+    params = []
+    if start_date:
+        params.append(start_date)
+        query += f" AND n.published >= ${first_param + len(params) - 1}::timestamptz"
+    if end_date:
+        params.append(end_date)
+        # Add one day to end_date to include the entire end day
+        query += f" AND n.published < (${first_param + len(params) - 1}::date + interval '1 day')::timestamptz"
+    if text_query:
+        params.append(text_query)
+        query += " AND n.search_tsv @@ " + TSQUERY_SQL.format(
+            first_param + len(params) - 1)
+    if tags:
+        params.append(list(tags))
+        query += f" AND n.tags && ${first_param + len(params) - 1}::text[]"
+    if sources:
+        params.append(list(sources))
+        query += f" AND n.source = ANY(${first_param + len(params) - 1}::text[])"
+    if exclude_published:
+        # Анти-join по первичному ключу published_links
+        query += " AND NOT EXISTS (SELECT 1 FROM published_links pl WHERE pl.link = n.link)"
+    return query, params
+
+
+async def _estimate_filtered_rows(conn, filters):
+    """Returns the planner's estimate of news rows matching the filters."""
+    news_filter, filter_params = _news_filter(1, **filters)
+    plan = await conn.fetchval(
+        f"EXPLAIN (FORMAT JSON) SELECT 1 FROM news n WHERE 1=1 {news_filter}",
+        *filter_params)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+async def _filtered_vector_search(conn, query, params, limit, filters,
+                                  ef_search=None, probes=None):
+    """
+    Vector search restricted by conditions on news (date window, text match,
+    tags, source, not yet published).
+
+    pgvector applies these filters after the ANN index scan, so a selective
+    filter can leave fewer than `limit` rows. Selective filters are therefore
+    searched exactly (the candidates come from the news indexes), while broad
+    ones use the ANN index with a search width scaled by the filter's
+    selectivity, widening it until enough rows are found and falling back to
+    an exact scan as a last resort.
+    """
+    window_rows = await _estimate_filtered_rows(conn, filters)
+
+    if window_rows > VECTOR_SEARCH_EXACT_MAX_ROWS:
+        total_rows = await conn.fetchval(
+            "SELECT GREATEST(reltuples::bigint, 1) FROM pg_class WHERE oid = 'news'::regclass")
+        selectivity = min(1.0, max(window_rows, 1) / total_rows)
+        ef = max(int(ef_search or VECTOR_SEARCH_EF_SEARCH),
+                 int(limit / selectivity * 2))
+        probe_count = max(int(probes or VECTOR_SEARCH_PROBES),
+                          int(VECTOR_SEARCH_PROBES / selectivity))
+
+        while True:
+            ef = min(ef, VECTOR_SEARCH_MAX_EF_SEARCH)
+            probe_count = min(probe_count, VECTOR_INDEX_LISTS)
+            async with conn.transaction():
+                await _set_vector_search_params(conn, limit, ef, probe_count)
+                rows = await conn.fetch(query, *params)
+            if len(rows) >= limit:
+                return rows
+            # Ширину поиска задает только параметр текущего индекса
+            # (без индекса поиск и так точный)
+            if VECTOR_INDEX_METHOD == 'hnsw':
+                exhausted = ef >= VECTOR_SEARCH_MAX_EF_SEARCH
+            elif VECTOR_INDEX_METHOD == 'ivfflat':
+                exhausted = probe_count >= VECTOR_INDEX_LISTS
+            else:
+                exhausted = True
+            if exhausted:
+                break
+            ef *= 2
+            probe_count *= 2
 
-        async with pool.acquire() as conn:
-            return await conn.fetch(query, *params)
+        logger.info(f"ANN-поиск с фильтром вернул {len(rows)} из {limit}, "
+                    f"выполняем точный поиск")
 
+    async with conn.transaction():
+        # Точный поиск: кандидаты отбираются по индексам news (bitmap scan),
+        # векторный индекс не используется
+        await conn.execute("SET LOCAL enable_indexscan = off")
+        return await conn.fetch(query, *params)
+
+
+async def find_articles_by_text(pool, text_query, limit=5, start_date=None,
+                                end_date=None, text_filter=None, tags=None,
+                                sources=None):
+    """
+    Full-text search over news titles and descriptions.
+
+    The query uses web search syntax ("quoted phrases", -exclusions, OR)
+    and is parsed with both Russian and English configurations. text_filter
+    is an additional full-text condition that does not affect ranking;
+    tags and sources restrict the search as in find_similar_articles.
+
+    Returns:
+        List of matching articles ranked by ts_rank_cd (column rank)
+    """
+    try:
+        news_filter, filter_params = _news_filter(
+            2, start_date=start_date, end_date=end_date, text_query=text_filter,
+            tags=tags, sources=sources)
+        query = f"""
+            SELECT n.id, n.title, n.description, n.link,
+                   n.source, n.tags, n.published,
+                   ts_rank_cd(n.search_tsv, q.query) AS rank
+            FROM news n, (SELECT {TSQUERY_SQL.format(1)} AS query) q
+            WHERE n.search_tsv @@ q.query {news_filter}
+            ORDER BY rank DESC, n.published DESC NULLS LAST
+            LIMIT ${len(filter_params) + 2}
+        """
+        async with pool.acquire() as conn:
+            return await conn.fetch(query, text_query, *filter_params, limit)
     except Exception as e:
-        logger.error(f"Error finding similar articles: {str(e)}",
-                     exc_info=True)
+        logger.error(f"Error in full-text search: {str(e)}", exc_info=True)
         return []
 
 
-async def get_db_status(pool):
-    """Gets the count of records in key tables."""
-    async with pool.acquire() as connection:
-        status = {}
-        for table in SAFE_TABLES:
-            try:
-                # Безопасный запрос с использованием белого списка таблиц
-                count = await connection.fetchval(
-                    f'SELECT COUNT(*) FROM {table};')
-                status[table] = count
-            except Exception as e:
-                status[table] = f"Error: {e}"
-        return status
+async def get_articles_by_ids(pool, ids):
+    """
+    Fetches articles by their news.id.
+
+    Returns:
+        List of records (id, title, description, link, source, tags, published)
+        in no particular order; missing ids are skipped
+    """
+    if not ids:
+        return []
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT id, title, description, link, source, tags, published
+            FROM news
+            WHERE id = ANY($1::int[])
+        """, list(ids))
+
+
+async def get_article_bodies(pool, ids):
+    """
+    Loads full article texts; news.description holds only a snippet.
+
+    Returns:
+        Dict {news_id: body}; articles without a stored body are missing
+    """
+    if not ids:
+        return {}
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT news_id, body FROM article_bodies WHERE news_id = ANY($1::int[])",
+            list(ids))
+    return {row['news_id']: row['body'] for row in rows}
+
+
+async def ensure_body_compression(pool, method=STORAGE_BODY_COMPRESSION):
+    """
+    Задает сжатие полных текстов статей (storage.body_compression).
+
+    lz4 и pglz — сжатие TOAST (lz4 требует PostgreSQL 14+ с поддержкой lz4),
+    none — хранение вне строки без сжатия. Настройка действует на тексты,
+    записанные после ее изменения.
+    """
+    if method not in BODY_COMPRESSION:
+        raise ValueError(f"Неизвестный метод сжатия: {method}")
+    compression, storage = BODY_COMPRESSION[method]
+    async with pool.acquire() as conn:
+        current = await conn.fetchrow("""
+            SELECT attcompression::text AS compression, attstorage::text AS storage
+            FROM pg_attribute
+            WHERE attrelid = 'article_bodies'::regclass AND attname = 'body'
+        """)
+        if current['compression'] == compression and current['storage'] == storage:
+            return
+        await conn.execute(f"""
+            ALTER TABLE article_bodies ALTER COLUMN body
+                SET STORAGE {'EXTERNAL' if method == 'none' else 'EXTENDED'};
+            ALTER TABLE article_bodies ALTER COLUMN body
+                SET COMPRESSION {'default' if method == 'none' else method};
+        """)
+        logger.info(f"Сжатие текстов статей: {method}")
+
+
+async def _install_row_counter(conn, table):
+    """Initializes the exact row counter of a table and its triggers."""
+    await conn.execute(f"LOCK TABLE {table} IN SHARE MODE")
+    await conn.execute(f"""
+        INSERT INTO table_row_counts (table_name, row_count)
+        SELECT '{table}', COUNT(*) FROM {table}
+        ON CONFLICT (table_name) DO UPDATE SET row_count = EXCLUDED.row_count;
+
+        DROP TRIGGER IF EXISTS {table}_count_insert ON {table};
+        DROP TRIGGER IF EXISTS {table}_count_delete ON {table};
+        DROP TRIGGER IF EXISTS {table}_count_truncate ON {table};
+        CREATE TRIGGER {table}_count_insert AFTER INSERT ON {table}
+            REFERENCING NEW TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION count_rows_insert();
+        CREATE TRIGGER {table}_count_delete AFTER DELETE ON {table}
+            REFERENCING OLD TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION count_rows_delete();
+        CREATE TRIGGER {table}_count_truncate AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION count_rows_truncate();
+    """)
+
+
+async def ensure_row_counters(pool):
+    """
+    Создает или удаляет точные счетчики строк (stats.exact_counts).
+
+    Счетчики обновляются statement-триггерами по transition-таблицам: одно
+    обновление счетчика на запрос, а не на строку.
+    """
+    async with pool.acquire() as conn:
+        state = await conn.fetchrow("""
+            SELECT to_regclass('table_row_counts') IS NOT NULL AS has_table,
+                   ARRAY(SELECT c.relname FROM pg_trigger t
+                         JOIN pg_class c ON c.oid = t.tgrelid
+                         WHERE t.tgname = c.relname || '_count_insert') AS counted
+        """)
+        counted = set(state['counted'])
+        if STATS_EXACT_COUNTS and counted >= set(COUNTED_TABLES):
+            return
+        if not STATS_EXACT_COUNTS and not counted and not state['has_table']:
+            return
+
+        async with conn.transaction():
+            if not STATS_EXACT_COUNTS:
+                for table in COUNTED_TABLES:
+                    await conn.execute(f"""
+                        DROP TRIGGER IF EXISTS {table}_count_insert ON {table};
+                        DROP TRIGGER IF EXISTS {table}_count_delete ON {table};
+                        DROP TRIGGER IF EXISTS {table}_count_truncate ON {table};
+                    """)
+                await conn.execute("DROP TABLE IF EXISTS table_row_counts")
+                return
+
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS table_row_counts (
+                    table_name TEXT PRIMARY KEY,
+                    row_count BIGINT NOT NULL
+                );
+
+                CREATE OR REPLACE FUNCTION count_rows_insert() RETURNS trigger AS $$
+                BEGIN
+                    UPDATE table_row_counts
+                    SET row_count = row_count + (SELECT COUNT(*) FROM changed_rows)
+                    WHERE table_name = TG_TABLE_NAME;
+                    RETURN NULL;
+                END $$ LANGUAGE plpgsql;
+
+                CREATE OR REPLACE FUNCTION count_rows_delete() RETURNS trigger AS $$
+                BEGIN
+                    UPDATE table_row_counts
+                    SET row_count = row_count - (SELECT COUNT(*) FROM changed_rows)
+                    WHERE table_name = TG_TABLE_NAME;
+                    RETURN NULL;
+                END $$ LANGUAGE plpgsql;
+
+                CREATE OR REPLACE FUNCTION count_rows_truncate() RETURNS trigger AS $$
+                BEGIN
+                    UPDATE table_row_counts SET row_count = 0
+                    WHERE table_name = TG_TABLE_NAME;
+                    RETURN NULL;
+                END $$ LANGUAGE plpgsql;
+            """)
+            for table in COUNTED_TABLES:
+                if table not in counted:
+                    await _install_row_counter(conn, table)
+                    logger.info(f"Включен точный счетчик строк для {table}")
+
+
+def _db_stats_sql():
+    """Builds the single statistics query (exact counters only if enabled)."""
+    exact = ("(SELECT row_count FROM table_row_counts rc WHERE rc.table_name = t.name)"
+             if STATS_EXACT_COUNTS else "NULL::bigint")
+    return f"""
+        WITH relations AS (
+            -- Таблица, а у секционированной (news) — ее секции
+            SELECT t.name, c.oid, c.relpages, c.reltuples
+            FROM unnest($1::text[]) t(name)
+            JOIN pg_class p ON p.oid = to_regclass(t.name)
+            JOIN pg_class c ON (c.oid = p.oid AND p.relkind <> 'p')
+                            OR c.oid IN (SELECT inhrelid FROM pg_inherits
+                                         WHERE inhparent = p.oid)
+        ),
+        tables AS (
+            SELECT t.name,
+                   -- Оценка планировщика: плотность строк по последнему ANALYZE,
+                   -- умноженная на текущий размер таблицы
+                   SUM(CASE WHEN r.relpages > 0 AND r.reltuples >= 0
+                            THEN (r.reltuples / r.relpages
+                                  * (pg_relation_size(r.oid) / current_setting('block_size')::int))::bigint
+                            ELSE COALESCE(s.n_live_tup, 0)
+                       END)::bigint AS estimate,
+                   {exact} AS exact,
+                   SUM(pg_total_relation_size(r.oid))::bigint AS size,
+                   SUM(s.n_dead_tup)::bigint AS dead_rows,
+                   MAX(GREATEST(s.last_analyze, s.last_autoanalyze)) AS last_analyze
+            FROM unnest($1::text[]) t(name)
+            JOIN relations r ON r.name = t.name
+            LEFT JOIN pg_stat_user_tables s ON s.relid = r.oid
+            GROUP BY t.name
+        ),
+        sources AS (
+            -- Частоты самых частых значений news.source из pg_stats
+            SELECT v.source, v.freq
+            FROM pg_stats ps,
+                 unnest(ps.most_common_vals::text::text[], ps.most_common_freqs)
+                     AS v(source, freq)
+            WHERE ps.schemaname = current_schema()
+              AND ps.tablename = 'news' AND ps.attname = 'source'
+        )
+        SELECT json_build_object(
+            'tables', (SELECT json_object_agg(name, json_build_object(
+                           'rows', COALESCE(exact, estimate),
+                           'exact', exact IS NOT NULL,
+                           'size', size,
+                           'dead_rows', dead_rows,
+                           'last_analyze', last_analyze))
+                       FROM tables),
+            'sources', (SELECT json_agg(json_build_object(
+                            'source', src.source,
+                            'articles', (src.freq * (SELECT COALESCE(exact, estimate)
+                                                     FROM tables WHERE name = 'news'))::bigint,
+                            'last_ingest', (SELECT MAX(n.created_at) FROM news n
+                                            WHERE n.source = src.source))
+                            ORDER BY src.freq DESC)
+                        FROM sources src),
+            'last_ingest', (SELECT created_at FROM news ORDER BY id DESC LIMIT 1)
+        )
+    """
+
+
+async def get_db_stats(pool):
+    """
+    Statistics for the admin panel in a single round-trip, without COUNT(*)
+    over the large tables.
+
+    Row counts are planner estimates (pg_class.reltuples scaled to the
+    current table size), or exact trigger-maintained counters when
+    stats.exact_counts is on. Per-source counts come from the news.source
+    column statistics, so sources outside its most common values are not
+    listed.
+
+    Returns:
+        Dict with keys:
+            tables: {table: {rows, exact, size, dead_rows, last_analyze}}
+            embedding_backlog: articles without an embedding
+            sources: [{source, articles, last_ingest}]
+            last_ingest: time the newest article was stored
+    """
+    async with pool.acquire() as conn:
+        stats = json.loads(await conn.fetchval(_db_stats_sql(), SAFE_TABLES))
+
+    tables = stats['tables'] or {}
+    for table in tables.values():
+        if table['last_analyze']:
+            table['last_analyze'] = datetime.fromisoformat(table['last_analyze'])
+    stats['tables'] = tables
+    stats['sources'] = stats['sources'] or []
+    for source in stats['sources']:
+        if source['last_ingest']:
+            source['last_ingest'] = datetime.fromisoformat(source['last_ingest'])
+    if stats['last_ingest']:
+        stats['last_ingest'] = datetime.fromisoformat(stats['last_ingest'])
+
+    news = tables.get('news', {}).get('rows', 0)
+    embeddings = tables.get(ACTIVE_EMBEDDINGS_TABLE, {}).get('rows', 0)
+    stats['embedding_backlog'] = max(news - embeddings, 0)
+    return stats
 
 
 async def get_admins(pool):
@@ -353,20 +1288,113 @@ async def remove_admin(pool, user_id):
         logger.info(f"Admin removed: {user_id}")
 
 
-async def get_setting(pool, key):
+LOAD_SETTINGS = statement('load_settings', "SELECT key, value FROM settings")
+GET_SETTING = statement('get_setting', "SELECT value FROM settings WHERE key = $1")
+
+
+async def _load_settings(pool):
+    """Loads all settings into the cache unless it was invalidated meanwhile."""
+    global _settings_cache
+    generation = _settings_generation
     async with pool.acquire() as conn:
-        return await conn.fetchval("SELECT value FROM settings WHERE key = $1",
-                                   key)
+        rows = await queries.fetch(conn, LOAD_SETTINGS)
+    settings = {row['key']: row['value'] for row in rows}
+    if generation == _settings_generation and _settings_listener is not None:
+        _settings_cache = settings
+    return settings
+
+
+def _invalidate_settings(*args):
+    """Drops the settings cache; the next read reloads it."""
+    global _settings_cache, _settings_generation
+    _settings_cache = None
+    _settings_generation += 1
+
+
+async def start_settings_listener(pool):
+    """
+    Enables the settings cache.
+
+    A dedicated connection LISTENs on SETTINGS_CHANNEL, so a setting changed
+    by any bot instance invalidates the cache everywhere. While the listener
+    is down, reads go straight to the database.
+    """
+    global _settings_listener
+    if _settings_listener is not None:
+        return
+    try:
+        conn = await asyncpg.connect(user=DB_USER, password=DB_PASSWORD,
+                                     host=DB_HOST, port=DB_PORT,
+                                     database=DB_NAME)
+        await conn.add_listener(SETTINGS_CHANNEL, _invalidate_settings)
+        conn.add_termination_listener(
+            lambda closed: _on_settings_listener_lost(pool, closed))
+    except Exception as e:
+        logger.error(f"Не удалось подписаться на изменения настроек: {e}")
+        _schedule_settings_listener(pool)
+        return
+    _invalidate_settings()
+    _settings_listener = conn
+    await _load_settings(pool)
+    logger.info("Кэш настроек включен")
+
+
+def _on_settings_listener_lost(pool, conn):
+    global _settings_listener
+    if conn is not _settings_listener:
+        # Соединение закрыто stop_settings_listener
+        return
+    _settings_listener = None
+    _invalidate_settings()
+    logger.warning("Соединение для LISTEN настроек потеряно, кэш отключен")
+    _schedule_settings_listener(pool)
+
+
+def _schedule_settings_listener(pool):
+    global _settings_reconnect_task
+    async def reconnect():
+        await asyncio.sleep(SETTINGS_LISTENER_RETRY)
+        await start_settings_listener(pool)
+    # Цикл событий хранит только слабую ссылку на задачу
+    _settings_reconnect_task = asyncio.get_running_loop().create_task(reconnect())
+
+
+async def stop_settings_listener():
+    global _settings_listener, _settings_reconnect_task
+    task, _settings_reconnect_task = _settings_reconnect_task, None
+    if task is not None and task is not asyncio.current_task():
+        task.cancel()
+    conn, _settings_listener = _settings_listener, None
+    _invalidate_settings()
+    if conn is not None:
+        await conn.remove_listener(SETTINGS_CHANNEL, _invalidate_settings)
+        await conn.close()
+
+
+async def get_setting(pool, key):
+    """Returns a setting value; served from memory while the cache is enabled."""
+    if _settings_listener is None:
+        async with pool.acquire() as conn:
+            return await queries.fetchval(conn, GET_SETTING, key)
+    settings = _settings_cache
+    if settings is None:
+        settings = await _load_settings(pool)
+    return settings.get(key)
 
 
 async def set_setting(pool, key, value):
+    """Writes a setting and notifies all bot instances to drop their cache."""
     async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO settings (key, value)
-            VALUES ($1, $2)
-            ON CONFLICT (key) DO UPDATE SET value = $2
-        """, key, value)
-        logger.info(f"Setting updated: {key} = {value}")
+        async with conn.transaction():
+            await conn.execute("""
+                INSERT INTO settings (key, value)
+                VALUES ($1, $2)
+                ON CONFLICT (key) DO UPDATE SET value = $2
+            """, key, value)
+            # Уведомление доставляется после коммита
+            await conn.execute("SELECT pg_notify($1, $2)", SETTINGS_CHANNEL, key)
+    _invalidate_settings()
+    logger.info(f"Setting updated: {key} = {value}")
 
 
 async def get_published_links(pool):
@@ -375,11 +1403,389 @@ async def get_published_links(pool):
         return {row['link'] for row in links}
 
 
-async def add_published_link(pool, link):
+async def add_published_link(pool, link, channel=None, post_id=None):
+    """
+    Records that an article was posted.
+
+    Args:
+        pool: Database connection pool
+        link: Article link (news.link)
+        channel: Channel the post was sent to
+        post_id: Telegram message_id of the post
+    """
     async with pool.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO published_links (link) VALUES ($1) ON CONFLICT DO NOTHING",
-            link)
+        await conn.execute("""
+            INSERT INTO published_links (link, published_at, channel, post_id)
+            VALUES ($1, CURRENT_TIMESTAMP, $2, $3)
+            ON CONFLICT (link) DO UPDATE
+                SET published_at = EXCLUDED.published_at,
+                    channel = EXCLUDED.channel,
+                    post_id = EXCLUDED.post_id
+        """, link, channel, post_id)
+
+
+async def add_scheduled_post(pool, due_at, channel, text, parse_mode='Markdown',
+                             disable_web_page_preview=False, news_id=None,
+                             link=None):
+    """
+    Stores a post to be sent at due_at.
+
+    Returns:
+        int: scheduled_posts.id
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetchval("""
+            INSERT INTO scheduled_posts (due_at, channel, text, parse_mode,
+                                         disable_web_page_preview, news_id, link)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            RETURNING id
+        """, due_at, channel, text, parse_mode, disable_web_page_preview,
+            news_id, link)
+
+
+async def get_pending_scheduled_posts(pool, limit=None):
+    """Returns pending scheduled posts ordered by due time."""
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT id, due_at, channel, text, parse_mode,
+                   disable_web_page_preview, news_id, link
+            FROM scheduled_posts
+            WHERE status = 'pending'
+            ORDER BY due_at
+            LIMIT $1
+        """, limit)
+
+
+async def claim_scheduled_post(pool, post_id):
+    """
+    Marks a pending post as being sent.
+
+    Returns:
+        The post record, or None if it is not pending any more (sent by
+        another bot instance or cancelled)
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetchrow("""
+            UPDATE scheduled_posts SET status = 'sending'
+            WHERE id = $1 AND status = 'pending'
+            RETURNING id, due_at, channel, text, parse_mode,
+                      disable_web_page_preview, news_id, link
+        """, post_id)
+
+
+async def finish_scheduled_post(pool, scheduled_id, status, message_id=None,
+                                error=None):
+    """
+    Records the outcome of a scheduled post.
+
+    Args:
+        scheduled_id: scheduled_posts.id
+        status: 'sent', 'failed' or 'missed'
+        message_id: Telegram message_id of the sent post
+        error: Reason the post was not sent
+    """
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE scheduled_posts
+            SET status = $2, post_id = $3, error = $4,
+                sent_at = CASE WHEN $2 = 'sent' THEN CURRENT_TIMESTAMP END
+            WHERE id = $1
+        """, scheduled_id, status, message_id, error)
+
+
+async def fail_stale_scheduled_posts(pool, due_before):
+    """
+    Marks posts stuck in 'sending' that were due before due_before as
+    failed (the process sending them stopped before recording the result).
+
+    Returns:
+        List of records (id, news_id, link) of the marked posts
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            UPDATE scheduled_posts
+            SET status = 'failed', error = 'interrupted while sending'
+            WHERE status = 'sending' AND due_at < $1
+            RETURNING id, news_id, link
+        """, due_before)
+
+
+async def cancel_scheduled_post(pool, post_id):
+    """Cancels a pending post. Returns True if it was pending."""
+    async with pool.acquire() as conn:
+        status = await conn.execute("""
+            UPDATE scheduled_posts SET status = 'cancelled'
+            WHERE id = $1 AND status = 'pending'
+        """, post_id)
+    return status == 'UPDATE 1'
+
+
+async def get_scheduled_post_links(pool):
+    """Links of the articles in pending scheduled posts."""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT DISTINCT link FROM scheduled_posts
+            WHERE status IN ('pending', 'sending') AND link IS NOT NULL
+        """)
+    return {row['link'] for row in rows}
+
+
+_INSERT_POST_CANDIDATES = """
+    INSERT INTO post_candidates (news_id, link, title, similarity)
+    SELECT * FROM unnest($1::int[], $2::text[], $3::text[], $4::real[])
+    ON CONFLICT DO NOTHING
+    RETURNING news_id
+"""
+
+
+async def _insert_post_candidates(conn, candidates):
+    """Inserts candidates, returns the news_id of the rows actually added."""
+    rows = await conn.fetch(_INSERT_POST_CANDIDATES,
+                            *(list(column) for column in zip(*candidates)))
+    return [row['news_id'] for row in rows]
+
+
+async def replace_post_candidates(pool, candidates):
+    """
+    Replaces the post candidate pool.
+
+    Used candidates stay until their post is published: a queued post is
+    not in published_links yet, and the new pool must not take its
+    article again.
+
+    Args:
+        candidates: Iterable of (news_id, link, title, similarity)
+
+    Returns:
+        int: Number of candidates in the new pool
+    """
+    candidates = list(candidates)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+                DELETE FROM post_candidates c
+                WHERE c.status = 'ready'
+                   OR EXISTS (SELECT 1 FROM published_links pl
+                              WHERE pl.link = c.link)
+            """)
+            if not candidates:
+                return 0
+            return len(await _insert_post_candidates(conn, candidates))
+
+
+async def add_post_candidates(pool, candidates, size):
+    """
+    Adds candidates to the pool and keeps only the size most similar
+    ready ones.
+
+    Args:
+        candidates: Iterable of (news_id, link, title, similarity)
+        size: Maximum number of ready candidates
+
+    Returns:
+        int: Number of added candidates that stayed in the pool
+    """
+    candidates = list(candidates)
+    if not candidates:
+        return 0
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            inserted = await _insert_post_candidates(conn, candidates)
+            if not inserted:
+                return 0
+            await conn.execute("""
+                DELETE FROM post_candidates
+                WHERE status = 'ready' AND news_id NOT IN (
+                    SELECT news_id FROM post_candidates
+                    WHERE status = 'ready'
+                    ORDER BY similarity DESC
+                    LIMIT $1)
+            """, size)
+            return await conn.fetchval(
+                "SELECT COUNT(*) FROM post_candidates WHERE news_id = ANY($1::int[])",
+                inserted)
+
+
+async def get_post_candidates(pool, limit=None):
+    """
+    Returns the ready candidates, most similar first.
+
+    Returns:
+        List of records (news_id, link, title, similarity, added_at, rendered)
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT news_id, link, title, similarity, added_at,
+                   rendered_at IS NOT NULL AS rendered
+            FROM post_candidates
+            WHERE status = 'ready'
+            ORDER BY similarity DESC
+            LIMIT $1
+        """, limit)
+
+
+async def count_post_candidates(pool):
+    """Number of ready candidates in the pool."""
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT COUNT(*) FROM post_candidates WHERE status = 'ready'")
+
+
+async def pop_post_candidate(pool, top=1):
+    """
+    Takes the next candidate for a post and marks it as used.
+
+    Candidates with a prepared summary go first, so publication does not
+    wait for the LLM.
+
+    Args:
+        top: Pick randomly among this many best candidates (1 — the best one)
+
+    Returns:
+        Article record (id, title, description, link, source, tags,
+        published, similarity, summary), or None if the pool is empty
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetchrow("""
+            WITH picked AS (
+                UPDATE post_candidates SET status = 'used',
+                                           used_at = CURRENT_TIMESTAMP
+                WHERE news_id = (
+                    SELECT news_id FROM (
+                        SELECT c.news_id FROM post_candidates c
+                        WHERE c.status = 'ready'
+                          AND NOT EXISTS (SELECT 1 FROM published_links pl
+                                          WHERE pl.link = c.link)
+                        ORDER BY c.rendered_at IS NOT NULL DESC, c.similarity DESC
+                        LIMIT $1
+                        FOR UPDATE SKIP LOCKED
+                    ) best
+                    ORDER BY random()
+                    LIMIT 1)
+                RETURNING news_id, similarity, summary
+            )
+            SELECT n.id, n.title, n.description, n.link, n.source, n.tags,
+                   n.published, p.similarity, p.summary
+            FROM picked p
+            JOIN news n ON n.id = p.news_id
+        """, top)
+
+
+async def release_post_candidate(pool, news_id):
+    """Returns a candidate to the pool, e.g. after a failed post."""
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE post_candidates SET status = 'ready', used_at = NULL
+            WHERE news_id = $1
+        """, news_id)
+
+
+async def get_unrendered_candidates(pool, count):
+    """
+    Candidates among the count best ones that have no prepared summary yet.
+
+    Returns:
+        List of records (news_id, link, title)
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT news_id, link, title FROM (
+                SELECT news_id, link, title, similarity, rendered_at
+                FROM post_candidates
+                WHERE status = 'ready'
+                ORDER BY similarity DESC
+                LIMIT $1
+            ) best
+            WHERE rendered_at IS NULL
+            ORDER BY similarity DESC
+        """, count)
+
+
+async def set_candidate_summary(pool, news_id, summary):
+    """Stores the prepared summary of a candidate."""
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE post_candidates
+            SET summary = $2, rendered_at = CURRENT_TIMESTAMP
+            WHERE news_id = $1
+        """, news_id, summary)
+
+
+async def get_candidate_summaries(pool, ids):
+    """Prepared summaries of candidates: {news_id: summary}."""
+    if not ids:
+        return {}
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT news_id, summary FROM post_candidates
+            WHERE news_id = ANY($1::int[]) AND summary IS NOT NULL
+        """, list(ids))
+    return {row['news_id']: row['summary'] for row in rows}
+
+
+async def get_theme_candidates_since(pool, embedding, since, until, limit,
+                                     tags=None):
+    """
+    Unpublished articles whose active embedding was written in (since, until],
+    ranked by similarity to embedding.
+
+    The scan is exact over the new embeddings only (index on updated_at).
+
+    Returns:
+        List of records (id, link, title, similarity)
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT n.id, n.link, n.title,
+                   1 - (ae.embedding <=> $1) AS similarity
+            FROM article_embeddings ae
+            JOIN news n ON n.id = ae.news_id
+            WHERE ae.updated_at > $2 AND ae.updated_at <= $3
+              AND ($5::text[] IS NULL OR n.tags && $5::text[])
+              AND NOT EXISTS (SELECT 1 FROM published_links pl
+                              WHERE pl.link = n.link)
+            ORDER BY ae.embedding <=> $1
+            LIMIT $4
+        """, embedding, since, until, limit, tags or None)
+
+
+async def get_embeddings_watermark(pool):
+    """Time of the latest active embedding write."""
+    async with pool.acquire() as conn:
+        return await conn.fetchval("SELECT MAX(updated_at) FROM article_embeddings")
+
+
+async def get_weekly_summary_candidates(pool, start, end, embedding=None,
+                                        exclude_links=None, limit=20):
+    """
+    Articles posted to the channel in [start, end), ranked by similarity
+    to the theme.
+
+    Args:
+        pool: Database connection pool
+        start: Start of the period (inclusive, compared with published_at)
+        end: End of the period (exclusive)
+        embedding: Theme embedding; without it the newest posts come first
+        exclude_links: Links of posts that are still pending
+        limit: Maximum number of articles
+
+    Returns:
+        List of records (id, title, description, link, source, tags,
+        published, published_at, channel, post_id, similarity)
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT n.id, n.title, n.description, n.link, n.source, n.tags,
+                   n.published, pl.published_at, pl.channel, pl.post_id,
+                   1 - (ae.embedding <=> $1) AS similarity
+            FROM published_links pl
+            JOIN news n ON n.link = pl.link
+            LEFT JOIN article_embeddings ae ON ae.news_id = n.id
+            WHERE pl.published_at >= $2 AND pl.published_at < $3
+              AND NOT (pl.link = ANY($4::text[]))
+            ORDER BY similarity DESC NULLS LAST, pl.published_at DESC
+            LIMIT $5
+        """, embedding, start, end, list(exclude_links or []), limit)
 
 
 async def add_channel(pool, username):
@@ -453,64 +1859,3 @@ async def update_last_message_id(pool, channel_username, message_id):
             VALUES ($1, $2)
             ON CONFLICT (username) DO UPDATE SET last_message_id = $2
         """, channel_username, message_id)
-
-
-async def ensure_vector_extension_exists():
-    """Ensures the vector extension is created and properly set up."""
-    conn = None
-    try:
-        conn = await asyncpg.connect(
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME
-        )
-
-        await conn.execute('CREATE EXTENSION IF NOT EXISTS vector;')
-        await register_vector(conn)
-
-        table_exists = await conn.fetchval(
-            """
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_schema = 'public' 
-                AND table_name = 'article_embeddings'
-            )
-            """
-        )
-
-        if table_exists:
-            column_type = await conn.fetchval(
-                """
-                SELECT data_type 
-                FROM information_schema.columns 
-                WHERE table_name = 'article_embeddings' 
-                AND column_name = 'embedding'
-                """
-            )
-
-            if column_type != 'USER-DEFINED':
-                await conn.execute('''
-                    ALTER TABLE article_embeddings 
-                    ALTER COLUMN embedding TYPE vector(384) USING REPLACE(REPLACE(embedding::text, '{', '['), '}', ']')::vector(384);
-                ''')
-                logger.info("Converted embedding column to vector(384) type.")
-
-        logger.info(
-            "Vector extension and database schema verified successfully.")
-
-    except Exception as e:
-        if "permission denied" in str(e).lower() or "must be superuser" in str(
-                e).lower():
-            logger.warning(
-                "Недостаточно прав для настройки расширения vector. Требуются права суперпользователя.")
-            logger.warning(
-                "Пожалуйста, выполните вручную в psql: CREATE EXTENSION IF NOT EXISTS vector;")
-        else:
-            logger.error(f"Ошибка при настройке расширения vector: {e}",
-                         exc_info=True)
-            raise
-    finally:
-        if conn:
-            await conn.close()
@@ -0,0 +1,282 @@
+"""
+Обслуживание хранилища статей: срок хранения, архив, VACUUM и индексы.
+
+news разбита на помесячные секции news_YYYY_MM (UTC) по дате публикации.
+Устаревшая секция удаляется целиком через DROP TABLE — без DELETE по
+миллионам строк и без мертвых кортежей. Перед удалением секция вместе с
+эмбеддингами и полными текстами ее статей может быть выгружена в
+storage.archive_dir (csv.gz). Эмбеддинги, тексты (article_bodies), пул
+кандидатов и published_links не секционированы, их строки удаляются
+запросом по id и ссылкам статей секции.
+
+После удаления секций выполняется VACUUM (ANALYZE) таблиц с большим числом
+мертвых строк, ANALYZE родительской news, удаление невалидных индексов
+(остатков прерванного CREATE INDEX CONCURRENTLY) и, если удалена заметная
+доля эмбеддингов, перестроение ANN-индекса через REINDEX CONCURRENTLY.
+"""
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timezone
+
+import asyncpg
+
+from database.db_manager import (ACTIVE_EMBEDDINGS_TABLE, EMBEDDING_TABLES,
+                                 INDEX_BUILD_TIMEOUT, add_months,
+                                 ensure_vector_index, forget_news_partition,
+                                 retention_cutoff, vector_index_name)
+from utils.config import (STORAGE_RETENTION_MONTHS, STORAGE_ARCHIVE,
+                          STORAGE_ARCHIVE_DIR, VECTOR_INDEX_METHOD)
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r'^news_(\d{4})_(\d{2})$')
+
+# VACUUM выполняется для таблиц, где мертвых строк больше порога
+VACUUM_MIN_DEAD_ROWS = 1000
+VACUUM_DEAD_FRACTION = 0.1
+
+# Доля удаленных эмбеддингов, после которой ANN-индекс перестраивается
+REINDEX_DELETED_FRACTION = 0.2
+
+MAINTENANCE_TIMEOUT = 6 * 3600
+
+
+async def get_news_partitions(conn):
+    """Returns [(name, month_start)] of the news partitions, oldest first."""
+    rows = await conn.fetch("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'news'::regclass
+    """)
+    partitions = []
+    for row in rows:
+        match = PARTITION_NAME.match(row['relname'])
+        if match:
+            month = datetime(int(match.group(1)), int(match.group(2)), 1,
+                             tzinfo=timezone.utc)
+            partitions.append((row['relname'], month))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+# Таблицы со строками статей по news_id, кроме эмбеддингов
+ARTICLE_TABLES = ['article_bodies']
+
+
+async def _existing_article_tables(conn):
+    """Таблицы с news_id, строки которых удаляются вместе с секцией."""
+    return [table for table in [*EMBEDDING_TABLES, *ARTICLE_TABLES]
+            if await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", table)]
+
+
+async def _copy_to_gzip(conn, query, path):
+    """Выгружает результат запроса в path (csv.gz) через временный файл."""
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, 'wb') as archive:
+        async def write(data):
+            archive.write(data)
+        await conn.copy_from_query(query, output=write, format='csv', header=True,
+                                   timeout=MAINTENANCE_TIMEOUT)
+    os.replace(tmp_path, path)
+
+
+async def archive_partition(conn, partition, article_tables):
+    """Выгружает секцию, эмбеддинги и тексты ее статей в STORAGE_ARCHIVE_DIR."""
+    os.makedirs(STORAGE_ARCHIVE_DIR, exist_ok=True)
+    await _copy_to_gzip(conn, f"SELECT * FROM {partition} ORDER BY id",
+                        os.path.join(STORAGE_ARCHIVE_DIR, f"{partition}.csv.gz"))
+    for table in article_tables:
+        await _copy_to_gzip(
+            conn,
+            f"SELECT e.* FROM {table} e WHERE e.news_id IN "
+            f"(SELECT id FROM {partition}) ORDER BY e.news_id",
+            os.path.join(STORAGE_ARCHIVE_DIR, f"{partition}_{table}.csv.gz"))
+
+
+# Таблицы со строками опубликованных и отобранных для постов статей
+LINKED_TABLES = {'post_candidates': 'news_id', 'published_links': 'link'}
+
+
+async def _drop_partition(conn, partition, article_tables):
+    """Удаляет секцию и строки ее статей в других таблицах в одной транзакции."""
+    deleted = {}
+    async with conn.transaction():
+        # Внешних ключей на news нет: пока транзакция не закончилась,
+        # эмбеддинги и тексты для статей секции записать нельзя, а записи
+        # после нее не найдут статью в news (см. _upsert_embedding_sql)
+        for table in article_tables:
+            await conn.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+        await conn.execute(f"""
+            CREATE TEMP TABLE dropped_articles ON COMMIT DROP AS
+            SELECT id, link FROM {partition}
+        """)
+        await conn.execute("CREATE INDEX ON dropped_articles (id)")
+        deleted['news'] = await conn.fetchval("SELECT COUNT(*) FROM dropped_articles")
+        await conn.execute(f"DROP TABLE {partition}")
+
+        for table in article_tables:
+            status = await conn.execute(f"""
+                DELETE FROM {table} t USING dropped_articles d
+                WHERE t.news_id = d.id
+            """)
+            deleted[table] = int(status.split()[-1])
+        for table, column in LINKED_TABLES.items():
+            if not await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", table):
+                continue
+            key = 'id' if column == 'news_id' else 'link'
+            status = await conn.execute(f"""
+                DELETE FROM {table} t USING dropped_articles d
+                WHERE t.{column} = d.{key}
+            """)
+            deleted[table] = int(status.split()[-1])
+
+        # DROP TABLE не вызывает триггеры точного счетчика строк news
+        if await conn.fetchval(
+                "SELECT to_regclass('table_row_counts') IS NOT NULL"):
+            await conn.execute("""
+                UPDATE table_row_counts SET row_count = row_count - $1
+                WHERE table_name = 'news'
+            """, deleted['news'])
+    forget_news_partition(partition)
+    return deleted
+
+
+async def apply_retention(pool, retention_months=STORAGE_RETENTION_MONTHS,
+                          archive=STORAGE_ARCHIVE):
+    """
+    Удаляет секции news старше срока хранения вместе с эмбеддингами и
+    текстами их статей.
+
+    Returns:
+        dict: cutoff (datetime или None), partitions (имена удаленных секций),
+        deleted ({таблица: число удаленных строк}), embeddings_before
+        ({таблица: оценка числа строк до удаления}).
+    """
+    cutoff = retention_cutoff(retention_months)
+    result = {'cutoff': cutoff, 'partitions': [], 'deleted': {},
+              'embeddings_before': {}}
+    if cutoff is None:
+        return result
+
+    async with pool.acquire() as conn:
+        expired = [name for name, month in await get_news_partitions(conn)
+                   if add_months(month, 1) <= cutoff]
+        if not expired:
+            return result
+
+        article_tables = await _existing_article_tables(conn)
+        for table in article_tables:
+            if table not in EMBEDDING_TABLES:
+                continue
+            result['embeddings_before'][table] = await conn.fetchval(
+                "SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = $1::regclass",
+                table)
+
+        timeout = await conn.fetchval("SHOW statement_timeout")
+        await conn.execute("SET statement_timeout = 0")
+        try:
+            for partition in expired:
+                if archive:
+                    await archive_partition(conn, partition, article_tables)
+                deleted = await _drop_partition(conn, partition, article_tables)
+                for table, count in deleted.items():
+                    result['deleted'][table] = result['deleted'].get(table, 0) + count
+                result['partitions'].append(partition)
+                logger.info(f"Секция {partition} удалена по сроку хранения: "
+                            f"{deleted.get('news', 0)} статей")
+        finally:
+            await conn.execute(
+                "SELECT set_config('statement_timeout', $1, false)", timeout)
+    return result
+
+
+async def vacuum_tables(conn):
+    """VACUUM (ANALYZE) таблиц и секций с большим числом мертвых строк."""
+    rows = await conn.fetch("""
+        SELECT relname FROM pg_stat_user_tables
+        WHERE n_dead_tup >= $1 AND n_dead_tup >= $2 * GREATEST(n_live_tup, 1)
+        ORDER BY n_dead_tup DESC
+    """, VACUUM_MIN_DEAD_ROWS, VACUUM_DEAD_FRACTION)
+    vacuumed = []
+    for row in rows:
+        await conn.execute(f'VACUUM (ANALYZE) "{row["relname"]}"',
+                           timeout=MAINTENANCE_TIMEOUT)
+        vacuumed.append(row['relname'])
+    # Статистика по родительской секционированной таблице автоматически не
+    # собирается, а планировщик использует ее для запросов ко всей news
+    await conn.execute("ANALYZE news", timeout=MAINTENANCE_TIMEOUT)
+    return vacuumed
+
+
+# Невалидные индексы таблиц, на которых сейчас не строится индекс: пока
+# идет CREATE INDEX / REINDEX CONCURRENTLY, его индекс тоже невалиден
+INVALID_INDEXES = """
+    SELECT c.relname FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE NOT i.indisvalid AND c.relkind = 'i'
+      AND n.nspname = current_schema()
+      AND NOT EXISTS (SELECT 1 FROM pg_inherits h WHERE h.inhrelid = c.oid)
+      AND NOT EXISTS (SELECT 1 FROM pg_stat_progress_create_index p
+                      WHERE p.relid = i.indrelid)
+"""
+
+
+async def drop_invalid_indexes(conn):
+    """Удаляет невалидные индексы, оставшиеся от прерванного CREATE INDEX CONCURRENTLY."""
+    dropped = []
+    for row in await conn.fetch(INVALID_INDEXES):
+        # Построение могло начаться после первой проверки
+        if not await conn.fetchval(
+                f"SELECT EXISTS (SELECT 1 FROM ({INVALID_INDEXES}) q WHERE q.relname = $1)",
+                row['relname']):
+            continue
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{row["relname"]}"')
+        logger.warning(f"Удален невалидный индекс {row['relname']}")
+        dropped.append(row['relname'])
+    return dropped
+
+
+async def run_maintenance(pool, retention=None):
+    """
+    VACUUM/ANALYZE и обслуживание индексов после apply_retention.
+
+    Args:
+        pool: Database connection pool
+        retention: Результат apply_retention; по нему решается, нужно ли
+            перестраивать ANN-индекс.
+
+    Returns:
+        dict: vacuumed, invalid_indexes_dropped, reindexed (списки имен).
+    """
+    retention = retention or {}
+    stats = {'vacuumed': [], 'invalid_indexes_dropped': [], 'reindexed': []}
+    async with pool.acquire() as conn:
+        timeout = await conn.fetchval("SHOW statement_timeout")
+        await conn.execute("SET statement_timeout = 0")
+        try:
+            stats['vacuumed'] = await vacuum_tables(conn)
+            stats['invalid_indexes_dropped'] = await drop_invalid_indexes(conn)
+
+            table = ACTIVE_EMBEDDINGS_TABLE
+            before = retention.get('embeddings_before', {}).get(table) or 0
+            deleted = retention.get('deleted', {}).get(table, 0)
+            if (VECTOR_INDEX_METHOD != 'none' and before
+                    and deleted >= REINDEX_DELETED_FRACTION * before):
+                name = vector_index_name(table, VECTOR_INDEX_METHOD)
+                try:
+                    await conn.execute(f"REINDEX INDEX CONCURRENTLY {name}",
+                                       timeout=INDEX_BUILD_TIMEOUT)
+                    stats['reindexed'].append(name)
+                    logger.info(f"Индекс {name} перестроен после удаления "
+                                f"{deleted} эмбеддингов")
+                except asyncpg.UndefinedObjectError:
+                    pass
+        finally:
+            await conn.execute(
+                "SELECT set_config('statement_timeout', $1, false)", timeout)
+
+    # Невалидный ANN-индекс удален выше — создаем его заново
+    await ensure_vector_index(pool)
+    return stats
@@ -0,0 +1,568 @@
+"""
+Версионированные миграции схемы базы данных.
+
+Каждая миграция применяется ровно один раз, номер примененной миграции
+записывается в schema_migrations. При старте проверяется только список
+примененных версий; миграции выполняются под advisory lock, поэтому
+несколько экземпляров бота могут запускаться одновременно.
+
+Новые миграции добавляются в конец с очередным номером; уже примененные
+миграции не редактируются.
+"""
+import ast
+import logging
+from datetime import datetime, timedelta
+
+import asyncpg
+
+from database.db_manager import EMBEDDING_TABLES, INDEX_BUILD_TIMEOUT
+from utils.config import (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME,
+                          STORAGE_SNIPPET_CHARS, TELEGRAM_CHANNEL)
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_lock, под которым применяются миграции
+MIGRATIONS_LOCK_ID = 7241500943
+
+MIGRATIONS = []
+
+
+def migration(version, transactional=True):
+    """
+    Регистрирует миграцию с номером version.
+
+    Миграция получает соединение и выполняется в транзакции вместе с записью
+    в schema_migrations. Миграции с CREATE INDEX CONCURRENTLY объявляются
+    с transactional=False и должны быть безопасны при повторном запуске.
+    """
+    def register(func):
+        MIGRATIONS.append((version, func.__name__, func, transactional))
+        return func
+    return register
+
+
+@migration(1, transactional=False)
+async def create_vector_extension(conn):
+    try:
+        await conn.execute('CREATE EXTENSION IF NOT EXISTS vector')
+    except asyncpg.InsufficientPrivilegeError:
+        logger.error(
+            "Недостаточно прав для настройки расширения vector. Требуются права суперпользователя.")
+        logger.error(
+            "Пожалуйста, выполните вручную в psql: CREATE EXTENSION IF NOT EXISTS vector;")
+        raise
+
+
+@migration(2)
+async def convert_legacy_embeddings(conn):
+    """Эмбеддинги, сохраненные как массивы ('{...}'), переводятся в тип vector."""
+    column_type = await conn.fetchval("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'article_embeddings'
+        AND column_name = 'embedding'
+    """)
+    if column_type is None or column_type == 'USER-DEFINED':
+        return
+    await conn.execute("""
+        ALTER TABLE article_embeddings
+        ALTER COLUMN embedding TYPE vector(384)
+        USING REPLACE(REPLACE(embedding::text, '{', '['), '}', ']')::vector(384)
+    """)
+    logger.info("Converted embedding column to vector(384) type.")
+
+
+@migration(3)
+async def baseline_schema(conn):
+    """Схема на момент перехода на миграции; на существующих базах ничего не меняет."""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS news (
+            id SERIAL PRIMARY KEY,
+            title TEXT NOT NULL,
+            link TEXT UNIQUE NOT NULL,
+            description TEXT,
+            source TEXT,
+            tags TEXT[],
+            published TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+
+        -- Старые базы создавались без даты публикации; существующие строки
+        -- получают текущее время из DEFAULT
+        ALTER TABLE news ADD COLUMN IF NOT EXISTS published
+            TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+
+        CREATE TABLE IF NOT EXISTS article_embeddings (
+            news_id INTEGER PRIMARY KEY REFERENCES news(id) ON DELETE CASCADE,
+            embedding vector(384) NOT NULL
+        );
+
+        -- Хэш нормализованного текста для переиспользования эмбеддингов
+        ALTER TABLE article_embeddings ADD COLUMN IF NOT EXISTS content_hash TEXT;
+        CREATE INDEX IF NOT EXISTS idx_article_embeddings_content_hash
+            ON article_embeddings (content_hash);
+
+        -- Модели эмбеддингов: активная (по ней идет поиск) и строящаяся
+        CREATE TABLE IF NOT EXISTS embedding_models (
+            model_id TEXT PRIMARY KEY,
+            dim INTEGER NOT NULL,
+            status TEXT NOT NULL
+                CHECK (status IN ('active', 'building', 'retired')),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            activated_at TIMESTAMP WITH TIME ZONE
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_embedding_models_one_active
+            ON embedding_models (status) WHERE status = 'active';
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_embedding_models_one_building
+            ON embedding_models (status) WHERE status = 'building';
+
+        ALTER TABLE article_embeddings ADD COLUMN IF NOT EXISTS model_id TEXT;
+
+        -- Время записи эмбеддинга: по нему догружаются новые векторы
+        ALTER TABLE article_embeddings ADD COLUMN IF NOT EXISTS updated_at
+            TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+        CREATE INDEX IF NOT EXISTS idx_article_embeddings_updated_at
+            ON article_embeddings (updated_at);
+
+        -- Фильтрация и сортировка по дате публикации
+        CREATE INDEX IF NOT EXISTS idx_news_published ON news (published);
+
+        -- Полнотекстовый поиск: заголовок весит больше описания,
+        -- русская и английская морфология одновременно
+        ALTER TABLE news ADD COLUMN IF NOT EXISTS search_tsv tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('russian', coalesce(description, '')), 'B') ||
+                setweight(to_tsvector('english', coalesce(description, '')), 'B')
+            ) STORED;
+        CREATE INDEX IF NOT EXISTS idx_news_search_tsv
+            ON news USING GIN (search_tsv);
+
+        -- Время добавления статьи в базу (у старых статей неизвестно)
+        ALTER TABLE news ADD COLUMN IF NOT EXISTS created_at
+            TIMESTAMP WITH TIME ZONE;
+        ALTER TABLE news ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP;
+
+        -- Фильтры поиска по тегам (tags && ...) и источнику; индекс по
+        -- источнику заодно дает время последнего сбора по источнику
+        CREATE INDEX IF NOT EXISTS idx_news_tags ON news USING GIN (tags);
+        CREATE INDEX IF NOT EXISTS idx_news_source_created_at
+            ON news (source, created_at);
+        DROP INDEX IF EXISTS idx_news_source;
+
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id BIGINT PRIMARY KEY
+        );
+
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS published_links (
+            link TEXT PRIMARY KEY
+        );
+
+        -- Когда, куда и каким сообщением опубликована статья.
+        -- У ссылок, опубликованных до появления колонок, время неизвестно
+        ALTER TABLE published_links ADD COLUMN IF NOT EXISTS published_at
+            TIMESTAMP WITH TIME ZONE;
+        ALTER TABLE published_links ALTER COLUMN published_at
+            SET DEFAULT CURRENT_TIMESTAMP;
+        ALTER TABLE published_links ADD COLUMN IF NOT EXISTS channel TEXT;
+        ALTER TABLE published_links ADD COLUMN IF NOT EXISTS post_id BIGINT;
+        CREATE INDEX IF NOT EXISTS idx_published_links_published_at
+            ON published_links (published_at);
+
+        CREATE TABLE IF NOT EXISTS channels (
+            username TEXT PRIMARY KEY,
+            added_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS channel_states (
+            username TEXT PRIMARY KEY,
+            last_message_id INTEGER NOT NULL
+        );
+    """)
+
+
+@migration(4, transactional=False)
+async def embeddings_news_id_key(conn, batch_size=5000):
+    """
+    Переводит таблицы эмбеддингов с ключа news.link (TEXT) на news.id (INTEGER).
+
+    Миграция онлайн: news_id заполняется небольшими батчами, уникальный
+    индекс строится CONCURRENTLY, и только финальная замена ключа выполняется
+    в короткой транзакции под блокировкой. Повторный запуск безопасен.
+    """
+    for table in EMBEDDING_TABLES:
+        has_link_key = await conn.fetchval("""
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = $1
+                AND column_name = 'article_id'
+            )
+        """, table)
+        if not has_link_key:
+            continue
+
+        logger.info(f"Переводим {table} на целочисленный ключ news_id...")
+        await conn.execute(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS news_id INTEGER")
+
+        # Заполняем news_id батчами, чтобы не держать долгих блокировок
+        filled = 0
+        while True:
+            result = await conn.execute(f"""
+                UPDATE {table} ae SET news_id = n.id
+                FROM news n
+                WHERE n.link = ae.article_id
+                AND ae.article_id IN (
+                    SELECT article_id FROM {table}
+                    WHERE news_id IS NULL LIMIT $1
+                )
+            """, batch_size)
+            updated = int(result.split()[-1])
+            filled += updated
+            if updated < batch_size:
+                break
+        logger.info(f"{table}: заполнено news_id для {filled} строк")
+
+        await conn.execute(f"""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {table}_news_id_key
+            ON {table} (news_id)
+        """, timeout=INDEX_BUILD_TIMEOUT)
+
+        async with conn.transaction():
+            await conn.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+            # Строки, записанные после батчевого заполнения
+            await conn.execute(f"""
+                UPDATE {table} ae SET news_id = n.id
+                FROM news n
+                WHERE n.link = ae.article_id AND ae.news_id IS NULL
+            """)
+            await conn.execute(f"DELETE FROM {table} WHERE news_id IS NULL")
+            await conn.execute(f"""
+                ALTER TABLE {table} DROP CONSTRAINT {table}_pkey;
+                ALTER TABLE {table} ALTER COLUMN news_id SET NOT NULL;
+                ALTER TABLE {table} ADD CONSTRAINT {table}_pkey
+                    PRIMARY KEY USING INDEX {table}_news_id_key;
+                ALTER TABLE {table} ADD CONSTRAINT {table}_news_id_fkey
+                    FOREIGN KEY (news_id) REFERENCES news(id) ON DELETE CASCADE
+                    NOT VALID;
+                ALTER TABLE {table} DROP COLUMN article_id;
+            """)
+
+        # Проверка внешнего ключа не блокирует запись в таблицу
+        await conn.execute(
+            f"ALTER TABLE {table} VALIDATE CONSTRAINT {table}_news_id_fkey")
+        logger.info(f"{table} переведена на ключ news_id")
+
+
+@migration(5)
+async def partition_news_by_month(conn):
+    """
+    Разбивает news на помесячные секции по published.
+
+    Уникальные ключи секционированной таблицы обязаны включать published,
+    поэтому первичный ключ становится (id, published), уникальность link
+    обеспечивает save_article, а внешние ключи эмбеддингов на news(id)
+    удаляются: эмбеддинги устаревших статей удаляет обслуживание хранения
+    (database.maintenance). Таблица переписывается целиком под блокировкой.
+    """
+    if await conn.fetchval("SELECT relkind FROM pg_class WHERE oid = 'news'::regclass") == 'p':
+        return
+    sequence = await conn.fetchval("SELECT pg_get_serial_sequence('news', 'id')")
+    await conn.execute(f"""
+        LOCK TABLE news IN ACCESS EXCLUSIVE MODE;
+
+        -- published — ключ секционирования и не может быть пустым
+        UPDATE news SET published = COALESCE(created_at, CURRENT_TIMESTAMP)
+        WHERE published IS NULL;
+
+        ALTER TABLE article_embeddings
+            DROP CONSTRAINT IF EXISTS article_embeddings_news_id_fkey;
+        ALTER TABLE IF EXISTS article_embeddings_next
+            DROP CONSTRAINT IF EXISTS article_embeddings_next_news_id_fkey;
+
+        ALTER TABLE news RENAME TO news_unpartitioned;
+
+        CREATE TABLE news (
+            id INTEGER NOT NULL DEFAULT nextval('{sequence}'::regclass),
+            title TEXT NOT NULL,
+            link TEXT NOT NULL,
+            description TEXT,
+            source TEXT,
+            tags TEXT[],
+            published TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            search_tsv tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('russian', coalesce(description, '')), 'B') ||
+                setweight(to_tsvector('english', coalesce(description, '')), 'B')
+            ) STORED
+        ) PARTITION BY RANGE (published);
+
+        -- Секция news_YYYY_MM за месяц (UTC), в который попадает ts
+        CREATE OR REPLACE FUNCTION create_news_partition(ts TIMESTAMP WITH TIME ZONE)
+        RETURNS TEXT AS $$
+        DECLARE
+            month_start TIMESTAMP := date_trunc('month', ts AT TIME ZONE 'UTC');
+            part_name TEXT := 'news_' || to_char(month_start, 'YYYY_MM');
+        BEGIN
+            IF to_regclass(part_name) IS NULL THEN
+                -- Одновременные вставки в новый месяц создают секцию по очереди
+                PERFORM pg_advisory_xact_lock(hashtext(part_name));
+                IF to_regclass(part_name) IS NULL THEN
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF news FOR VALUES FROM (%L) TO (%L)',
+                        part_name, month_start AT TIME ZONE 'UTC',
+                        (month_start + interval '1 month') AT TIME ZONE 'UTC');
+                END IF;
+            END IF;
+            RETURN part_name;
+        END $$ LANGUAGE plpgsql;
+
+        SELECT create_news_partition(month)
+        FROM (SELECT DISTINCT
+                     date_trunc('month', published AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS month
+              FROM news_unpartitioned
+              UNION SELECT CURRENT_TIMESTAMP
+              UNION SELECT CURRENT_TIMESTAMP + interval '1 month') months;
+
+        INSERT INTO news (id, title, link, description, source, tags,
+                          published, created_at)
+        SELECT id, title, link, description, source, tags, published, created_at
+        FROM news_unpartitioned;
+
+        ALTER SEQUENCE {sequence} OWNED BY NONE;
+        DROP TABLE news_unpartitioned;
+        ALTER SEQUENCE {sequence} OWNED BY news.id;
+
+        ALTER TABLE news ADD CONSTRAINT news_pkey PRIMARY KEY (id, published);
+        CREATE INDEX idx_news_link ON news (link);
+        CREATE INDEX idx_news_published ON news (published);
+        CREATE INDEX idx_news_search_tsv ON news USING GIN (search_tsv);
+        CREATE INDEX idx_news_tags ON news USING GIN (tags);
+        CREATE INDEX idx_news_source_created_at ON news (source, created_at);
+        ANALYZE news;
+    """)
+
+
+@migration(6)
+async def split_article_bodies(conn):
+    """
+    Переносит полные тексты статей из news.description в article_bodies.
+
+    В news остается короткий фрагмент без HTML (news_snippet), поэтому
+    поиск и выборки статей читают узкие строки. search_tsv перестает быть
+    генерируемым столбцом: он строится по полному тексту при сохранении
+    статьи (news_search_tsv). Внешнего ключа на секционированную news нет,
+    тексты устаревших статей удаляет обслуживание хранения.
+    """
+    await conn.execute("""
+        CREATE OR REPLACE FUNCTION news_snippet(body TEXT, max_chars INTEGER)
+        RETURNS TEXT AS $$
+            SELECT CASE WHEN length(plain) <= max_chars THEN plain
+                        ELSE regexp_replace(left(plain, max_chars), '\\s+\\S*$', '') || '…'
+                   END
+            FROM (SELECT btrim(regexp_replace(regexp_replace(body, '<[^>]*>', ' ', 'g'),
+                                              '\\s+', ' ', 'g')) AS plain) b
+        $$ LANGUAGE sql IMMUTABLE;
+
+        CREATE OR REPLACE FUNCTION news_search_tsv(title TEXT, body TEXT)
+        RETURNS tsvector AS $$
+            SELECT setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+                   setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                   setweight(to_tsvector('russian', coalesce(body, '')), 'B') ||
+                   setweight(to_tsvector('english', coalesce(body, '')), 'B')
+        $$ LANGUAGE sql IMMUTABLE;
+
+        LOCK TABLE news IN SHARE ROW EXCLUSIVE MODE;
+
+        -- Значения search_tsv сохраняются, дальше их пишет save_article
+        ALTER TABLE news ALTER COLUMN search_tsv DROP EXPRESSION;
+
+        CREATE TABLE article_bodies (
+            news_id INTEGER PRIMARY KEY,
+            body TEXT NOT NULL
+        );
+
+        INSERT INTO article_bodies (news_id, body)
+        SELECT id, description FROM news WHERE description IS NOT NULL;
+    """)
+    await conn.execute("""
+        UPDATE news SET description = news_snippet(description, $1)
+        WHERE description IS NOT NULL
+          AND description IS DISTINCT FROM news_snippet(description, $1)
+    """, STORAGE_SNIPPET_CHARS)
+    await conn.execute("ANALYZE news; ANALYZE article_bodies;")
+
+
+@migration(7)
+async def create_scheduled_posts(conn):
+    """
+    Посты, запланированные на точное время. Раньше хранились строкой
+    в settings и находились опросом каждые 5 минут.
+    """
+    await conn.execute("""
+        CREATE TABLE scheduled_posts (
+            id SERIAL PRIMARY KEY,
+            due_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            -- pending, sending, sent, failed, missed, cancelled
+            status TEXT NOT NULL DEFAULT 'pending',
+            channel TEXT NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT NOT NULL DEFAULT 'Markdown',
+            disable_web_page_preview BOOLEAN NOT NULL DEFAULT FALSE,
+            news_id INTEGER,
+            link TEXT,
+            post_id BIGINT,
+            error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP WITH TIME ZONE
+        );
+
+        -- Восстановление заданий при старте и ближайшие посты
+        CREATE INDEX idx_scheduled_posts_pending_due_at
+            ON scheduled_posts (due_at) WHERE status = 'pending';
+    """)
+
+
+@migration(8)
+async def create_post_candidates(conn):
+    """Пул статей-кандидатов для постов по теме недели."""
+    await conn.execute("""
+        CREATE TABLE post_candidates (
+            news_id INTEGER PRIMARY KEY,
+            link TEXT NOT NULL UNIQUE,
+            title TEXT NOT NULL,
+            similarity REAL NOT NULL,
+            -- ready или used
+            status TEXT NOT NULL DEFAULT 'ready',
+            added_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            used_at TIMESTAMP WITH TIME ZONE
+        );
+
+        -- Следующий кандидат — первая строка индекса
+        CREATE INDEX idx_post_candidates_ready
+            ON post_candidates (similarity DESC) WHERE status = 'ready';
+    """)
+
+
+@migration(9)
+async def add_post_candidate_rendering(conn):
+    """Саммари кандидатов, подготовленные заранее (scheduler.candidates)."""
+    await conn.execute("""
+        ALTER TABLE post_candidates ADD COLUMN summary TEXT;
+        ALTER TABLE post_candidates ADD COLUMN rendered_at TIMESTAMP WITH TIME ZONE;
+    """)
+
+
+def _legacy_post_due_at(day, time, now):
+    """Ближайшие день недели (0 — понедельник) и время 'HH:MM' после now."""
+    hour, minute = (int(part) for part in time.split(':'))
+    due_at = (now + timedelta(days=(day - now.weekday()) % 7)).replace(
+        hour=hour, minute=minute, second=0, microsecond=0)
+    return due_at if due_at > now else due_at + timedelta(days=7)
+
+
+@migration(10)
+async def import_legacy_scheduled_posts(conn):
+    """
+    Посты из строки settings.scheduled_posts (список словарей day, time,
+    article) переносятся в scheduled_posts. Бот отправлял такой пост в
+    ближайшие день недели и время по локальному времени сервера, с тем же
+    текстом, что и раньше.
+    """
+    value = await conn.fetchval(
+        "SELECT value FROM settings WHERE key = 'scheduled_posts'")
+    if not value:
+        return
+    try:
+        posts = ast.literal_eval(value)
+    except (ValueError, SyntaxError) as e:
+        # Настройка остается в settings, чтобы ее можно было перенести вручную
+        logger.error(f"Не удалось разобрать settings.scheduled_posts: {e}")
+        return
+
+    now = datetime.now().astimezone()
+    for post in posts:
+        article = post['article']
+        text = f"*{article['title']}*\n\n"
+        if article.get('description'):
+            text += f"{article['description']}\n\n"
+        text += f"🔗 {article['link']}"
+        await conn.execute("""
+            INSERT INTO scheduled_posts (due_at, channel, text, link)
+            VALUES ($1, $2, $3, $4)
+        """, _legacy_post_due_at(post['day'], post['time'], now),
+            TELEGRAM_CHANNEL, text, article['link'])
+    await conn.execute("DELETE FROM settings WHERE key = 'scheduled_posts'")
+    logger.info(f"Перенесено запланированных постов из settings: {len(posts)}")
+
+
+async def _applied_versions(conn):
+    try:
+        return {row['version'] for row in await conn.fetch(
+            "SELECT version FROM schema_migrations")}
+    except asyncpg.UndefinedTableError:
+        return set()
+
+
+async def apply_migrations():
+    """
+    Применяет недостающие миграции.
+
+    Работает через отдельное соединение, до создания пула: соединения пула
+    регистрируют тип vector, которого может еще не быть.
+    """
+    conn = await asyncpg.connect(
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME
+    )
+    try:
+        latest = {version for version, _, _, _ in MIGRATIONS}
+        if latest <= await _applied_versions(conn):
+            logger.info("Схема базы данных актуальна.")
+            return
+
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID)
+        try:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # Пока ждали блокировку, миграции мог применить другой экземпляр
+            applied = await _applied_versions(conn)
+            for version, name, apply, transactional in sorted(MIGRATIONS):
+                if version in applied:
+                    continue
+                logger.info(f"Применяем миграцию {version}: {name}")
+                if transactional:
+                    async with conn.transaction():
+                        await apply(conn)
+                        await _record_migration(conn, version, name)
+                else:
+                    await apply(conn)
+                    await _record_migration(conn, version, name)
+            logger.info("Database schema verified and ready.")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграций: {e}", exc_info=True)
+        raise
+    finally:
+        await conn.close()
+
+
+async def _record_migration(conn, version, name):
+    await conn.execute(
+        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+        version, name)
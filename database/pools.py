@@ -0,0 +1,106 @@
+"""
+Пулы соединений по классам нагрузки.
+
+interactive — команды бота и публикация постов, ingest — сбор статей,
+batch — эмбеддинги, индексы, снимки и саммари. У каждого класса свой пул
+с лимитом соединений и statement_timeout (postgres.pools в config.yml),
+поэтому фоновая задача, занявшая все соединения своего класса, не
+задерживает команды админ-панели.
+
+Класс нагрузки выбирается не аргументом, а контекстом выполнения: код внутри
+workload('batch') или функции с декоратором @in_workload('batch') получает
+соединения из пула batch при обычном pool.acquire(). Контекст наследуется
+задачами asyncio, созданными внутри него. По умолчанию — interactive.
+Утилиты командной строки создают только пул batch; если пула нужного класса
+нет, используется первый созданный.
+"""
+import asyncio
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+from utils import metrics
+
+WORKLOADS = ('interactive', 'ingest', 'batch')
+
+_workload = contextvars.ContextVar('db_workload', default='interactive')
+
+
+@contextmanager
+def workload(name):
+    """Направляет запросы к базе внутри блока в пул класса name."""
+    if name not in WORKLOADS:
+        raise ValueError(f"Неизвестный класс нагрузки: {name}")
+    token = _workload.set(name)
+    try:
+        yield
+    finally:
+        _workload.reset(token)
+
+
+def in_workload(name):
+    """Декоратор корутины: все ее запросы идут через пул класса name."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with workload(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_workload():
+    return _workload.get()
+
+
+class DatabasePools:
+    """
+    Набор пулов asyncpg с интерфейсом одного пула (acquire/close).
+
+    Ожидание свободного соединения записывается в гистограмму
+    db_pool_acquire_seconds, размеры пулов — в датчики db_pool_size,
+    db_pool_in_use и db_pool_idle; метка — класс нагрузки.
+    """
+
+    def __init__(self, pools):
+        self._pools = pools
+
+    def acquire(self, *, timeout=None):
+        name = current_workload()
+        if name not in self._pools:
+            name = next(iter(self._pools))
+        return _PoolAcquire(self, name, timeout)
+
+    def get_pool(self, name):
+        return self._pools[name]
+
+    def stats(self):
+        """Returns {workload: {size, max_size, in_use, idle}}."""
+        return {name: {'size': pool.get_size(), 'max_size': pool.get_max_size(),
+                       'in_use': pool.get_size() - pool.get_idle_size(),
+                       'idle': pool.get_idle_size()}
+                for name, pool in self._pools.items()}
+
+    async def close(self):
+        await asyncio.gather(*(pool.close() for pool in self._pools.values()))
+
+
+class _PoolAcquire:
+    def __init__(self, pools, name, timeout):
+        self._pools = pools
+        self._name = name
+        self._pool = pools.get_pool(name)
+        self._timeout = timeout
+        self._conn = None
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        self._conn = await self._pool.acquire(timeout=self._timeout)
+        metrics.observe('db_pool_acquire_seconds', time.perf_counter() - started,
+                        self._name)
+        return self._conn
+
+    async def __aexit__(self, *exc_info):
+        conn, self._conn = self._conn, None
+        await self._pool.release(conn)
@@ -0,0 +1,90 @@
+"""
+Горячие запросы к базе: подготавливаются один раз на соединение пула и
+замеряются.
+
+Запрос регистрируется через statement() на уровне модуля, до создания пула;
+соединения пула (PreparedConnection) подготавливают все зарегистрированные
+запросы в init-хуке. fetch/fetchrow/fetchval выполняют подготовленный запрос
+по имени и записывают задержку (db_query_seconds) и число строк
+(db_query_rows) с меткой-именем запроса. timed() замеряет запросы, которые
+нельзя подготовить заранее (с переменным набором фильтров).
+"""
+import time
+
+import asyncpg
+
+from utils import metrics
+
+PREPARED_STATEMENTS = {}
+
+
+def statement(name, sql):
+    """Регистрирует горячий запрос и возвращает его имя."""
+    if name in PREPARED_STATEMENTS:
+        raise ValueError(f"Запрос {name} уже зарегистрирован")
+    PREPARED_STATEMENTS[name] = sql
+    return name
+
+
+class PreparedConnection(asyncpg.Connection):
+    """Соединение пула с подготовленными горячими запросами."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prepared = {}
+
+    async def prepare_statements(self):
+        for name, sql in PREPARED_STATEMENTS.items():
+            self._prepared[name] = await self.prepare(sql)
+
+    async def prepared(self, name, refresh=False):
+        stmt = self._prepared.get(name)
+        if stmt is None or refresh:
+            stmt = self._prepared[name] = await self.prepare(PREPARED_STATEMENTS[name])
+        return stmt
+
+
+async def _run(conn, name, method, args):
+    started = time.perf_counter()
+    try:
+        stmt = await conn.prepared(name)
+        try:
+            result = await getattr(stmt, method)(*args)
+        except asyncpg.FeatureNotSupportedError:
+            # После изменения схемы (например, переключения таблицы эмбеддингов)
+            # сервер отказывается выполнять запрос со старым типом результата
+            if conn.is_in_transaction():
+                raise
+            stmt = await conn.prepared(name, refresh=True)
+            result = await getattr(stmt, method)(*args)
+    finally:
+        metrics.observe('db_query_seconds', time.perf_counter() - started, name)
+    if method == 'fetch':
+        metrics.inc('db_query_rows', len(result), name)
+    elif result is not None:
+        metrics.inc('db_query_rows', 1, name)
+    return result
+
+
+async def fetch(conn, name, *args):
+    return await _run(conn, name, 'fetch', args)
+
+
+async def fetchrow(conn, name, *args):
+    return await _run(conn, name, 'fetchrow', args)
+
+
+async def fetchval(conn, name, *args):
+    return await _run(conn, name, 'fetchval', args)
+
+
+async def timed(name, coro):
+    """Awaits a query that is not prepared and records it under name."""
+    started = time.perf_counter()
+    try:
+        result = await coro
+    finally:
+        metrics.observe('db_query_seconds', time.perf_counter() - started, name)
+    if isinstance(result, list):
+        metrics.inc('db_query_rows', len(result), name)
+    return result
@@ -2,9 +2,14 @@ import asyncio
 from telethon import TelegramClient
 from utils.config import API_ID, API_HASH, BOT_TOKEN
 from database.db_manager import (
-    ensure_vector_extension_exists, init_db_pool, init_db)
+    init_db_pool, init_db, start_settings_listener, stop_settings_listener)
+from database.migrations import apply_migrations
+from database.pools import workload
 from bot.handlers import register_handlers
+from search.embeddings import sync_embedding_models
+from search.vector_index import load_vector_index
 from scheduler.scheduler import setup_scheduler
+from scheduler.posts import restore_scheduled_posts
 from utils.logging_config import setup_logging
 
 
@@ -17,12 +22,17 @@ async def main():
         raise ValueError("Missing Telegram API configuration")
 
     try:
-        print("Ensuring vector extension exists...")
-        await ensure_vector_extension_exists()
+        print("Applying database migrations...")
+        await apply_migrations()
 
         print("Initializing database pool...")
         pool = await init_db_pool()
-        await init_db(pool)
+        # Построение индексов и выгрузка снимка векторов — пакетная нагрузка
+        with workload('batch'):
+            await init_db(pool)
+            await start_settings_listener(pool)
+            await sync_embedding_models(pool)
+            await load_vector_index(pool)
         print("Database initialized successfully")
     except Exception as e:
         print("Database initialization failed")
@@ -37,6 +47,7 @@ async def main():
         print("Setting up handlers and scheduler...")
         await register_handlers(client, pool)
         scheduler = setup_scheduler(client, pool)
+        await restore_scheduled_posts(pool)
 
         try:
             async with client:
@@ -51,6 +62,7 @@ async def main():
         print(f"Fatal error in main loop {e}")
     finally:
         print("Closing database pool...")
+        await stop_settings_listener()
         await pool.close()
         if client and client.is_connected():
             await client.disconnect()
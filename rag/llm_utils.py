@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from typing import List, Dict, Optional
 from transformers import Pipeline, pipeline, AutoTokenizer, \
@@ -11,6 +12,10 @@ model = None
 tokenizer = None
 generator: Pipeline | None = None
 
+# Генерация выполняется в отдельном потоке, чтобы не блокировать цикл событий
+# (публикацию постов, команды бота); вызовы модели идут по одному
+_generation_lock = asyncio.Lock()
+
 def load_model():
     """Load the local language model and tokenizer."""
     global model, tokenizer, generator
@@ -56,20 +61,22 @@ async def generate_with_llm(prompt: str, max_tokens: int = 50) -> Optional[str]:
         Generated text or None if error
     """
     try:
-        if generator is None:
-            load_model()
-
-        # Generate text with more conservative settings for CPU
-        output = generator(
-            prompt,
-            max_new_tokens=max_tokens,
-            temperature=0.7,
-            do_sample=True,
-            top_p=0.9,
-            repetition_penalty=1.1,
-            num_return_sequences=1,
-            pad_token_id=tokenizer.eos_token_id
-        )
+        async with _generation_lock:
+            if generator is None:
+                await asyncio.to_thread(load_model)
+
+            # Generate text with more conservative settings for CPU
+            output = await asyncio.to_thread(
+                generator,
+                prompt,
+                max_new_tokens=max_tokens,
+                temperature=0.7,
+                do_sample=True,
+                top_p=0.9,
+                repetition_penalty=1.1,
+                num_return_sequences=1,
+                pad_token_id=tokenizer.eos_token_id
+            )
 
         # Extract and clean the generated text
         generated_text = output[0]['generated_text'].replace(prompt, '').strip()
@@ -106,18 +113,28 @@ async def generate_theme_description(theme: str) -> str:
     result = await generate_with_llm(prompt)
     return result or f"Тема недели: {theme}"
 
-async def generate_article_summary(article: Dict[str, str]) -> str:
-    """Generate a concise summary of an article."""
+async def generate_article_summary(article: Dict[str, str],
+                                   fallback: bool = True) -> Optional[str]:
+    """
+    Generate a concise summary of an article.
+
+    Uses the full text from 'body' when loaded (see get_article_bodies),
+    otherwise the snippet in 'description'. If generation fails, returns
+    the title, or None when fallback is False.
+    """
+    text = article.get('body') or article.get('description') or ''
     prompt = (
         f"Создай краткое описание статьи в 2-3 предложения. "
         f"Заголовок: {article.get('title', '')}\n"
-        f"Текст: {article.get('description', '')[:1000]}\n\n"
+        f"Текст: {text[:1000]}\n\n"
         "Опиши простым языком, о чем статья, без технических деталей. "
         "Не используй кавычки в ответе."
     )
 
     result = await generate_with_llm(prompt)
-    return result or article.get('title', 'Без названия')
+    if result or not fallback:
+        return result or None
+    return article.get('title', 'Без названия')
 
 def should_exclude_article(article: Dict[str, str]) -> bool:
     """Check if article should be excluded based on title."""
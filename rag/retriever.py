@@ -1,9 +1,11 @@
 from datetime import datetime, timedelta
 from search.lm_search import semantic_search
 
-async def retrieve_relevant_articles(theme: str, pool, days_back=7, top_k=10):
+async def retrieve_relevant_articles(theme: str, pool, days_back=7, top_k=10,
+                                     tags=None, sources=None):
     """
-    Retrieves articles relevant to a theme from the last N days using semantic search.
+    Retrieves articles relevant to a theme from the last N days using semantic search,
+    optionally restricted to articles with any of the given tags or from the given sources.
     """
     print(f"Retrieving top {top_k} articles for theme '{theme}' from the last {days_back} days.")
     
@@ -16,7 +18,9 @@ async def retrieve_relevant_articles(theme: str, pool, days_back=7, top_k=10):
         pool=pool,
         top_k=top_k,
         start_date=start_date,
-        end_date=end_date
+        end_date=end_date,
+        tags=tags,
+        sources=sources
     )
     
     print(f"Found {len(relevant_articles)} relevant articles.")
@@ -2,7 +2,8 @@ import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 from .generator import generate_summary
-from database.db_manager import get_articles_by_date_range, find_similar_articles
+from database.db_manager import get_articles_by_date_range, get_article_bodies
+from search.vector_index import find_similar_articles
 from search.embeddings import generate_embedding
 
 logger = logging.getLogger(__name__)
@@ -58,6 +59,11 @@ async def create_weekly_summary(theme: str, pool,
 
         logger.info(f"Found {len(articles)} relevant articles for summary")
 
+        # Полные тексты нужны только для саммари, в выборках статей — фрагменты
+        bodies = await get_article_bodies(
+            pool, [a['id'] for a in articles if a.get('id') is not None])
+        articles = [dict(a, body=bodies.get(a.get('id'))) for a in articles]
+
         # Generate summary using the RAG model
         summary_text = await generate_summary(theme, articles)
 
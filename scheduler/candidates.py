@@ -0,0 +1,218 @@
+"""
+Пул статей-кандидатов для постов по теме недели.
+
+Пул строится один раз при смене темы: эмбеддинг темы, поиск похожих
+неопубликованных статей (с тегами темы, а если по ним ничего нет — без
+них), отсев анонсов и дублей. После каждого обновления эмбеддингов в пул
+добавляются подходящие новые статьи — сравниваются только эмбеддинги,
+записанные после прошлого обновления. Публикация берет следующего
+кандидата из пула одним запросом (pop_post_candidate).
+
+Саммари статей для постов готовятся заранее: после построения пула и
+после обновления эмбеддингов start_rendering запускает в фоне
+render_candidates — LLM-саммари для publication.prerender_posts лучших
+кандидатов, у которых его еще нет. Одновременно выполняется только одна
+такая задача.
+Публикация берет кандидатов с готовым саммари в первую очередь и сама
+модель не вызывает.
+
+Состояние пула хранится в settings: candidate_pool_theme,
+candidate_pool_tags и candidate_pool_updated_at (время последнего
+учтенного эмбеддинга).
+"""
+import asyncio
+import html
+import logging
+import re
+from datetime import datetime, timezone
+
+from database.db_manager import (get_setting, set_setting,
+                                 replace_post_candidates, add_post_candidates,
+                                 get_post_candidates,
+                                 get_theme_candidates_since,
+                                 get_embeddings_watermark,
+                                 get_unrendered_candidates,
+                                 set_candidate_summary, get_article_bodies,
+                                 get_articles_by_ids)
+from database.pools import workload
+from rag.llm_utils import should_exclude_article, generate_article_summary
+from search.embeddings import generate_embedding
+from search.vector_index import find_similar_articles, WATERMARK_MARGIN
+from utils.config import CANDIDATE_POOL_SIZE, PRERENDER_POSTS
+
+logger = logging.getLogger(__name__)
+
+
+def clean_html(text):
+    """Убирает HTML-теги и раскодирует сущности."""
+    if not text:
+        return ""
+    return html.unescape(re.sub(r'<[^>]+>', '', text)).strip()
+
+
+def _title_key(title):
+    """Заголовок без регистра, пунктуации и эмодзи — для поиска дублей."""
+    return ' '.join(re.findall(r'\w+', (title or '').lower()))
+
+
+def _select_candidates(articles, size, seen_links=(), seen_titles=()):
+    """Отбирает до size статей без анонсов и повторов ссылок и заголовков."""
+    links, titles = set(seen_links), set(seen_titles)
+    selected = []
+    for article in articles:
+        title_key = _title_key(article['title'])
+        if (article['link'] in links or title_key in titles
+                or should_exclude_article(article)):
+            continue
+        links.add(article['link'])
+        titles.add(title_key)
+        selected.append((article['id'], article['link'], article['title'],
+                         float(article['similarity'])))
+        if len(selected) == size:
+            break
+    return selected
+
+
+async def _theme_tags(pool):
+    tags = await get_setting(pool, 'weekly_theme_tags')
+    return [tag for tag in (tags or '').split(',') if tag]
+
+
+async def build_candidate_pool(pool, theme=None, tags=None,
+                               size=CANDIDATE_POOL_SIZE):
+    """
+    Builds the candidate pool for the theme from scratch.
+
+    Args:
+        theme: Theme to rank by (defaults to the weekly theme)
+        tags: Tags to restrict the pool to (defaults to the theme's tags)
+        size: Number of candidates
+
+    Returns:
+        int: Number of candidates in the new pool
+    """
+    theme = theme or await get_setting(pool, 'weekly_theme')
+    if not theme:
+        logger.warning("No weekly theme set, candidate pool not built")
+        return 0
+    if tags is None:
+        tags = await _theme_tags(pool)
+
+    embedding = await generate_embedding(theme)
+    if embedding is None:
+        logger.error("Failed to generate theme embedding for the candidate pool")
+        return 0
+
+    # Эмбеддинги, записанные позже, добавит refresh_candidate_pool
+    watermark = await get_embeddings_watermark(pool)
+    # С запасом: часть статей отсеется как анонсы и дубли
+    articles = await find_similar_articles(
+        pool, embedding, limit=size * 2, tags=tags, exclude_published=True)
+    if not articles and tags:
+        logger.info("No articles match the theme tags, building the pool without them")
+        tags = []
+        articles = await find_similar_articles(
+            pool, embedding, limit=size * 2, exclude_published=True)
+
+    candidates = _select_candidates(articles, size)
+    added = await replace_post_candidates(pool, candidates)
+    await set_setting(pool, 'candidate_pool_theme', theme)
+    await set_setting(pool, 'candidate_pool_tags', ','.join(tags))
+    await set_setting(pool, 'candidate_pool_updated_at',
+                      (watermark or datetime.now(timezone.utc)).isoformat())
+    logger.info(f"Candidate pool for '{theme}' built: {added} articles")
+    return added
+
+
+async def refresh_candidate_pool(pool, size=CANDIDATE_POOL_SIZE):
+    """
+    Adds articles embedded since the last build or refresh to the pool.
+
+    Rebuilds the pool if the weekly theme changed since it was built.
+
+    Returns:
+        int: Number of added candidates
+    """
+    theme = await get_setting(pool, 'weekly_theme')
+    if not theme:
+        return 0
+    updated_at = await get_setting(pool, 'candidate_pool_updated_at')
+    if theme != await get_setting(pool, 'candidate_pool_theme') or not updated_at:
+        return await build_candidate_pool(pool, theme)
+
+    # Эмбеддинг, закоммиченный позже, мог получить updated_at раньше
+    # watermark — последние минуты перепроверяются; статьи, уже бывшие в
+    # пуле, повторно не добавляются
+    since = datetime.fromisoformat(updated_at) - WATERMARK_MARGIN
+    until = await get_embeddings_watermark(pool)
+    if until is None:
+        return 0
+
+    embedding = await generate_embedding(theme)
+    if embedding is None:
+        return 0
+    tags = [tag for tag in (await get_setting(pool, 'candidate_pool_tags') or '').split(',')
+            if tag]
+    articles = await get_theme_candidates_since(pool, embedding, since, until,
+                                                size, tags=tags)
+
+    current = await get_post_candidates(pool)
+    candidates = _select_candidates(
+        articles, size, seen_links=[row['link'] for row in current],
+        seen_titles=[_title_key(row['title']) for row in current])
+    added = await add_post_candidates(pool, candidates, size)
+    await set_setting(pool, 'candidate_pool_updated_at', until.isoformat())
+    if added:
+        logger.info(f"Candidate pool refreshed: {added} new articles")
+    return added
+
+
+async def render_candidates(pool, count=PRERENDER_POSTS):
+    """
+    Prepares LLM summaries for the count best candidates that lack one.
+
+    Returns:
+        int: Number of prepared summaries
+    """
+    pending = await get_unrendered_candidates(pool, count)
+    if not pending:
+        return 0
+    ids = [row['news_id'] for row in pending]
+    bodies = await get_article_bodies(pool, ids)
+    snippets = {row['id']: row['description']
+                for row in await get_articles_by_ids(pool, ids)}
+
+    rendered = 0
+    for row in pending:
+        summary = await generate_article_summary({
+            'title': clean_html(row['title']),
+            'body': clean_html(bodies.get(row['news_id'])),
+            'description': clean_html(snippets.get(row['news_id'])),
+            'link': row['link']
+        }, fallback=False)
+        if not summary:
+            # Кандидат остается без саммари: следующий запуск повторит
+            # попытку, а публикация возьмет фрагмент статьи
+            logger.warning(f"Failed to prepare a summary for {row['link']}")
+            continue
+        await set_candidate_summary(pool, row['news_id'], summary)
+        rendered += 1
+    logger.info(f"Prepared {rendered} post summaries")
+    return rendered
+
+
+_render_task = None
+
+
+def start_rendering(pool, count=PRERENDER_POSTS):
+    """Starts render_candidates in the background unless it is already running."""
+    global _render_task
+    if _render_task is None or _render_task.done():
+        async def render():
+            with workload('batch'):
+                try:
+                    await render_candidates(pool, count)
+                except Exception as e:
+                    logger.error(f"Error preparing post summaries: {e}", exc_info=True)
+        _render_task = asyncio.create_task(render())
+    return _render_task
@@ -2,42 +2,94 @@ import logging
 import random
 from datetime import datetime, timedelta
 from parsers.main_parser import run_parsing
-from search.embeddings import update_embeddings, generate_embedding
+from search.embeddings import (update_embeddings, generate_embedding,
+                               migrate_embeddings)
+from search.vector_index import (find_similar_articles, refresh_vector_index,
+                                 save_vector_snapshot, drop_articles_before)
 from rag.weekly_summary import create_weekly_summary
 from utils.config import TELEGRAM_CHANNEL
 import httpx
 from database.db_manager import (
-    get_setting, set_setting, find_similar_articles,
-    get_published_links, add_published_link, get_articles_by_date_range
+    get_setting, set_setting,
+    add_published_link, get_weekly_summary_candidates,
+    ensure_news_partitions, get_candidate_summaries, get_scheduled_post_links,
+    pop_post_candidate, release_post_candidate
 )
 from utils.telegram_web import send_web_message
+from database.pools import in_workload
+from database.maintenance import apply_retention, run_maintenance
+from scheduler.candidates import (build_candidate_pool, refresh_candidate_pool,
+                                  start_rendering, clean_html)
+from scheduler.posts import schedule_post
 
 logger = logging.getLogger(__name__)
 
+@in_workload('ingest')
 async def scheduled_parsing(client, pool):
     """Job to run parsing of all sources."""
     logger.info("Scheduler: Running scheduled parsing...")
     await run_parsing(client, pool)
     logger.info("Scheduler: Scheduled parsing finished.")
 
+@in_workload('batch')
 async def scheduled_embedding_update(pool):
     """Job to update embeddings for new articles."""
     logger.info("Scheduler: Running scheduled embedding update...")
     await update_embeddings(pool)
+    await refresh_candidate_pool(pool)
+    # Не параллельно с подготовкой, запущенной сменой темы или публикацией
+    start_rendering(pool)
     logger.info("Scheduler: Scheduled embedding update finished.")
 
+@in_workload('batch')
+async def scheduled_embedding_migration(pool):
+    """Job to re-embed articles with the next model and cut over when done."""
+    stats = await migrate_embeddings(pool)
+    if stats["switched"]:
+        logger.info("Scheduler: Embedding model cutover completed.")
+
+@in_workload('batch')
+async def scheduled_vector_index_refresh(pool):
+    """Job to pull embeddings written by other processes into the in-memory index."""
+    added = await refresh_vector_index(pool)
+    if added:
+        logger.info(f"Scheduler: In-memory vector index refreshed, {added} vectors.")
+
+async def scheduled_vector_snapshot():
+    """Job to persist the in-memory vector index for fast restarts."""
+    if await save_vector_snapshot():
+        logger.info("Scheduler: Vector index snapshot saved.")
+
+@in_workload('batch')
+async def scheduled_database_maintenance(pool):
+    """Job to create upcoming news partitions, drop expired ones and vacuum."""
+    logger.info("Scheduler: Running database maintenance...")
+    await ensure_news_partitions(pool)
+    retention = await apply_retention(pool)
+    if retention["partitions"]:
+        dropped = drop_articles_before(retention["cutoff"])
+        logger.info(f"Scheduler: Dropped partitions {', '.join(retention['partitions'])}, "
+                    f"{dropped} vectors removed from the in-memory index.")
+    stats = await run_maintenance(pool, retention)
+    logger.info(f"Scheduler: Database maintenance finished, vacuumed: "
+                f"{len(stats['vacuumed'])}, reindexed: {len(stats['reindexed'])}.")
+
 WEEKLY_THEMES = [
     {
         "title": "🤖 Машинное обучение",
-        "description": "Исследуем последние достижения в области машинного обучения и нейронных сетей."
+        "description": "Исследуем последние достижения в области машинного обучения и нейронных сетей.",
+        # Теги статей, которыми ограничивается поиск для постов по теме
+        "tags": ["machine_learning", "deep_learning", "neural_networks", "neural-network", "pytorch", "машинное обучение"]
     },
     {
         "title": "📊 Обработка данных",
-        "description": "Все о сборе, обработке и анализе больших объемов данных."
+        "description": "Все о сборе, обработке и анализе больших объемов данных.",
+        "tags": ["bigdata", "data_engineering", "data_science"]
     },
     {
         "title": "🧠 Искусственный интеллект",
-        "description": "Новости и исследования в области искусственного интеллекта."
+        "description": "Новости и исследования в области искусственного интеллекта.",
+        "tags": ["artificial_intelligence", "AI"]
     },
     {
         "title": "🔍 Компьютерное зрение",
@@ -87,6 +139,14 @@ async def set_weekly_theme(pool):
         # Save current theme
         await set_setting(pool, 'weekly_theme', theme['title'])
         await set_setting(pool, 'weekly_theme_description', theme['description'])
+        await set_setting(pool, 'weekly_theme_tags', ','.join(theme.get('tags', [])))
+
+        # Пул кандидатов для постов недели
+        try:
+            await build_candidate_pool(pool, theme['title'], theme.get('tags', []))
+            start_rendering(pool)
+        except Exception as e:
+            logger.error(f"Error building candidate pool: {e}", exc_info=True)
 
         # Generate relevant hashtags based on theme
         hashtags = {
@@ -121,6 +181,7 @@ async def set_weekly_theme(pool):
         # Fallback to default theme
         default_theme = "🤖 Искусственный интеллект"
         await set_setting(pool, 'weekly_theme', default_theme)
+        await set_setting(pool, 'weekly_theme_tags', '')
         return default_theme, f"🎯 Новая тема недели: {default_theme}"
 
 async def scheduled_weekly_theme(client, pool):
@@ -166,112 +227,43 @@ async def scheduled_weekly_theme(client, pool):
         except Exception as e2:
             logger.error(f"Scheduler: Failed to send fallback theme announcement: {e2}")
 
-async def publish_scheduled_post(pool, client):
-    """Publish the next scheduled post for today."""
-    try:
-        # Get current day and time
-        now = datetime.now()
-        current_day = now.weekday()  # 0 = Monday, 6 = Sunday
-        current_time = now.strftime('%H:%M')
-
-        # Get scheduled posts
-        scheduled_posts = await get_setting(pool, 'scheduled_posts')
-        if not scheduled_posts:
-            logger.warning("No scheduled posts found")
-            return False
-
-        scheduled_posts = eval(scheduled_posts)  # Convert string back to list
-
-        # Find posts for current day and time
-        posts_to_publish = [
-            p for p in scheduled_posts
-            if p['day'] == current_day and p['time'] == current_time
-        ]
+# Сколько опубликованных за неделю статей попадает в итоги
+WEEKLY_SUMMARY_ARTICLES = 20
 
-        if not posts_to_publish:
-            logger.info(f"No posts scheduled for {current_day} at {current_time}")
-            return False
-
-        # Publish all matching posts
-        for post in posts_to_publish:
-            article = post['article']
-            post_text = f"*{article['title']}*\n\n"
-            if article.get('description'):
-                post_text += f"{article['description']}\n\n"
-            post_text += f"🔗 {article['link']}"
-
-            await send_web_message(
-                chat_id=TELEGRAM_CHANNEL,
-                text=post_text,
-                parse_mode='Markdown'
-            )
-
-            # Mark as published
-            scheduled_posts.remove(post)
-            await set_setting(pool, 'scheduled_posts', str(scheduled_posts))
-
-        return True
-
-    except Exception as e:
-        logger.error(f"Error publishing scheduled post: {e}", exc_info=True)
-        return False
 
+@in_workload('batch')
 async def scheduled_weekly_summary(client, pool):
     """Job to create and post a weekly summary on Friday 20:00."""
     logger.info("Scheduler: Generating weekly summary...")
 
     try:
         # Calculate start and end of the current week (Monday to Sunday)
-        now = datetime.now()
+        now = datetime.now().astimezone()
         start_of_week = now - timedelta(days=now.weekday())  # Monday
         start_of_week = start_of_week.replace(hour=0, minute=0, second=0,
                                               microsecond=0)
-        end_of_week = start_of_week + timedelta(days=6)  # Sunday
-        end_of_week = end_of_week.replace(hour=23, minute=59, second=59,
-                                          microsecond=999999)
-
-        # 1. Get scheduled posts to exclude them
-        scheduled_posts = await get_setting(pool, 'scheduled_posts')
-        if scheduled_posts:
-            scheduled_posts = eval(scheduled_posts)
-            scheduled_links = {p['article']['link'] for p in scheduled_posts}
-        else:
-            scheduled_links = set()
-            logger.info("No scheduled posts found")
-
-        # 2. Get all articles from this week
-        weekly_articles = await get_articles_by_date_range(pool, start_of_week,
-                                                           end_of_week)
-        if not weekly_articles:
-            logger.warning("Scheduler: No articles found for the week")
-            return
+        end_of_week = start_of_week + timedelta(days=7)  # Next Monday
 
-        # 3. Get actually published articles
-        published_links = await get_published_links(pool)
-        if not published_links:
-            logger.warning("No published articles found for weekly summary")
-            return
+        # Posts that are scheduled but not sent yet are not part of the summary
+        scheduled_links = await get_scheduled_post_links(pool)
+
+        # Get theme
+        theme = await get_setting(pool, 'weekly_theme') or "Актуальные новости"
+        theme_embedding = await generate_embedding(theme)
 
-        # 4. Combined filtering:
-        # - must be published (in published_links)
-        # - must not be scheduled (not in scheduled_links)
-        final_articles = [
-            a for a in weekly_articles
-            if
-            a['link'] in published_links and a['link'] not in scheduled_links
-        ]
+        # Articles actually posted this week, ranked by theme similarity
+        final_articles = await get_weekly_summary_candidates(
+            pool, start_of_week, end_of_week, embedding=theme_embedding,
+            exclude_links=scheduled_links, limit=WEEKLY_SUMMARY_ARTICLES)
 
         if not final_articles:
-            logger.warning(
-                "No articles available for weekly summary after filtering")
+            logger.warning("No published articles found for weekly summary")
             return
 
-        # Get theme
-        theme = await get_setting(pool, 'weekly_theme') or "Актуальные новости"
-
         logger.info(
             f"Creating weekly summary for theme '{theme}' ({len(final_articles)} articles)...")
-        summary = await create_weekly_summary(theme, pool, final_articles)
+        summary = await create_weekly_summary(
+            theme, pool, [dict(article) for article in final_articles])
 
         if not summary:
             logger.error("Failed to generate weekly summary content")
@@ -302,35 +294,21 @@ async def publish_article(article, pool):
     """Helper function to publish a single article."""
     try:
         # Check if article should be excluded
-        from rag.llm_utils import should_exclude_article, generate_article_summary
+        from rag.llm_utils import should_exclude_article
 
         if should_exclude_article(article):
             logger.info(f"Skipping article (excluded by filters): {article.get('title', 'No title')}")
             return False
 
-        # Clean HTML tags from title and description
-        import re
-
-        def clean_html(text):
-            if not text:
-                return ""
-            # Remove HTML tags
-            clean_text = re.sub(r'<[^>]+>', '', text)
-            # Decode HTML entities
-            import html
-            clean_text = html.unescape(clean_text)
-            return clean_text.strip()
-
-        # Clean title and description
+        # Clean HTML tags from title
         clean_title = clean_html(article['title'])
-        clean_description = clean_html(article.get('description', ''))
 
-        # Generate a short summary of the article
-        summary = await generate_article_summary({
-            'title': clean_title,
-            'description': clean_description,
-            'link': article.get('link', '')
-        })
+        # The summary is prepared ahead of time (render_candidates); without
+        # it the snippet is used, so publishing never waits for the LLM
+        summary = article.get('summary')
+        if not summary and article.get('id') is not None:
+            summary = (await get_candidate_summaries(pool, [article['id']])).get(article['id'])
+        summary = summary or clean_html(article.get('description', ''))
 
         # Format message with title, summary and link
         message = (
@@ -367,7 +345,8 @@ async def publish_article(article, pool):
         )
 
         if success:
-            await add_published_link(pool, article['link'])
+            await add_published_link(pool, article['link'],
+                                     channel=TELEGRAM_CHANNEL, post_id=success)
             logger.info(f"Scheduler: Successfully published post: {article['link']}")
             return True
         else:
@@ -378,12 +357,49 @@ async def publish_article(article, pool):
         logger.error(f"Scheduler: Error publishing article: {e}", exc_info=True)
         return False
 
-async def scheduled_post_publication(client, pool, time_of_day=None):
+async def _next_candidate(pool, theme, top):
+    """Takes the next article from the candidate pool, building it if needed."""
+    if await get_setting(pool, 'candidate_pool_theme') != theme:
+        # Пул построен для другой темы: при смене темы он не собрался
+        await build_candidate_pool(pool, theme)
+        if await get_setting(pool, 'candidate_pool_theme') != theme:
+            logger.error("Scheduler: Candidate pool is still built for another theme")
+            return None
+    article = await pop_post_candidate(pool, top)
+    if article is None:
+        # Пул исчерпан
+        await build_candidate_pool(pool, theme)
+        article = await pop_post_candidate(pool, top)
+    return article
+
+async def _search_article(pool, theme, top, tags, sources):
+    """Searches for an article by explicit tag/source filters, bypassing the pool."""
+    theme_embedding = await generate_embedding(theme)
+    if not theme_embedding:
+        logger.error("Scheduler: Failed to generate theme embedding")
+        return None
+    new_articles = await find_similar_articles(
+        pool, theme_embedding, limit=top, tags=tags, sources=sources,
+        exclude_published=True)
+    return random.choice(new_articles) if new_articles else None
+
+async def scheduled_post_publication(client, pool, time_of_day=None,
+                                     tags=None, sources=None):
     """
     Job to publish relevant articles based on the weekly theme.
 
     Args:
         time_of_day: 'morning' or 'evening' to select which post to publish
+        tags: Only consider articles with any of these tags
+        sources: Only consider articles from these sources
+
+    Without tags and sources the article is taken from the candidate pool
+    (scheduler.candidates), built with the weekly theme's tags. The post is
+    queued in scheduled_posts and sent right away by scheduler.posts.
+
+    Returns:
+        scheduled_posts.id of the queued post, or None/False if nothing
+        was queued
     """
     logger.info(f"Scheduler: Running scheduled post publication ({time_of_day or 'unspecified time'})")
 
@@ -396,33 +412,25 @@ async def scheduled_post_publication(client, pool, time_of_day=None):
             logger.warning("Scheduler: No weekly theme set. Skipping post publication.")
             return
 
-        # Generate embedding for the theme
-        theme_embedding = await generate_embedding(theme)
-        if not theme_embedding:
-            logger.error("Scheduler: Failed to generate theme embedding")
-            return
-
-        # Find relevant articles (increase limit to get more variety)
-        articles = await find_similar_articles(pool, theme_embedding, limit=15)
-        if not articles:
-            logger.warning("Scheduler: No relevant articles found for the theme")
-            return
-
-        # Filter out already published articles
-        published_links = await get_published_links(pool)
-        new_articles = [a for a in articles if a['link'] not in published_links]
-
-        if not new_articles:
+        # Утренний пост — лучший кандидат, вечерний — случайный из пяти лучших
+        top = 1 if time_of_day == 'morning' else 5
+        if tags is None and sources is None:
+            article = await _next_candidate(pool, theme, top)
+        else:
+            article = await _search_article(pool, theme, top, tags, sources)
+        if article is None:
             logger.info("Scheduler: No new articles to publish")
             return
 
+        # Саммари подготовлено заранее; если его нет — фрагмент статьи
+        text = article.get('summary') or article.get('description') or ''
+
         # Get current day of week (0=Monday, 6=Sunday)
         day_of_week = datetime.now().weekday()
 
         # Select and format article based on time of day and day of week
         if time_of_day == 'morning':
             # Morning post: More technical/in-depth
-            article = new_articles[0]
 
             # Add different intros based on day of week
             day_intros = [
@@ -441,14 +449,13 @@ async def scheduled_post_publication(client, pool, time_of_day=None):
                 f"📌 *{theme}*\n"
                 f"{theme_desc}\n\n"
                 f"🔍 *{article['title']}*\n"
-                f"{article.get('description', '')}\n\n"
+                f"{text}\n\n"
                 f"📖 Читать полностью: {article['link']}"
             )
 
         else:  # Evening post
             # Evening post: More engaging/entertaining
-            # Select from top 5 most relevant articles
-            article = random.choice(new_articles[:min(5, len(new_articles))])
+            # The article is one of the top 5 most relevant
 
             # Different formats for different days
             if day_of_week in [0, 2, 4]:  # Mon, Wed, Fri
@@ -456,7 +463,7 @@ async def scheduled_post_publication(client, pool, time_of_day=None):
                     f"🌙 Вечерний дайджест по теме *{theme}*\n\n"
                     f"{random.choice(['Сегодня мы нашли для вас интересный материал:', 'Рекомендуем к прочтению:', 'Что нового в этой теме?'])}"
                     f"\n\n*{article['title']}*\n"
-                    f"{article.get('description', '')}\n\n"
+                    f"{text}\n\n"
                     f"🔗 {article['link']}\n\n"
                     f"💬 Обсудим в комментариях?"
                 )
@@ -471,7 +478,7 @@ async def scheduled_post_publication(client, pool, time_of_day=None):
 
                 message = (
                     f"✨ *{article['title']}*\n\n"
-                    f"{article.get('description', '')}\n\n"
+                    f"{text}\n\n"
                     f"{random.choice(questions)}\n\n"
                     f"📌 Тема недели: {theme}\n"
                     f"🔗 {article['link']}"
@@ -493,22 +500,21 @@ async def scheduled_post_publication(client, pool, time_of_day=None):
         emojis = ['💡', '🚀', '🔍', '📚', '🧠', '🎯', '📈', '🤖']
         message += f"\n\n{random.choice(emojis)} {hashtags}"
 
-        # Send to channel
-        success = await send_web_message(
-            chat_id=TELEGRAM_CHANNEL,
-            text=message,
-            parse_mode='Markdown',
-            disable_web_page_preview=False
-        )
-
-        if success:
-            # Mark as published
-            await add_published_link(pool, article['link'])
-            logger.info(f"Scheduler: Published article: {article['title']}")
-            return True
-        else:
-            logger.error("Scheduler: Failed to publish article")
-            raise RuntimeError("Scheduler: Failed to publish article")
+        # Пост отправляет одноразовое задание scheduler.posts; ссылка
+        # попадает в published_links после отправки, а при ошибке статья
+        # возвращается в пул кандидатов
+        try:
+            scheduled_id = await schedule_post(
+                pool, message, datetime.now().astimezone(),
+                parse_mode='Markdown', disable_web_page_preview=False,
+                news_id=article['id'], link=article['link'])
+        except Exception:
+            await release_post_candidate(pool, article['id'])
+            raise
+        logger.info(f"Scheduler: Article queued as post #{scheduled_id}: {article['title']}")
+        # Саммари для следующих постов готовятся в фоне
+        start_rendering(pool)
+        return scheduled_id
 
     except Exception as e:
         logger.error(f"Scheduler: Error during post publication: {e}", exc_info=True)
@@ -0,0 +1,167 @@
+"""
+Посты на точное время.
+
+Каждый ожидающий пост из таблицы scheduled_posts — одноразовое задание
+планировщика (триггер date) с id scheduled_post_<id>. Задание создается
+при планировании поста и восстанавливается из таблицы при старте бота.
+Перед отправкой пост переводится в статус sending одним UPDATE, поэтому
+при нескольких экземплярах бота он отправляется один раз.
+
+Через scheduled_posts отправляются и регулярные посты по теме недели
+(scheduled_post_publication ставит их со временем слота), и посты из
+старой настройки settings.scheduled_posts (миграция 10).
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+
+from apscheduler.jobstores.base import JobLookupError
+
+from database.db_manager import (add_scheduled_post, get_pending_scheduled_posts,
+                                 claim_scheduled_post, finish_scheduled_post,
+                                 cancel_scheduled_post, add_published_link,
+                                 release_post_candidate, fail_stale_scheduled_posts)
+from utils.config import TELEGRAM_CHANNEL
+from utils.telegram_web import send_web_message
+
+logger = logging.getLogger(__name__)
+
+# Пост, опоздавший больше чем на столько секунд (бот был выключен),
+# не отправляется и получает статус missed
+MISFIRE_GRACE_TIME = 3600
+
+_scheduler = None
+
+
+def attach_scheduler(scheduler):
+    """Sets the scheduler that runs the one-shot post jobs."""
+    global _scheduler
+    _scheduler = scheduler
+
+
+def _job_id(scheduled_id):
+    return f'scheduled_post_{scheduled_id}'
+
+
+def _add_job(pool, scheduled_id, due_at):
+    if _scheduler is None:
+        # Пост сохранен в таблице, задание создаст restore_scheduled_posts
+        return
+    _scheduler.add_job(
+        publish_scheduled_post,
+        'date',
+        run_date=max(due_at, datetime.now(timezone.utc)),
+        args=[pool, scheduled_id],
+        id=_job_id(scheduled_id),
+        name=f'Scheduled Post #{scheduled_id}',
+        replace_existing=True,
+        misfire_grace_time=MISFIRE_GRACE_TIME
+    )
+
+
+async def schedule_post(pool, text, due_at, channel=TELEGRAM_CHANNEL,
+                        parse_mode='Markdown', disable_web_page_preview=False,
+                        news_id=None, link=None):
+    """
+    Schedules a post to be sent at due_at.
+
+    Args:
+        text: Ready message text
+        due_at: Send time; naive datetimes are taken as local time
+        news_id, link: The article the post is about; the link is recorded
+            in published_links once the post is sent
+
+    Returns:
+        int: scheduled_posts.id
+    """
+    due_at = due_at.astimezone()
+    scheduled_id = await add_scheduled_post(
+        pool, due_at, channel, text, parse_mode=parse_mode,
+        disable_web_page_preview=disable_web_page_preview,
+        news_id=news_id, link=link)
+    _add_job(pool, scheduled_id, due_at)
+    logger.info(f"Post #{scheduled_id} scheduled for {due_at:%Y-%m-%d %H:%M %Z}")
+    return scheduled_id
+
+
+async def cancel_post(pool, scheduled_id):
+    """Cancels a pending post. Returns True if it was pending."""
+    cancelled = await cancel_scheduled_post(pool, scheduled_id)
+    if _scheduler is not None:
+        try:
+            _scheduler.remove_job(_job_id(scheduled_id))
+        except JobLookupError:
+            pass
+    return cancelled
+
+
+async def restore_scheduled_posts(pool):
+    """
+    Creates jobs for the pending posts after a restart.
+
+    Posts that are overdue by more than MISFIRE_GRACE_TIME are marked as
+    missed, the rest are sent at their time or right away. Posts left in
+    'sending' by a stopped process are marked as failed once they are
+    overdue by MISFIRE_GRACE_TIME, and their articles return to the
+    candidate pool.
+
+    Returns:
+        int: Number of restored jobs
+    """
+    now = datetime.now(timezone.utc)
+    for post in await fail_stale_scheduled_posts(
+            pool, now - timedelta(seconds=MISFIRE_GRACE_TIME)):
+        logger.warning(f"Scheduled post #{post['id']} was interrupted while sending")
+        if post['news_id'] is not None:
+            await release_post_candidate(pool, post['news_id'])
+
+    restored = 0
+    for post in await get_pending_scheduled_posts(pool):
+        if post['due_at'] < now - timedelta(seconds=MISFIRE_GRACE_TIME):
+            await finish_scheduled_post(pool, post['id'], 'missed',
+                                        error='bot was not running at due time')
+            logger.warning(f"Scheduled post #{post['id']} missed "
+                           f"(was due at {post['due_at']})")
+            continue
+        _add_job(pool, post['id'], post['due_at'])
+        restored += 1
+    if restored:
+        logger.info(f"Restored {restored} scheduled posts")
+    return restored
+
+
+async def _fail(pool, post, error):
+    await finish_scheduled_post(pool, post['id'], 'failed', error=error)
+    if post['news_id'] is not None:
+        # Статья из пула кандидатов вернется в него до следующей публикации
+        await release_post_candidate(pool, post['news_id'])
+
+
+async def publish_scheduled_post(pool, scheduled_id):
+    """Job that sends one scheduled post."""
+    post = await claim_scheduled_post(pool, scheduled_id)
+    if post is None:
+        return False
+
+    try:
+        message_id = await send_web_message(
+            chat_id=post['channel'],
+            text=post['text'],
+            parse_mode=post['parse_mode'],
+            disable_web_page_preview=post['disable_web_page_preview']
+        )
+    except Exception as e:
+        logger.error(f"Error publishing scheduled post #{scheduled_id}: {e}",
+                     exc_info=True)
+        await _fail(pool, post, str(e))
+        return False
+
+    if not message_id:
+        await _fail(pool, post, 'Telegram API request failed')
+        return False
+
+    await finish_scheduled_post(pool, scheduled_id, 'sent', message_id=message_id)
+    if post['link']:
+        await add_published_link(pool, post['link'], channel=post['channel'],
+                                 post_id=message_id)
+    logger.info(f"Scheduled post #{scheduled_id} published")
+    return True
@@ -1,12 +1,18 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from utils.config import (MEMORY_INDEX_ENABLED, MEMORY_INDEX_REFRESH_MINUTES,
+                          STORAGE_MAINTENANCE_HOUR)
 from .jobs import (
     scheduled_parsing,
     scheduled_embedding_update,
+    scheduled_embedding_migration,
+    scheduled_vector_index_refresh,
+    scheduled_vector_snapshot,
+    scheduled_database_maintenance,
     scheduled_weekly_summary,
     scheduled_post_publication,
-    scheduled_weekly_theme,
-    publish_scheduled_post
+    scheduled_weekly_theme
 )
+from .posts import attach_scheduler
 
 
 def setup_scheduler(client, pool):
@@ -39,6 +45,57 @@ def setup_scheduler(client, pool):
         misfire_grace_time=300
     )
 
+    # Фоновая миграция эмбеддингов на новую модель (если она запущена)
+    scheduler.add_job(
+        scheduled_embedding_migration,
+        'interval',
+        minutes=15,
+        args=[pool],
+        id='embedding_migration_job',
+        name='Embedding Model Migration',
+        replace_existing=True,
+        max_instances=1,
+        misfire_grace_time=300
+    )
+
+    # Индекс эмбеддингов в памяти: догрузка новых векторов и снимок на диск
+    if MEMORY_INDEX_ENABLED:
+        scheduler.add_job(
+            scheduled_vector_index_refresh,
+            'interval',
+            minutes=MEMORY_INDEX_REFRESH_MINUTES,
+            args=[pool],
+            id='vector_index_refresh_job',
+            name='Refresh In-Memory Vector Index',
+            replace_existing=True,
+            max_instances=1,
+            misfire_grace_time=300
+        )
+        scheduler.add_job(
+            scheduled_vector_snapshot,
+            'interval',
+            hours=1,
+            id='vector_snapshot_job',
+            name='Save Vector Index Snapshot',
+            replace_existing=True,
+            max_instances=1,
+            misfire_grace_time=300
+        )
+
+    # Обслуживание базы: секции news, срок хранения, VACUUM и индексы
+    scheduler.add_job(
+        scheduled_database_maintenance,
+        'cron',
+        hour=STORAGE_MAINTENANCE_HOUR,
+        minute=0,
+        args=[pool],
+        id='database_maintenance_job',
+        name='Database Maintenance',
+        replace_existing=True,
+        max_instances=1,
+        misfire_grace_time=3600
+    )
+
     # 2. Weekly Theme and Content Schedule
     scheduler.add_job(
         scheduled_weekly_theme,
@@ -116,17 +173,8 @@ def setup_scheduler(client, pool):
         misfire_grace_time=3600
     )
 
-    # Публикация запланированных постов (каждые 5 минут)
-    scheduler.add_job(
-        publish_scheduled_post,
-        'interval',
-        minutes=5,
-        args=[pool, client],
-        id='publish_scheduled_posts',
-        name='Publish Scheduled Posts',
-        replace_existing=True,
-        misfire_grace_time=300
-    )
+    # Посты на точное время — одноразовые задания, см. scheduler.posts
+    attach_scheduler(scheduler)
 
     print("Scheduler has been configured with jobs.")
     return scheduler
@@ -0,0 +1,182 @@
+"""
+Многопроцессный бэкфилл эмбеддингов.
+
+Статьи без эмбеддингов делятся на диапазоны news.id примерно одинакового
+размера, и каждый диапазон обрабатывается отдельным процессом. Каждый процесс
+один раз загружает модель, ограничивает число потоков PyTorch своей долей
+ядер и пишет эмбеддинги пакетами. Прогресс собирается в главном процессе.
+
+Повторный запуск продолжает с места остановки: в работу берутся только
+статьи, у которых эмбеддинга еще нет.
+
+Запуск:
+    python -m search.backfill --workers 4
+    python -m search.backfill --workers 4 --migration  # векторы новой модели
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _pin_threads(threads):
+    """Ограничивает число потоков BLAS/OpenMP до загрузки torch."""
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS',
+                'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+
+
+async def _run_shard(shard, min_id, max_id, table, progress):
+    # Импорт здесь: модель должна загружаться уже после настройки потоков
+    from database.db_manager import (init_db_pool, NEXT_EMBEDDINGS_TABLE,
+                                     iter_articles_without_embeddings)
+    from search import embeddings
+    from utils.config import (EMBEDDING_BATCH_SIZE, EMBEDDING_FETCH_SIZE,
+                              EMBEDDING_MAX_CHARS)
+
+    pool = await init_db_pool(workloads=('batch',))
+    try:
+        migration = table == NEXT_EMBEDDINGS_TABLE
+        await embeddings.sync_embedding_models(pool, load_next=migration)
+        if migration:
+            encoder, encoder_id = embeddings.next_model, embeddings.next_model_id
+        else:
+            encoder, encoder_id = embeddings.model, embeddings.model_id
+
+        async for page in iter_articles_without_embeddings(
+                pool, batch_size=EMBEDDING_FETCH_SIZE,
+                max_chars=EMBEDDING_MAX_CHARS, min_id=min_id, max_id=max_id,
+                table=table):
+            processed, errors, reused = await embeddings.embed_articles(
+                pool, page, EMBEDDING_BATCH_SIZE, encoder=encoder,
+                encoder_id=encoder_id, table=table)
+            progress.put((shard, processed, errors, reused))
+    finally:
+        await pool.close()
+
+
+def _worker(shard, min_id, max_id, table, threads, progress):
+    """Точка входа процесса-воркера."""
+    _pin_threads(threads)
+    import torch
+    torch.set_num_threads(threads)
+
+    from utils.logging_config import setup_logging
+    setup_logging()
+    logger.info(f"[BACKFILL] Воркер {shard}: id {min_id}..{max_id}, потоков: {threads}")
+
+    try:
+        asyncio.run(_run_shard(shard, min_id, max_id, table, progress))
+    except Exception as e:
+        logger.error(f"[BACKFILL] Воркер {shard} завершился с ошибкой: {e}",
+                     exc_info=True)
+        raise
+
+
+async def _load_shards(workers, table):
+    from database.db_manager import init_db_pool, get_pending_embedding_ranges
+
+    pool = await init_db_pool(workloads=('batch',))
+    try:
+        return await get_pending_embedding_ranges(pool, workers, table=table)
+    finally:
+        await pool.close()
+
+
+def run_backfill(workers, threads=None, report_interval=10.0,
+                 migration=False):
+    """
+    Запускает бэкфилл эмбеддингов в нескольких процессах.
+
+    Args:
+        workers: Количество процессов-воркеров
+        threads: Потоков PyTorch на воркер (по умолчанию ядра / воркеры)
+        report_interval: Как часто печатать прогресс, в секундах
+        migration: Заполнять article_embeddings_next моделью, на которую
+            идет миграция, вместо активной таблицы
+
+    Returns:
+        Словарь со статистикой: {'processed': ..., 'errors': ..., 'reused': ...}
+    """
+    from database.db_manager import (ACTIVE_EMBEDDINGS_TABLE,
+                                     NEXT_EMBEDDINGS_TABLE)
+    table = NEXT_EMBEDDINGS_TABLE if migration else ACTIVE_EMBEDDINGS_TABLE
+
+    shards = asyncio.run(_load_shards(workers, table))
+    total = sum(row['pending'] for row in shards)
+    if not total:
+        logger.info("[BACKFILL] Нет статей без эмбеддингов.")
+        return {"processed": 0, "errors": 0, "reused": 0}
+
+    threads = threads or max(1, (os.cpu_count() or 1) // len(shards))
+    logger.info(f"[BACKFILL] {total} статей, {len(shards)} воркеров по {threads} потоков")
+
+    ctx = mp.get_context('spawn')
+    progress = ctx.Queue()
+    processes = [
+        ctx.Process(target=_worker,
+                    args=(i, row['min_id'], row['max_id'], table, threads,
+                          progress),
+                    name=f"embedding-backfill-{i}")
+        for i, row in enumerate(shards)
+    ]
+    for process in processes:
+        process.start()
+
+    processed = 0
+    errors = 0
+    reused = 0
+    started = time.monotonic()
+    last_report = started
+    while any(p.is_alive() for p in processes) or not progress.empty():
+        try:
+            _, done, failed, skipped = progress.get(timeout=1.0)
+            processed += done
+            errors += failed
+            reused += skipped
+        except queue.Empty:
+            pass
+
+        now = time.monotonic()
+        if now - last_report >= report_interval:
+            rate = processed / (now - started)
+            eta = (total - processed - errors) / rate if rate else float('inf')
+            logger.info(f"[BACKFILL] {processed}/{total} ({processed * 100 / total:.1f}%), "
+                        f"ошибок: {errors}, {rate:.1f} статей/с, осталось ~{eta:.0f} с")
+            last_report = now
+
+    for process in processes:
+        process.join()
+        if process.exitcode:
+            logger.error(f"[BACKFILL] {process.name} завершился с кодом {process.exitcode}")
+
+    elapsed = time.monotonic() - started
+    logger.info(f"[BACKFILL] Готово за {elapsed:.0f} с. Обработано: {processed}, ошибок: {errors}, "
+                f"переиспользовано без инференса: {reused}")
+    return {"processed": processed, "errors": errors, "reused": reused}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэкфилл эмбеддингов")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Количество процессов (по умолчанию число ядер)")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="Потоков PyTorch на процесс")
+    parser.add_argument('--migration', action='store_true',
+                        help="Заполнять векторы модели, на которую идет миграция "
+                             "(миграция должна быть запущена ботом через embeddings.next_model)")
+    args = parser.parse_args()
+
+    from utils.logging_config import setup_logging
+    setup_logging()
+    run_backfill(args.workers, args.threads, migration=args.migration)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,113 @@
-from sentence_transformers import SentenceTransformer
+import asyncio
+import hashlib
+import unicodedata
 import numpy as np
 import logging
-from typing import Optional, List, Dict, Any
-from database.db_manager import get_articles_without_embeddings, add_embedding
+from typing import Optional, List, Dict, Any, Tuple
+from search.encoder import load_encoder
+from search.vector_index import (index_embeddings, load_vector_index,
+                                 reset_vector_index)
+from database.db_manager import (iter_articles_without_embeddings,
+                                 add_embedding, add_embeddings_bulk,
+                                 get_embeddings_by_hash, get_embedding_models,
+                                 register_active_embedding_model,
+                                 start_embedding_migration,
+                                 get_embedding_migration_status,
+                                 cutover_embedding_model,
+                                 ensure_vector_index,
+                                 ACTIVE_EMBEDDINGS_TABLE,
+                                 NEXT_EMBEDDINGS_TABLE)
+from utils.config import (EMBEDDING_BATCH_SIZE, EMBEDDING_FETCH_SIZE,
+                          EMBEDDING_MAX_CHARS, EMBEDDING_TOKEN_BUDGET,
+                          EMBEDDING_MODEL, EMBEDDING_NEXT_MODEL,
+                          EMBEDDING_ONNX_FILE, EMBEDDING_NEXT_ONNX_FILE,
+                          EMBEDDING_MIGRATION_BATCH)
 
 logger = logging.getLogger(__name__)
-model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+
+# Активная модель: ей кодируются запросы и статьи в article_embeddings
+model = load_encoder()
+model_id = EMBEDDING_MODEL
+
+# Модель, на которую идет миграция (article_embeddings_next), если есть
+next_model = None
+next_model_id = None
+
+def make_length_batches(lengths: List[int], max_batch_size: int,
+                        token_budget: int) -> List[List[int]]:
+    """
+    Группирует индексы текстов в батчи близкой длины.
+
+    Индексы сортируются по длине в токенах, после чего батч закрывается,
+    когда паддинг до самого длинного текста превысил бы token_budget
+    или батч достиг max_batch_size.
+
+    Args:
+        lengths: Длины текстов в токенах
+        max_batch_size: Максимальное количество текстов в батче
+        token_budget: Максимум токенов в батче с учетом паддинга
+
+    Returns:
+        Список батчей, каждый батч — список индексов исходных текстов
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches = []
+    current = []
+    for idx in order:
+        # Тексты идут по возрастанию длины, поэтому текущий — самый длинный
+        padded = (len(current) + 1) * max(lengths[idx], 1)
+        if current and (padded > token_budget or len(current) >= max_batch_size):
+            batches.append(current)
+            current = []
+        current.append(idx)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _token_lengths(texts: List[str], encoder) -> List[int]:
+    """Считает длину текстов в токенах с учетом обрезки модели."""
+    encoded = encoder.tokenizer(
+        texts,
+        truncation=True,
+        max_length=encoder.max_seq_length,
+        add_special_tokens=True
+    )
+    return [len(ids) for ids in encoded['input_ids']]
+
+
+def encode_texts(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE,
+                 token_budget: int = EMBEDDING_TOKEN_BUDGET,
+                 encoder=None) -> np.ndarray:
+    """
+    Кодирует тексты батчами одинаковой длины, чтобы не тратить время на паддинг.
+
+    Args:
+        texts: Тексты для векторизации
+        batch_size: Максимальное количество текстов в батче
+        token_budget: Максимум токенов в батче с учетом паддинга
+        encoder: Модель для кодирования (по умолчанию активная)
+
+    Returns:
+        Матрица эмбеддингов float32 в исходном порядке текстов
+    """
+    encoder = encoder or model
+    dim = encoder.get_sentence_embedding_dimension()
+    result = np.empty((len(texts), dim), dtype=np.float32)
+    if not texts:
+        return result
+
+    lengths = _token_lengths(texts, encoder)
+    for indices in make_length_batches(lengths, batch_size, token_budget):
+        # Записываем результат по исходным индексам, восстанавливая порядок
+        result[indices] = encoder.encode(
+            [texts[i] for i in indices],
+            batch_size=len(indices),
+            show_progress_bar=False,
+            convert_to_numpy=True
+        )
+    return result
+
 
 async def generate_embedding(text: str) -> Optional[List[float]]:
     """
@@ -21,111 +123,294 @@ async def generate_embedding(text: str) -> Optional[List[float]]:
         logger.warning("Пустой или неверный формат текста для генерации эмбеддинга")
         return None
     try:
-        embedding = model.encode(text, convert_to_numpy=True).tolist()
+        # Кодирование в потоке не блокирует цикл событий: параллельные
+        # запросы к БД (hybrid_search) выполняются в это время
+        embedding = (await asyncio.to_thread(
+            model.encode, text, convert_to_numpy=True)).tolist()
         logger.debug(f"Успешно сгенерирован эмбеддинг для текста: {text[:100]}...")
         return embedding
     except Exception as e:
         logger.error(f"Ошибка генерации эмбеддинга: {e}")
         return None
 
-async def update_embeddings(pool, batch_size: int = 32) -> Dict[str, int]:
+async def update_embeddings(pool, batch_size: int = EMBEDDING_BATCH_SIZE) -> Dict[str, int]:
     """
     Находит статьи без эмбеддингов, генерирует их и сохраняет в БД.
+
+    Статьи читаются из БД потоково, порциями по EMBEDDING_FETCH_SIZE,
+    поэтому потребление памяти не зависит от размера очереди.
     
     Args:
         pool: Пул подключений к БД
-        batch_size: Размер батча для обработки (по умолчанию 32)
+        batch_size: Максимальный размер батча для model.encode (по умолчанию 32)
         
     Returns:
         Словарь со статистикой: {
             'processed': количество успешно обработанных статей,
-            'errors': количество ошибок
+            'errors': количество ошибок,
+            'reused': сколько эмбеддингов взято по хэшу текста без инференса
         }
     """
     processed = 0
     errors = 0
+    reused = 0
+    found = 0
     
     try:
-        # Получаем все статьи без эмбеддингов
-        articles = await get_articles_without_embeddings(pool)
-        if not articles:
+        async for page in iter_articles_without_embeddings(
+                pool, batch_size=EMBEDDING_FETCH_SIZE,
+                max_chars=EMBEDDING_MAX_CHARS):
+            found += len(page)
+            logger.info(f"Получено {len(page)} статей без эмбеддингов (всего {found}). Обрабатываем...")
+
+            # Страница кодируется целиком: encode_texts сам разбивает её
+            # на батчи близкой длины
+            page_processed, page_errors, page_reused = await embed_articles(
+                pool, page, batch_size)
+            processed += page_processed
+            errors += page_errors
+            reused += page_reused
+
+        if not found:
             logger.info("Нет статей для обновления эмбеддингов.")
-            return {"processed": 0, "errors": 0}
-            
-        logger.info(f"Найдено {len(articles)} статей без эмбеддингов. Начинаем обработку...")
-        
-        # Обрабатываем статьи батчами
-        for i in range(0, len(articles), batch_size):
-            batch = articles[i:i + batch_size]
-            batch_texts = []
-            valid_articles = []
-            
-            # Подготавливаем текст для эмбеддинга
-            for article in batch:
-                text_parts = []
-                if article['title']:
-                    text_parts.append(article['title'])
-                if article['description']:
-                    text_parts.append(article['description'])
-                
-                if not text_parts:
-                    logger.warning(f"Пустые title и description у статьи {article['link']}")
-                    errors += 1
-                    continue
-                
-                # Используем published date для логирования, если доступно
-                pub_date = article.get('published', 'без даты')
-                logger.info(f"Обработка статьи: {article['title'][:50]}... (опубликовано: {pub_date})")
-                
-                text = ' '.join(text_parts)
-                batch_texts.append(text)
-                valid_articles.append(article)
-            
-            if not batch_texts:
-                continue
-                
-            try:
-                # Генерируем эмбеддинги для батча
-                embeddings = model.encode(
-                    batch_texts,
-                    batch_size=len(batch_texts),
-                    show_progress_bar=False,
-                    convert_to_numpy=True
-                )
-                
-                # Сохраняем эмбеддинги
-                for j, embedding in enumerate(embeddings):
-                    if j >= len(valid_articles):
-                        break
-                        
-                    article = valid_articles[j]
-                    try:
-                        # Преобразуем numpy массив в список
-                        embedding_list = embedding.tolist()
-                        
-                        # Сохраняем эмбеддинг
-                        await add_embedding(
-                            pool=pool,
-                            article_id=article['link'],
-                            embedding=embedding_list
-                        )
-                        processed += 1
-                        
-                        if processed % 10 == 0:
-                            logger.info(f"Обработано {processed} эмбеддингов...")
-                            
-                    except Exception as e:
-                        logger.error(f"Ошибка при сохранении эмбеддинга для статьи {article.get('link', 'unknown')}: {e}")
-                        errors += 1
-                        
-            except Exception as e:
-                logger.error(f"Ошибка при генерации эмбеддингов для батча: {e}")
-                errors += len(batch_texts)
-                continue
+            return {"processed": 0, "errors": 0, "reused": 0}
                 
-        logger.info(f"Обновление эмбеддингов завершено. Обработано: {processed}, ошибок: {errors}")
-        return {"processed": processed, "errors": errors}
+        logger.info(f"Обновление эмбеддингов завершено. Обработано: {processed}, ошибок: {errors}, "
+                    f"переиспользовано без инференса: {reused}")
+        return {"processed": processed, "errors": errors, "reused": reused}
         
     except Exception as e:
         logger.error(f"Критическая ошибка при обновлении эмбеддингов: {e}", exc_info=True)
-        return {"processed": processed, "errors": errors + (len(articles) - processed) if 'articles' in locals() else 1}
\ No newline at end of file
+        return {"processed": processed, "errors": errors + 1, "reused": reused}
+
+
+def content_hash(text: str) -> str:
+    """Хэш текста после нормализации пробелов: одинаковые репосты дают один хэш."""
+    normalized = ' '.join(unicodedata.normalize('NFC', text).split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+async def embed_articles(pool, batch, batch_size: int, encoder=None,
+                         encoder_id: Optional[str] = None,
+                         table: str = ACTIVE_EMBEDDINGS_TABLE) -> Tuple[int, int, int]:
+    """
+    Генерирует и сохраняет эмбеддинги для порции статей.
+
+    Перед инференсом эмбеддинги ищутся по хэшу текста, как в БД, так и внутри
+    самой порции, поэтому одинаковые тексты кодируются только один раз.
+
+    Args:
+        pool: Пул подключений к БД
+        batch: Статьи (id, link, title, description, published)
+        batch_size: Максимальный размер батча для model.encode
+        encoder: Модель для кодирования (по умолчанию активная)
+        encoder_id: Идентификатор модели encoder
+        table: Таблица, в которую пишутся эмбеддинги
+
+    Returns:
+        Кортеж (обработано, ошибок, переиспользовано)
+    """
+    processed = 0
+    errors = 0
+    batch_texts = []
+    valid_articles = []
+    
+    # Подготавливаем текст для эмбеддинга
+    for article in batch:
+        text_parts = []
+        if article['title']:
+            text_parts.append(article['title'])
+        if article['description']:
+            text_parts.append(article['description'])
+        
+        if not text_parts:
+            logger.warning(f"Пустые title и description у статьи {article['link']}")
+            errors += 1
+            continue
+        
+        # Используем published date для логирования, если доступно
+        pub_date = article.get('published', 'без даты')
+        logger.info(f"Обработка статьи: {(article['title'] or '')[:50]}... (опубликовано: {pub_date})")
+        
+        text = ' '.join(text_parts)
+        batch_texts.append(text)
+        valid_articles.append(article)
+    
+    if not batch_texts:
+        return processed, errors, 0
+
+    if encoder is None:
+        encoder, encoder_id = model, model_id
+
+    hashes = [content_hash(text) for text in batch_texts]
+    try:
+        vectors = await get_embeddings_by_hash(pool, list(set(hashes)),
+                                               encoder_id, table=table)
+    except Exception as e:
+        logger.warning(f"Не удалось получить эмбеддинги по хэшу: {e}")
+        vectors = {}
+
+    # Кодируем только тексты, которых еще нет ни в БД, ни выше в порции
+    to_encode = {}
+    for text_hash, text in zip(hashes, batch_texts):
+        if text_hash not in vectors and text_hash not in to_encode:
+            to_encode[text_hash] = text
+    reused = len(batch_texts) - len(to_encode)
+        
+    try:
+        # Генерируем эмбеддинги батчами, сгруппированными по длине
+        embeddings = encode_texts(list(to_encode.values()),
+                                  batch_size=batch_size, encoder=encoder)
+    except Exception as e:
+        logger.error(f"Ошибка при генерации эмбеддингов для батча: {e}")
+        return processed, errors + len(batch_texts), 0
+    vectors.update(zip(to_encode.keys(), embeddings))
+        
+    # Сохраняем эмбеддинги одним пакетом
+    items = [(article['id'], vectors[text_hash].tolist(), text_hash)
+             for article, text_hash in zip(valid_articles, hashes)]
+    saved = list(range(len(items)))
+    try:
+        await add_embeddings_bulk(pool, items, encoder_id, table=table)
+        processed += len(items)
+    except Exception as e:
+        logger.warning(f"Пакетное сохранение эмбеддингов не удалось ({e}), сохраняем по одному...")
+        saved = []
+        for i, (news_id, embedding, text_hash) in enumerate(items):
+            try:
+                await add_embedding(pool=pool, news_id=news_id,
+                                    embedding=embedding,
+                                    model_id=encoder_id,
+                                    content_hash=text_hash, table=table)
+                processed += 1
+                saved.append(i)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении эмбеддинга для статьи {news_id}: {e}")
+                errors += 1
+
+    if table == ACTIVE_EMBEDDINGS_TABLE and saved:
+        index_embeddings(encoder_id,
+                         [valid_articles[i]['id'] for i in saved],
+                         np.stack([vectors[hashes[i]] for i in saved]),
+                         [valid_articles[i].get('published') for i in saved])
+
+    return processed, errors, reused
+
+
+def _onnx_file(model_name: str) -> Optional[str]:
+    """Свой .onnx файл модели из конфига; для остальных моделей — файл по умолчанию."""
+    if model_name == EMBEDDING_MODEL:
+        return EMBEDDING_ONNX_FILE
+    if model_name == EMBEDDING_NEXT_MODEL:
+        return EMBEDDING_NEXT_ONNX_FILE
+    return None
+
+
+async def sync_embedding_models(pool, load_next: bool = True):
+    """
+    Сверяет загруженные модели с моделями, зарегистрированными в БД.
+
+    БД — источник истины для активной модели: если поиск уже переключен
+    на другую модель, она загружается вместо указанной в конфиге. Если
+    в конфиге задана embeddings.next_model или в БД есть строящаяся
+    модель, запускается (или продолжается) фоновая миграция.
+
+    Args:
+        pool: Пул подключений к БД
+        load_next: Загружать ли модель для миграции
+    """
+    global model, model_id, next_model, next_model_id
+
+    models = await get_embedding_models(pool)
+    active = models.get('active')
+    if active is None:
+        await register_active_embedding_model(
+            pool, model_id, model.get_sentence_embedding_dimension())
+    elif active['model_id'] != model_id:
+        logger.warning(f"В БД активна модель {active['model_id']}, а в конфиге {model_id}. "
+                       f"Используем {active['model_id']}, обновите embeddings.model.")
+        model = load_encoder(model_name=active['model_id'],
+                             onnx_file=_onnx_file(active['model_id']),
+                             expected_dim=active['dim'])
+        model_id = active['model_id']
+    else:
+        dim = model.get_sentence_embedding_dimension()
+        if dim != active['dim']:
+            raise ValueError(
+                f"Модель {model_id} выдает векторы размерности {dim}, в БД зарегистрировано {active['dim']}")
+
+    building = models.get('building')
+    target = building['model_id'] if building else EMBEDDING_NEXT_MODEL
+    if not load_next or not target or target == model_id:
+        return
+
+    if building and EMBEDDING_NEXT_MODEL and EMBEDDING_NEXT_MODEL != target:
+        logger.warning(f"Продолжаем начатую миграцию на {target}, "
+                       f"embeddings.next_model={EMBEDDING_NEXT_MODEL} игнорируется")
+
+    if next_model_id != target:
+        next_model = load_encoder(
+            model_name=target, onnx_file=_onnx_file(target),
+            expected_dim=building['dim'] if building else None)
+        next_model_id = target
+    await start_embedding_migration(
+        pool, next_model_id, next_model.get_sentence_embedding_dimension())
+
+
+async def migrate_embeddings(pool, limit: int = EMBEDDING_MIGRATION_BATCH,
+                             batch_size: int = EMBEDDING_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Шаг фоновой миграции эмбеддингов на новую модель.
+
+    Кодирует новой моделью до limit статей в article_embeddings_next, пока
+    поиск продолжает работать по старым векторам. Когда покрытие полное,
+    атомарно переключает поиск на новые векторы и новую модель.
+
+    Returns:
+        Словарь со статистикой: processed, errors, reused, missing, switched
+    """
+    global model, model_id, next_model, next_model_id
+
+    stats = {"processed": 0, "errors": 0, "reused": 0, "missing": 0,
+             "switched": False}
+    if next_model is None:
+        return stats
+
+    try:
+        async for page in iter_articles_without_embeddings(
+                pool, batch_size=EMBEDDING_FETCH_SIZE,
+                max_chars=EMBEDDING_MAX_CHARS, table=NEXT_EMBEDDINGS_TABLE):
+            processed, errors, reused = await embed_articles(
+                pool, page, batch_size, encoder=next_model,
+                encoder_id=next_model_id, table=NEXT_EMBEDDINGS_TABLE)
+            stats["processed"] += processed
+            stats["errors"] += errors
+            stats["reused"] += reused
+            if stats["processed"] + stats["errors"] >= limit:
+                break
+
+        status = await get_embedding_migration_status(pool)
+        stats["missing"] = status["missing"] if status else 0
+        logger.info(f"Миграция эмбеддингов на {next_model_id}: "
+                    f"{status['done'] if status else 0}/{status['total'] if status else 0}, "
+                    f"за этот шаг обработано {stats['processed']}")
+
+        if status and not status["missing"]:
+            # Индекс строится заранее, чтобы после переключения поиск
+            # сразу работал через ANN
+            await ensure_vector_index(pool, table=NEXT_EMBEDDINGS_TABLE)
+            switched = await cutover_embedding_model(pool)
+            if switched == next_model_id:
+                model, model_id = next_model, next_model_id
+                next_model, next_model_id = None, None
+                stats["switched"] = True
+                logger.info(f"Поиск переключен на модель {model_id}")
+                # Векторы старой модели в индексе больше не сравнимы с запросами
+                reset_vector_index()
+                await load_vector_index(pool)
+
+    except Exception as e:
+        logger.error(f"Ошибка при миграции эмбеддингов: {e}", exc_info=True)
+        stats["errors"] += 1
+
+    return stats
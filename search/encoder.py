@@ -0,0 +1,86 @@
+"""
+Выбор бэкенда для модели эмбеддингов.
+
+Все бэкенды возвращают объект SentenceTransformer с тем же интерфейсом
+(encode, tokenizer, max_seq_length), поэтому остальной код не зависит
+от того, как именно выполняется инференс.
+
+Бэкенды:
+    torch       — PyTorch float32 (по умолчанию)
+    torch-int8  — динамическая int8-квантизация линейных слоев PyTorch
+    onnx        — ONNX Runtime, экспорт float32
+    onnx-int8   — ONNX Runtime, квантизованная int8-модель
+"""
+import logging
+from sentence_transformers import SentenceTransformer
+from utils.config import (EMBEDDING_MODEL, EMBEDDING_BACKEND,
+                          EMBEDDING_ONNX_FILE)
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+
+# Квантизованный файл, опубликованный вместе с all-MiniLM-L6-v2
+DEFAULT_ONNX_INT8_FILE = 'onnx/model_qint8_avx2.onnx'
+
+
+def _load(backend, model_name, onnx_file):
+    if backend == 'torch':
+        return SentenceTransformer(model_name, device='cpu')
+
+    if backend == 'torch-int8':
+        import torch
+        model = SentenceTransformer(model_name, device='cpu')
+        return torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if backend in ('onnx', 'onnx-int8'):
+        file_name = onnx_file
+        if backend == 'onnx-int8' and not file_name:
+            file_name = DEFAULT_ONNX_INT8_FILE
+        model_kwargs = {'file_name': file_name} if file_name else None
+        return SentenceTransformer(model_name, device='cpu', backend='onnx',
+                                   model_kwargs=model_kwargs)
+
+    raise ValueError(
+        f"Неизвестный бэкенд эмбеддингов: {backend}. Доступны: {', '.join(BACKENDS)}")
+
+
+def load_encoder(backend=EMBEDDING_BACKEND, model_name=EMBEDDING_MODEL,
+                 onnx_file=EMBEDDING_ONNX_FILE, expected_dim=None, fallback=True):
+    """
+    Загружает модель эмбеддингов с выбранным бэкендом.
+
+    Если бэкенд не удалось загрузить (например, не установлен onnxruntime,
+    неверный onnx_file или неизвестное имя бэкенда) и fallback=True,
+    используется PyTorch float32. Несовпадение размерности с expected_dim
+    всегда вызывает ValueError.
+
+    Args:
+        backend: Один из BACKENDS
+        model_name: Название модели sentence-transformers
+        onnx_file: Путь к .onnx файлу внутри репозитория модели
+        expected_dim: Размерность, зарегистрированная для модели в БД
+        fallback: Загружать torch, если выбранный бэкенд недоступен;
+            при False ошибка загрузки пробрасывается
+
+    Returns:
+        Экземпляр SentenceTransformer
+    """
+    try:
+        model = _load(backend, model_name, onnx_file)
+    except Exception as e:
+        if backend == 'torch' or not fallback:
+            raise
+        logger.error(f"Не удалось загрузить бэкенд '{backend}': {e}. Используем torch.",
+                     exc_info=True)
+        backend = 'torch'
+        model = _load(backend, model_name, onnx_file)
+
+    dim = model.get_sentence_embedding_dimension()
+    if expected_dim is not None and dim != expected_dim:
+        raise ValueError(
+            f"Модель {model_name} выдает векторы размерности {dim}, ожидается {expected_dim}")
+
+    logger.info(f"Модель эмбеддингов {model_name} загружена (бэкенд: {backend})")
+    return model
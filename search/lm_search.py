@@ -1,9 +1,18 @@
+import asyncio
+import logging
+
 from search.embeddings import generate_embedding
-from database.db_manager import find_similar_articles
+from search.vector_index import find_similar_articles
+from database.db_manager import find_articles_by_text
+from utils.config import SEARCH_MODE, SEARCH_RRF_K, SEARCH_HYBRID_CANDIDATES
 
 import httpx
 
-async def semantic_search(query: str, pool, top_k=5, start_date=None, end_date=None, client=None):
+logger = logging.getLogger(__name__)
+
+async def semantic_search(query: str, pool, top_k=5, start_date=None, end_date=None, client=None,
+                          ef_search=None, probes=None, mode=SEARCH_MODE, text_filter=None,
+                          tags=None, sources=None):
     """
     Performs semantic search for a given query, with optional date filtering.
 
@@ -14,6 +23,14 @@ async def semantic_search(query: str, pool, top_k=5, start_date=None, end_date=N
         start_date (datetime, optional): The start date for filtering articles (inclusive).
         end_date (datetime, optional): The end date for filtering articles (inclusive).
         client: Optional client parameter for future use.
+        ef_search (int, optional): HNSW search width, trades speed for recall.
+        probes (int, optional): IVFFlat lists to scan, trades speed for recall.
+        mode (str): 'vector' for pure similarity search, 'hybrid' to fuse it
+            with full-text search (see hybrid_search).
+        text_filter (str, optional): Full-text query articles must match;
+            only matching articles are ranked by similarity.
+        tags (list, optional): Only articles having at least one of these tags.
+        sources (list, optional): Only articles from these sources.
 
     Returns:
         list: A list of the most relevant articles.
@@ -21,6 +38,10 @@ async def semantic_search(query: str, pool, top_k=5, start_date=None, end_date=N
     if not query:
         return []
 
+    if mode == 'hybrid':
+        return await hybrid_search(query, pool, top_k=top_k, start_date=start_date,
+                                   end_date=end_date, ef_search=ef_search, probes=probes,
+                                   text_filter=text_filter, tags=tags, sources=sources)
 
     try:
         # 1. Generate embedding for the query
@@ -28,18 +49,95 @@ async def semantic_search(query: str, pool, top_k=5, start_date=None, end_date=N
         if query_embedding is None:
             return []
 
-        # 2. Find similar articles using the database function
+        # 2. Find similar articles (in-memory index or the database)
         similar_articles = await find_similar_articles(
             pool,
             embedding=query_embedding,
             limit=top_k,
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            ef_search=ef_search,
+            probes=probes,
+            text_query=text_filter,
+            tags=tags,
+            sources=sources
         )
 
         return similar_articles
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Error in semantic_search: {e}", exc_info=True)
         return []
+
+
+def reciprocal_rank_fusion(result_lists, k=SEARCH_RRF_K):
+    """
+    Merges ranked result lists with reciprocal rank fusion.
+
+    Each article scores sum(1 / (k + rank)) over the lists it appears in,
+    so articles found by both searches rise to the top without having to
+    compare cosine similarity with ts_rank on the same scale.
+
+    Returns:
+        list: Articles (dicts) ordered by fused score, with the score in 'rrf_score'.
+    """
+    merged = {}
+    for results in result_lists:
+        for rank, article in enumerate(results, 1):
+            entry = merged.get(article['id'])
+            if entry is None:
+                entry = merged[article['id']] = dict(article)
+                entry['rrf_score'] = 0.0
+            else:
+                entry.update({key: value for key, value in dict(article).items()
+                              if entry.get(key) is None})
+            entry['rrf_score'] += 1.0 / (k + rank)
+    return sorted(merged.values(), key=lambda a: a['rrf_score'], reverse=True)
+
+
+async def hybrid_search(query: str, pool, top_k=5, start_date=None, end_date=None,
+                        ef_search=None, probes=None, text_filter=None,
+                        tags=None, sources=None, candidates=SEARCH_HYBRID_CANDIDATES):
+    """
+    Hybrid search: full-text and vector search run concurrently and are
+    merged with reciprocal rank fusion.
+
+    Full-text search catches exact names (models, libraries, people) that
+    embeddings blur, vector search catches paraphrases. The full-text query
+    is sent to the database before the query embedding is computed, so the
+    two overlap.
+
+    Returns:
+        list: Up to top_k articles; 'similarity' is None for articles found
+        only by full-text search.
+    """
+    if not query:
+        return []
+
+    limit = max(top_k, candidates)
+
+    async def vector_candidates():
+        query_embedding = await generate_embedding(query)
+        if query_embedding is None:
+            return []
+        return await find_similar_articles(
+            pool, embedding=query_embedding, limit=limit,
+            start_date=start_date, end_date=end_date,
+            ef_search=ef_search, probes=probes, text_query=text_filter,
+            tags=tags, sources=sources)
+
+    try:
+        # Полнотекстовый запрос стартует первым: пока БД его выполняет,
+        # кодируется эмбеддинг запроса
+        lexical, vector = await asyncio.gather(
+            find_articles_by_text(pool, query, limit=limit, start_date=start_date,
+                                  end_date=end_date, text_filter=text_filter,
+                                  tags=tags, sources=sources),
+            vector_candidates())
+
+        fused = reciprocal_rank_fusion([vector, lexical])
+        for article in fused:
+            article.setdefault('similarity', None)
+        return fused[:top_k]
+    except Exception as e:
+        logger.error(f"Error in hybrid_search: {e}", exc_info=True)
+        return []
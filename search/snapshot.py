@@ -0,0 +1,390 @@
+"""
+Снимок эмбеддингов на диске для быстрого холодного старта и офлайн-анализа.
+
+Снимок — каталог из сегментов и манифеста:
+    meta.json       модель, размерность, watermark, список сегментов
+    seg-000001/     ids.npy (int64, news.id по возрастанию),
+                    vectors.npy (float32, N x dim, нормированные),
+                    published.npy (int64, секунды epoch)
+    seg-000002.arrow  тот же сегмент в формате Arrow IPC (нужен pyarrow)
+
+Сегменты открываются через memory map без копирования в память. Новые
+векторы дописываются отдельным сегментом (append_segment), а более поздний
+сегмент перекрывает векторы тех же статей в более ранних.
+
+Запуск:
+    python -m search.snapshot export [--format arrow]   # выгрузить из БД
+    python -m search.snapshot import                    # загрузить в БД
+    python -m search.snapshot info
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+import numpy as np
+
+from utils.config import MEMORY_INDEX_SNAPSHOT_DIR, MEMORY_INDEX_SNAPSHOT_FORMAT
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 2
+SEGMENT_FORMATS = ('npy', 'arrow')
+
+# Сколько строк выгрузки из БД собирается в один сегмент
+EXPORT_SEGMENT_ROWS = 100000
+
+# Статья без даты публикации: не попадает ни в одно окно дат
+NO_DATE = np.iinfo(np.int64).min
+
+
+def to_epoch(value) -> int:
+    """Переводит datetime в секунды epoch, None — в NO_DATE."""
+    if value is None:
+        return NO_DATE
+    return int(value.timestamp())
+
+
+def normalize(vectors) -> np.ndarray:
+    """Нормирует строки, чтобы скалярное произведение было косинусным сходством."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def rows_to_arrays(rows, dim: int):
+    """Переводит записи (news_id, embedding, published) в массивы сегмента."""
+    ids = np.fromiter((row['news_id'] for row in rows), dtype=np.int64,
+                      count=len(rows))
+    vectors = np.empty((len(rows), dim), dtype=np.float32)
+    for i, row in enumerate(rows):
+        vectors[i] = row['embedding']
+    published = np.fromiter((to_epoch(row['published']) for row in rows),
+                            dtype=np.int64, count=len(rows))
+    return ids, normalize(vectors), published
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+    except ImportError:
+        raise RuntimeError("Для сегментов Arrow нужен pyarrow: pip install pyarrow")
+    return pa, ipc
+
+
+def _write_segment(directory: Path, name: str, fmt: str, ids, vectors,
+                   published) -> Dict[str, Any]:
+    """Пишет один сегмент и возвращает его запись для манифеста."""
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    published = np.ascontiguousarray(published, dtype=np.int64)
+
+    if fmt == 'npy':
+        segment_dir = directory / name
+        segment_dir.mkdir()
+        np.save(segment_dir / 'ids.npy', ids)
+        np.save(segment_dir / 'vectors.npy', vectors)
+        np.save(segment_dir / 'published.npy', published)
+        file_name = name
+    elif fmt == 'arrow':
+        pa, ipc = _import_pyarrow()
+        dim = vectors.shape[1]
+        embedding = pa.FixedSizeListArray.from_arrays(
+            pa.array(vectors.reshape(-1)), dim)
+        batch = pa.record_batch([pa.array(ids), pa.array(published), embedding],
+                                names=['id', 'published', 'embedding'])
+        file_name = name + '.arrow'
+        with pa.OSFile(str(directory / file_name), 'wb') as sink:
+            with ipc.new_file(sink, batch.schema) as writer:
+                writer.write_batch(batch)
+    else:
+        raise ValueError(
+            f"Неизвестный формат сегмента: {fmt}. Доступны: {', '.join(SEGMENT_FORMATS)}")
+
+    return {'file': file_name, 'format': fmt, 'count': int(len(ids))}
+
+
+def _read_segment(directory: Path, segment: Dict[str, Any], dim: int,
+                  mmap: bool) -> Dict[str, np.ndarray]:
+    path = directory / segment['file']
+    if segment['format'] == 'npy':
+        mode = 'r' if mmap else None
+        return {
+            'ids': np.load(path / 'ids.npy', mmap_mode=mode),
+            'vectors': np.load(path / 'vectors.npy', mmap_mode=mode),
+            'published': np.load(path / 'published.npy', mmap_mode=mode),
+        }
+
+    pa, ipc = _import_pyarrow()
+    source = pa.memory_map(str(path), 'r') if mmap else pa.OSFile(str(path), 'rb')
+    batch = ipc.open_file(source).get_batch(0)
+    return {
+        'ids': batch.column(0).to_numpy(zero_copy_only=True),
+        'published': batch.column(1).to_numpy(zero_copy_only=True),
+        'vectors': batch.column(2).values.to_numpy(
+            zero_copy_only=True).reshape(-1, dim),
+    }
+
+
+def _write_manifest(path: Path, manifest: Dict[str, Any]):
+    """Атомарно заменяет meta.json."""
+    tmp = path / 'meta.json.tmp'
+    tmp.write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+    os.replace(tmp, path / 'meta.json')
+
+
+def _read_manifest(path: Path) -> Optional[Dict[str, Any]]:
+    meta_file = path / 'meta.json'
+    if not meta_file.exists():
+        return None
+    manifest = json.loads(meta_file.read_text(encoding='utf-8'))
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        logger.warning(f"Неподдерживаемый формат снимка {path}: {manifest.get('format')}")
+        return None
+    return manifest
+
+
+class SnapshotWriter:
+    """
+    Пишет новый снимок по сегментам во временный каталог и подменяет
+    старый снимок целиком в commit().
+    """
+
+    def __init__(self, path, model_id: str, dim: int,
+                 fmt: str = MEMORY_INDEX_SNAPSHOT_FORMAT):
+        self.path = Path(path)
+        self.tmp = self.path.with_name(self.path.name + '.tmp')
+        self.manifest = {'format': SNAPSHOT_FORMAT, 'model_id': model_id,
+                         'dim': dim, 'watermark': None, 'segments': []}
+        self.fmt = fmt
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+
+    def add_segment(self, ids, vectors, published):
+        if not len(ids):
+            return
+        name = f"seg-{len(self.manifest['segments']) + 1:06d}"
+        self.manifest['segments'].append(
+            _write_segment(self.tmp, name, self.fmt, ids, vectors, published))
+
+    def commit(self, watermark: Optional[datetime]):
+        self.manifest['watermark'] = watermark.isoformat() if watermark else None
+        _write_manifest(self.tmp, self.manifest)
+
+        old = self.path.with_name(self.path.name + '.old')
+        shutil.rmtree(old, ignore_errors=True)
+        if self.path.exists():
+            self.path.rename(old)
+        self.tmp.rename(self.path)
+        shutil.rmtree(old, ignore_errors=True)
+        count = sum(segment['count'] for segment in self.manifest['segments'])
+        logger.info(f"Снимок эмбеддингов записан: {self.path} ({count} векторов, "
+                    f"сегментов: {len(self.manifest['segments'])})")
+
+    def abort(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def write_snapshot(path, model_id: str, ids: np.ndarray, vectors: np.ndarray,
+                   published: np.ndarray, watermark: Optional[datetime],
+                   fmt: str = MEMORY_INDEX_SNAPSHOT_FORMAT):
+    """Атомарно записывает снимок из одного сегмента (компакция)."""
+    writer = SnapshotWriter(path, model_id, int(vectors.shape[1]), fmt)
+    try:
+        writer.add_segment(ids, vectors, published)
+        writer.commit(watermark)
+    except Exception:
+        writer.abort()
+        raise
+
+
+def append_segment(path, model_id: str, ids: np.ndarray, vectors: np.ndarray,
+                   published: np.ndarray, watermark: Optional[datetime],
+                   fmt: str = MEMORY_INDEX_SNAPSHOT_FORMAT) -> Dict[str, Any]:
+    """
+    Дописывает к снимку сегмент с новыми и перезаписанными векторами.
+
+    Сегмент становится видимым только после атомарной замены meta.json,
+    поэтому прерванная запись оставляет снимок в прежнем состоянии.
+
+    Returns:
+        Запись сегмента из манифеста
+    """
+    path = Path(path)
+    manifest = _read_manifest(path)
+    if manifest is None:
+        raise ValueError(f"Снимок {path} не найден")
+    if manifest['model_id'] != model_id:
+        raise ValueError(f"Снимок {path} построен моделью {manifest['model_id']}, а не {model_id}")
+
+    number = max((int(s['file'][4:10]) for s in manifest['segments']), default=0) + 1
+    name = f"seg-{number:06d}"
+    shutil.rmtree(path / name, ignore_errors=True)
+    (path / (name + '.arrow')).unlink(missing_ok=True)
+
+    segment = _write_segment(path, name, fmt, ids, vectors, published)
+    manifest['segments'].append(segment)
+    manifest['watermark'] = watermark.isoformat() if watermark else None
+    _write_manifest(path, manifest)
+    return segment
+
+
+def read_snapshot(path, mmap: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Открывает снимок. Векторы не копируются в память при mmap=True.
+
+    Returns:
+        Словарь с полями манифеста (model_id, dim, count, watermark) и списком
+        segments, где у каждого сегмента есть массивы ids, vectors, published;
+        None, если снимка нет или он поврежден
+    """
+    path = Path(path)
+    try:
+        manifest = _read_manifest(path)
+        if manifest is None:
+            return None
+
+        snapshot = dict(manifest)
+        snapshot['segments'] = [
+            _read_segment(path, segment, manifest['dim'], mmap)
+            for segment in manifest['segments']
+        ]
+        snapshot['count'] = sum(segment['count'] for segment in manifest['segments'])
+        snapshot['watermark'] = (datetime.fromisoformat(manifest['watermark'])
+                                 if manifest.get('watermark') else None)
+        return snapshot
+    except Exception as e:
+        logger.error(f"Не удалось прочитать снимок {path}: {e}", exc_info=True)
+        return None
+
+
+async def export_embeddings(pool, path, model_id: str, dim: int,
+                            fmt: str = MEMORY_INDEX_SNAPSHOT_FORMAT,
+                            segment_rows: int = EXPORT_SEGMENT_ROWS) -> int:
+    """
+    Выгружает эмбеддинги активной модели из БД в новый снимок.
+
+    Векторы читаются потоково и сбрасываются на диск сегментами по
+    segment_rows, поэтому память не зависит от размера таблицы.
+
+    Returns:
+        Количество выгруженных векторов
+    """
+    from database.db_manager import iter_embeddings
+
+    writer = SnapshotWriter(path, model_id, dim, fmt)
+    chunks = []
+    pending = 0
+    total = 0
+    watermark = None
+    try:
+        async for rows in iter_embeddings(pool):
+            chunks.append(rows_to_arrays(rows, dim))
+            pending += len(rows)
+            latest = max(row['updated_at'] for row in rows)
+            if watermark is None or latest > watermark:
+                watermark = latest
+            if pending >= segment_rows:
+                await asyncio.to_thread(
+                    writer.add_segment,
+                    *(np.concatenate(parts) for parts in zip(*chunks)))
+                total += pending
+                chunks, pending = [], 0
+        if chunks:
+            await asyncio.to_thread(
+                writer.add_segment,
+                *(np.concatenate(parts) for parts in zip(*chunks)))
+            total += pending
+        await asyncio.to_thread(writer.commit, watermark)
+    except Exception:
+        writer.abort()
+        raise
+    return total
+
+
+async def import_embeddings(pool, path) -> int:
+    """
+    Загружает векторы из снимка в article_embeddings.
+
+    Снимок должен быть построен активной моделью. Векторы статей, которых
+    нет в news, пропускаются.
+
+    Returns:
+        Количество записанных векторов
+    """
+    from database.db_manager import get_embedding_models, import_embeddings_bulk
+
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        raise ValueError(f"Снимок {path} не найден")
+    active = (await get_embedding_models(pool)).get('active')
+    if active is None or active['model_id'] != snapshot['model_id']:
+        raise ValueError(f"Снимок построен моделью {snapshot['model_id']}, активна "
+                         f"{active['model_id'] if active else 'никакая'}")
+
+    written = 0
+    for segment in snapshot['segments']:
+        written += await import_embeddings_bulk(
+            pool, segment['ids'], segment['vectors'], snapshot['model_id'])
+    return written
+
+
+def _print_info(path):
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        print(f"Снимок {path} не найден")
+        return
+    print(f"Модель: {snapshot['model_id']} ({snapshot['dim']})")
+    print(f"Векторов: {snapshot['count']}, сегментов: {len(snapshot['segments'])}")
+    print(f"Watermark: {snapshot['watermark']}")
+
+
+async def _run(args):
+    from database.db_manager import init_db_pool, get_embedding_models
+
+    pool = await init_db_pool(workloads=('batch',))
+    try:
+        if args.command == 'export':
+            active = (await get_embedding_models(pool)).get('active')
+            if active is None:
+                raise ValueError("В БД нет активной модели эмбеддингов")
+            count = await export_embeddings(pool, args.path, active['model_id'],
+                                            active['dim'], fmt=args.format,
+                                            segment_rows=args.segment_rows)
+            logger.info(f"Выгружено {count} векторов в {args.path}")
+        else:
+            count = await import_embeddings(pool, args.path)
+            logger.info(f"Загружено {count} векторов из {args.path}")
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Снимок эмбеддингов на диске")
+    parser.add_argument('command', choices=('export', 'import', 'info'))
+    parser.add_argument('--path', type=Path, default=MEMORY_INDEX_SNAPSHOT_DIR,
+                        help="Каталог снимка (по умолчанию memory_index.snapshot_dir)")
+    parser.add_argument('--format', choices=SEGMENT_FORMATS,
+                        default=MEMORY_INDEX_SNAPSHOT_FORMAT,
+                        help="Формат сегментов при выгрузке")
+    parser.add_argument('--segment-rows', type=int, default=EXPORT_SEGMENT_ROWS,
+                        help="Строк в одном сегменте при выгрузке")
+    args = parser.parse_args()
+
+    from utils.logging_config import setup_logging
+    setup_logging()
+    if args.command == 'info':
+        _print_info(args.path)
+    else:
+        asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
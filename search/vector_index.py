@@ -0,0 +1,445 @@
+"""
+Векторный индекс в памяти процесса.
+
+Postgres остается хранилищем эмбеддингов, а поиск по сходству выполняется
+здесь: нормированные векторы лежат в непрерывной матрице float32, и top-k
+считается одним матричным умножением. Индекс поднимается из снимка на диске
+(search/snapshot.py, через memory map) и догружает из БД векторы, записанные
+после снимка.
+"""
+import asyncio
+import logging
+from datetime import datetime, time, timedelta, timezone
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+
+from database import db_manager
+from database.db_manager import (get_embeddings_since, get_embedding_models,
+                                 get_articles_by_ids)
+from search.snapshot import (NO_DATE, normalize, to_epoch, rows_to_arrays,
+                             write_snapshot, append_segment, read_snapshot,
+                             export_embeddings)
+from utils.config import (MEMORY_INDEX_ENABLED, MEMORY_INDEX_SNAPSHOT_DIR,
+                          MEMORY_INDEX_MAX_SEGMENTS)
+
+logger = logging.getLogger(__name__)
+
+# Транзакция могла записать эмбеддинг с updated_at раньше уже прочитанных,
+# поэтому догрузка всегда перекрывает последние минуты
+WATERMARK_MARGIN = timedelta(minutes=5)
+
+# Запас кандидатов на случай статей, удаленных из БД после загрузки индекса
+SEARCH_OVERFETCH = 5
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Фильтры по полям news, которых нет в индексе: с ними поиск идет в Postgres
+DB_ONLY_FILTERS = ('text_query', 'tags', 'sources', 'exclude_published')
+
+
+def _window_bounds(start_date, end_date) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Границы окна дат в секундах epoch, как в _published_window_filter:
+    start_date включительно, end_date — до конца указанного дня.
+    """
+    start = end = None
+    if start_date:
+        if isinstance(start_date, str):
+            start_date = datetime.fromisoformat(start_date)
+        elif not isinstance(start_date, datetime):
+            start_date = datetime.combine(start_date, time.min)
+        start = int(start_date.timestamp())
+    if end_date:
+        if isinstance(end_date, str):
+            end_date = datetime.fromisoformat(end_date)
+        tzinfo = end_date.tzinfo if isinstance(end_date, datetime) else None
+        day = end_date.date() if isinstance(end_date, datetime) else end_date
+        end = int(datetime.combine(day + timedelta(days=1), time.min,
+                                   tzinfo=tzinfo).timestamp())
+    return start, end
+
+
+class _Segment:
+    """Неизменяемая часть индекса: массивы сегмента снимка и маска живых строк."""
+
+    def __init__(self, ids, vectors, published):
+        self.ids = ids
+        self.vectors = vectors
+        self.published = published
+        self.alive = np.ones(len(ids), dtype=bool)
+
+    def hide(self, ids: np.ndarray):
+        """Скрывает строки статей, векторы которых перезаписаны позже."""
+        if not len(self.ids):
+            return
+        pos = np.searchsorted(self.ids, ids)
+        pos[pos == len(self.ids)] = 0
+        self.alive[pos[self.ids[pos] == ids]] = False
+
+
+class VectorIndex:
+    """
+    Точный поиск по косинусному сходству.
+
+    Базовая часть — сегменты снимка, которые не изменяются и обычно открыты
+    через memory map. Новые и перезаписанные векторы копятся в дельте, а
+    устаревшие строки сегментов скрываются маской.
+    """
+
+    def __init__(self, model_id: str, dim: int,
+                 watermark: Optional[datetime] = None):
+        self.model_id = model_id
+        self.dim = dim
+        self.watermark = watermark
+        # Счетчик изменений: по нему видно, что индекс менялся во время await
+        self.version = 0
+        # Сколько первых сегментов уже лежит в снимке на диске
+        self.persisted = 0
+        self._segments: List[_Segment] = []
+        self._reset_delta()
+
+    def _reset_delta(self):
+        self._delta_ids = np.empty(0, dtype=np.int64)
+        self._delta_vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._delta_published = np.empty(0, dtype=np.int64)
+        self._delta_size = 0
+        self._delta_pos = {}
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict[str, Any]) -> 'VectorIndex':
+        loaded = cls(snapshot['model_id'], snapshot['dim'], snapshot['watermark'])
+        loaded.rebase(snapshot['segments'])
+        return loaded
+
+    def rebase(self, segments: List[Dict[str, np.ndarray]]):
+        """Заменяет базу сегментами снимка и очищает дельту."""
+        self._segments = []
+        for data in segments:
+            # Более поздний сегмент перекрывает векторы тех же статей
+            for segment in self._segments:
+                segment.hide(data['ids'])
+            self._segments.append(
+                _Segment(data['ids'], data['vectors'], data['published']))
+        self._reset_delta()
+        self.persisted = len(self._segments)
+        self.version += 1
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._segments)
+
+    @property
+    def pending(self) -> int:
+        """Количество векторов в дельте, еще не записанных в снимок."""
+        return self._delta_size
+
+    def __len__(self):
+        return sum(int(s.alive.sum()) for s in self._segments) + self._delta_size
+
+    def _grow_delta(self, needed: int):
+        capacity = len(self._delta_ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        ids = np.empty(capacity, dtype=np.int64)
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        published = np.empty(capacity, dtype=np.int64)
+        size = self._delta_size
+        ids[:size] = self._delta_ids[:size]
+        vectors[:size] = self._delta_vectors[:size]
+        published[:size] = self._delta_published[:size]
+        self._delta_ids = ids
+        self._delta_vectors = vectors
+        self._delta_published = published
+
+    def add(self, ids, vectors, published):
+        """
+        Добавляет или перезаписывает векторы статей.
+
+        Args:
+            ids: news.id статей
+            vectors: Эмбеддинги (N, dim), нормируются при добавлении
+            published: Время публикации в секундах epoch (NO_DATE, если нет)
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        vectors = normalize(vectors).reshape(len(ids), self.dim)
+        published = np.asarray(published, dtype=np.int64)
+
+        for segment in self._segments:
+            segment.hide(ids)
+
+        self._grow_delta(self._delta_size + len(ids))
+        for news_id, vector, ts in zip(ids.tolist(), vectors, published):
+            row = self._delta_pos.get(news_id)
+            if row is None:
+                row = self._delta_size
+                self._delta_pos[news_id] = row
+                self._delta_ids[row] = news_id
+                self._delta_size += 1
+            self._delta_vectors[row] = vector
+            self._delta_published[row] = ts
+        self.version += 1
+
+    def drop_before(self, cutoff: int) -> int:
+        """
+        Удаляет векторы статей, опубликованных раньше cutoff (секунды epoch).
+
+        Строки сегментов скрываются маской, поэтому следующий снимок
+        переписывается целиком. Возвращает количество удаленных векторов.
+        """
+        dropped = 0
+        for segment in self._segments:
+            old = segment.alive & (segment.published != NO_DATE) & (segment.published < cutoff)
+            count = int(old.sum())
+            if count:
+                segment.alive = segment.alive & ~old
+                dropped += count
+
+        size = self._delta_size
+        keep = ((self._delta_published[:size] == NO_DATE)
+                | (self._delta_published[:size] >= cutoff))
+        if not keep.all():
+            ids = self._delta_ids[:size][keep]
+            vectors = self._delta_vectors[:size][keep]
+            published = self._delta_published[:size][keep]
+            dropped += size - len(ids)
+            self._delta_size = len(ids)
+            self._delta_ids[:len(ids)] = ids
+            self._delta_vectors[:len(ids)] = vectors
+            self._delta_published[:len(ids)] = published
+            self._delta_pos = {news_id: row for row, news_id in enumerate(ids.tolist())}
+
+        if dropped:
+            self.persisted = 0
+            self.version += 1
+        return dropped
+
+    @staticmethod
+    def _candidates(ids, vectors, published, alive, query, start, end):
+        mask = alive
+        if start is not None or end is not None:
+            mask = mask & (published != NO_DATE)
+            if start is not None:
+                mask = mask & (published >= start)
+            if end is not None:
+                mask = mask & (published < end)
+        rows = np.flatnonzero(mask)
+        if len(rows) == len(ids):
+            return ids, vectors @ query
+        return ids[rows], vectors[rows] @ query
+
+    def search(self, query, limit: int, start: Optional[int] = None,
+               end: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Возвращает до limit пар (news.id, сходство) по убыванию сходства.
+
+        start/end — окно публикации в секундах epoch, [start, end).
+        """
+        query = normalize(query).reshape(self.dim)
+        size = self._delta_size
+        parts = [self._candidates(s.ids, s.vectors, s.published, s.alive,
+                                  query, start, end)
+                 for s in self._segments]
+        parts.append(self._candidates(
+            self._delta_ids[:size], self._delta_vectors[:size],
+            self._delta_published[:size], np.ones(size, dtype=bool),
+            query, start, end))
+
+        ids = np.concatenate([part[0] for part in parts])
+        scores = np.concatenate([part[1] for part in parts])
+        if not len(ids) or limit <= 0:
+            return []
+        if limit < len(ids):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(ids))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return list(zip(ids[top].tolist(), scores[top].tolist()))
+
+    def delta_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Векторы, еще не попавшие в сегменты, отсортированные по news.id."""
+        size = self._delta_size
+        order = np.argsort(self._delta_ids[:size], kind='stable')
+        return (self._delta_ids[:size][order], self._delta_vectors[:size][order],
+                self._delta_published[:size][order])
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Сводит сегменты и дельту в массивы, отсортированные по news.id."""
+        size = self._delta_size
+        parts = [(s.ids[s.alive], s.vectors[s.alive], s.published[s.alive])
+                 for s in self._segments]
+        parts.append((self._delta_ids[:size], self._delta_vectors[:size],
+                      self._delta_published[:size]))
+        ids, vectors, published = (np.concatenate(column) for column in zip(*parts))
+        order = np.argsort(ids, kind='stable')
+        return ids[order], vectors[order], published[order]
+
+
+# Индекс активной модели; None — поиск идет через Postgres
+index: Optional[VectorIndex] = None
+
+
+async def _catch_up(pool, target: VectorIndex) -> int:
+    """Догружает в индекс векторы, записанные после его watermark."""
+    since = (target.watermark or EPOCH) - WATERMARK_MARGIN
+    rows = await get_embeddings_since(pool, since)
+    if rows:
+        target.add(*rows_to_arrays(rows, target.dim))
+        latest = max(row['updated_at'] for row in rows)
+        if target.watermark is None or latest > target.watermark:
+            target.watermark = latest
+    return len(rows)
+
+
+async def load_vector_index(pool) -> Optional[VectorIndex]:
+    """
+    Поднимает индекс активной модели из снимка на диске. Если снимка нет
+    или он построен другой моделью, снимок сначала выгружается из БД.
+    """
+    global index
+
+    if not MEMORY_INDEX_ENABLED:
+        return None
+
+    active = (await get_embedding_models(pool)).get('active')
+    if active is None:
+        logger.warning("Нет активной модели эмбеддингов, индекс в памяти не загружен")
+        return None
+
+    snapshot = await asyncio.to_thread(read_snapshot, MEMORY_INDEX_SNAPSHOT_DIR)
+    if not snapshot or snapshot['model_id'] != active['model_id'] \
+            or snapshot['dim'] != active['dim']:
+        if snapshot:
+            logger.info(f"Снимок построен моделью {snapshot['model_id']}, "
+                        f"активна {active['model_id']}: выгружаем векторы из БД")
+        await export_embeddings(pool, MEMORY_INDEX_SNAPSHOT_DIR,
+                                active['model_id'], active['dim'])
+        snapshot = await asyncio.to_thread(read_snapshot, MEMORY_INDEX_SNAPSHOT_DIR)
+        if snapshot is None:
+            logger.error("Не удалось открыть только что выгруженный снимок")
+            return None
+
+    loaded = VectorIndex.from_snapshot(snapshot)
+    caught_up = await _catch_up(pool, loaded)
+    index = loaded
+    logger.info(f"Индекс векторов готов: {len(loaded)} векторов модели {loaded.model_id} "
+                f"из {loaded.segment_count} сегментов, догружено из БД {caught_up}")
+    return index
+
+
+def index_embeddings(model_id: str, ids, vectors, published):
+    """
+    Добавляет только что записанные эмбеддинги в индекс.
+
+    Векторы другой модели (например, при миграции) игнорируются.
+    """
+    if index is None or index.model_id != model_id:
+        return
+    index.add(ids, vectors, [to_epoch(ts) for ts in published])
+
+
+def reset_vector_index():
+    """Отключает индекс до следующей загрузки (например, после смены модели)."""
+    global index
+    index = None
+
+
+def drop_articles_before(cutoff: datetime) -> int:
+    """Убирает из индекса статьи, удаленные из БД по сроку хранения."""
+    if index is None:
+        return 0
+    return index.drop_before(to_epoch(cutoff))
+
+
+async def refresh_vector_index(pool) -> int:
+    """Догружает векторы, записанные другими процессами (backfill, миграция)."""
+    if index is None:
+        return 0
+    try:
+        return await _catch_up(pool, index)
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении индекса векторов: {e}", exc_info=True)
+        return 0
+
+
+async def save_vector_snapshot() -> bool:
+    """
+    Сохраняет индекс на диск и переводит его базу на memory map снимка.
+
+    Если все сегменты индекса уже есть в снимке, дельта дописывается
+    новым сегментом; когда сегментов становится больше
+    memory_index.max_segments, снимок переписывается одним сегментом.
+    """
+    current = index
+    if current is None:
+        return False
+    try:
+        version = current.version
+        incremental = (current.persisted == current.segment_count
+                       and current.segment_count < MEMORY_INDEX_MAX_SEGMENTS)
+        if incremental:
+            if not current.pending:
+                return True
+            await asyncio.to_thread(append_segment, MEMORY_INDEX_SNAPSHOT_DIR,
+                                    current.model_id, *current.delta_arrays(),
+                                    current.watermark)
+        else:
+            await asyncio.to_thread(write_snapshot, MEMORY_INDEX_SNAPSHOT_DIR,
+                                    current.model_id, *current.arrays(),
+                                    current.watermark)
+        # Если за время записи индекс не менялся, отдаем векторы в page cache
+        if current.version == version:
+            snapshot = await asyncio.to_thread(read_snapshot,
+                                               MEMORY_INDEX_SNAPSHOT_DIR)
+            if snapshot:
+                current.rebase(snapshot['segments'])
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении снимка индекса: {e}", exc_info=True)
+        return False
+
+
+async def find_similar_articles(pool, embedding, limit=5, start_date=None,
+                                end_date=None, **search_params):
+    """
+    Поиск похожих статей через индекс в памяти.
+
+    Возвращает то же, что database.db_manager.find_similar_articles. Если
+    индекс не загружен или заданы фильтры из DB_ONLY_FILTERS, запрос уходит
+    в Postgres; параметры ANN-поиска (ef_search, probes) передаются только
+    туда — здесь поиск точный.
+    """
+    current = index
+    if current is None or any(search_params.get(name) for name in DB_ONLY_FILTERS):
+        return await db_manager.find_similar_articles(
+            pool, embedding, limit=limit, start_date=start_date,
+            end_date=end_date, **search_params)
+
+    try:
+        start, end = _window_bounds(start_date, end_date)
+        hits = current.search(embedding, limit + SEARCH_OVERFETCH, start, end)
+        if not hits:
+            return []
+        rows = await get_articles_by_ids(pool, [news_id for news_id, _ in hits])
+        by_id = {row['id']: row for row in rows}
+
+        articles = []
+        for news_id, similarity in hits:
+            row = by_id.get(news_id)
+            if row is None:
+                continue
+            article = dict(row)
+            article['similarity'] = similarity
+            articles.append(article)
+            if len(articles) == limit:
+                break
+        return articles
+    except Exception as e:
+        logger.error(f"Ошибка поиска по индексу в памяти, используем БД: {e}",
+                     exc_info=True)
+        return await db_manager.find_similar_articles(
+            pool, embedding, limit=limit, start_date=start_date,
+            end_date=end_date, **search_params)
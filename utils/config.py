@@ -31,11 +31,80 @@ DB_USER = DB_CONFIG.get('user')
 DB_HOST = DB_CONFIG.get('host')
 DB_PORT = DB_CONFIG.get('port')
 
+# Пулы соединений по классам нагрузки (database/pools.py);
+# statement_timeout в секундах, 0 — без ограничения
+DB_POOL_DEFAULTS = {
+    'interactive': {'min_size': 1, 'max_size': 4, 'statement_timeout': 15},
+    'ingest': {'min_size': 1, 'max_size': 3, 'statement_timeout': 60},
+    'batch': {'min_size': 1, 'max_size': 3, 'statement_timeout': 600},
+}
+DB_POOLS = {name: {**defaults, **(DB_CONFIG.get('pools', {}).get(name) or {})}
+            for name, defaults in DB_POOL_DEFAULTS.items()}
+
 # Parsing settings
 INTERVALS = config.get('intervals', {})
 PARSING_INTERVAL = config.get('parsing_interval')
 SOURCES = config.get('sources', [])
 
+# Embedding settings
+EMBEDDINGS_CONFIG = config.get('embeddings', {})
+EMBEDDING_MODEL = EMBEDDINGS_CONFIG.get('model', 'all-MiniLM-L6-v2')
+EMBEDDING_BACKEND = EMBEDDINGS_CONFIG.get('backend', 'torch')
+EMBEDDING_ONNX_FILE = EMBEDDINGS_CONFIG.get('onnx_file')
+EMBEDDING_BATCH_SIZE = EMBEDDINGS_CONFIG.get('batch_size', 32)
+EMBEDDING_FETCH_SIZE = EMBEDDINGS_CONFIG.get('fetch_size', 256)
+EMBEDDING_MAX_CHARS = EMBEDDINGS_CONFIG.get('max_text_chars', 2000)
+EMBEDDING_TOKEN_BUDGET = EMBEDDINGS_CONFIG.get('token_budget', 4096)
+EMBEDDING_NEXT_MODEL = EMBEDDINGS_CONFIG.get('next_model')
+EMBEDDING_NEXT_ONNX_FILE = EMBEDDINGS_CONFIG.get('next_model_onnx_file')
+EMBEDDING_MIGRATION_BATCH = EMBEDDINGS_CONFIG.get('migration_batch', 2000)
+
+# ANN-индекс pgvector для article_embeddings
+VECTOR_INDEX_CONFIG = config.get('vector_index', {})
+VECTOR_INDEX_METHOD = VECTOR_INDEX_CONFIG.get('method', 'hnsw')
+VECTOR_INDEX_M = VECTOR_INDEX_CONFIG.get('m', 16)
+VECTOR_INDEX_EF_CONSTRUCTION = VECTOR_INDEX_CONFIG.get('ef_construction', 64)
+VECTOR_INDEX_LISTS = VECTOR_INDEX_CONFIG.get('lists', 100)
+VECTOR_SEARCH_EF_SEARCH = VECTOR_INDEX_CONFIG.get('ef_search', 40)
+VECTOR_SEARCH_PROBES = VECTOR_INDEX_CONFIG.get('probes', 10)
+VECTOR_SEARCH_EXACT_MAX_ROWS = VECTOR_INDEX_CONFIG.get('exact_max_rows', 20000)
+VECTOR_SEARCH_MAX_EF_SEARCH = VECTOR_INDEX_CONFIG.get('max_ef_search', 1000)
+
+# Режим поиска статей: vector — только по эмбеддингам, hybrid — вместе
+# с полнотекстовым поиском (reciprocal rank fusion)
+SEARCH_CONFIG = config.get('search', {})
+SEARCH_MODE = SEARCH_CONFIG.get('mode', 'vector')
+SEARCH_RRF_K = SEARCH_CONFIG.get('rrf_k', 60)
+SEARCH_HYBRID_CANDIDATES = SEARCH_CONFIG.get('hybrid_candidates', 50)
+
+# Индекс эмбеддингов в памяти процесса (поиск без обращения к pgvector)
+MEMORY_INDEX_CONFIG = config.get('memory_index', {})
+MEMORY_INDEX_ENABLED = MEMORY_INDEX_CONFIG.get('enabled', False)
+MEMORY_INDEX_SNAPSHOT_DIR = BASE_DIR / MEMORY_INDEX_CONFIG.get(
+    'snapshot_dir', 'data/vector_snapshot')
+MEMORY_INDEX_REFRESH_MINUTES = MEMORY_INDEX_CONFIG.get('refresh_minutes', 5)
+MEMORY_INDEX_SNAPSHOT_FORMAT = MEMORY_INDEX_CONFIG.get('snapshot_format', 'npy')
+MEMORY_INDEX_MAX_SEGMENTS = MEMORY_INDEX_CONFIG.get('max_segments', 16)
+
+# Хранение статей: секции news, срок хранения и архив (database/maintenance.py)
+STORAGE_CONFIG = config.get('storage', {})
+STORAGE_RETENTION_MONTHS = STORAGE_CONFIG.get('retention_months', 0)
+STORAGE_ARCHIVE = STORAGE_CONFIG.get('archive', True)
+STORAGE_ARCHIVE_DIR = BASE_DIR / STORAGE_CONFIG.get('archive_dir', 'data/archive')
+STORAGE_PARTITIONS_AHEAD = STORAGE_CONFIG.get('partitions_ahead', 2)
+STORAGE_MAINTENANCE_HOUR = STORAGE_CONFIG.get('maintenance_hour', 4)
+STORAGE_SNIPPET_CHARS = STORAGE_CONFIG.get('snippet_chars', 500)
+STORAGE_BODY_COMPRESSION = STORAGE_CONFIG.get('body_compression', 'pglz')
+
+# Публикация постов по теме недели
+PUBLICATION_CONFIG = config.get('publication', {})
+CANDIDATE_POOL_SIZE = PUBLICATION_CONFIG.get('candidate_pool_size', 30)
+PRERENDER_POSTS = PUBLICATION_CONFIG.get('prerender_posts', 5)
+
+# Статистика для админ-панели: оценки из каталога или точные счетчики строк
+STATS_CONFIG = config.get('stats', {})
+STATS_EXACT_COUNTS = STATS_CONFIG.get('exact_counts', False)
+
 # Admin user ids: объединяем из .env и config.yml
 env_admins = [int(admin_id) for admin_id in os.getenv('ADMIN_USER_IDS', '').split(',') if admin_id]
 config_admins = config.get('admin_user_ids', [])
@@ -0,0 +1,63 @@
+"""
+Метрики процесса в памяти: гистограммы задержек и счетчики.
+
+Значения копятся с момента запуска бота и показываются командой
+админ-панели «Метрики». Метрика задается именем и необязательной меткой,
+например ('db_query_seconds', 'save_article').
+"""
+from bisect import bisect_left
+
+# Границы корзин гистограммы задержек, в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами; квантили оцениваются по верхней границе корзины."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        threshold = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= threshold:
+                return bound
+        return float('inf')
+
+
+_histograms = {}
+_counters = {}
+
+
+def observe(name, value, label=None):
+    histogram = _histograms.get((name, label))
+    if histogram is None:
+        histogram = _histograms[(name, label)] = Histogram()
+    histogram.observe(value)
+
+
+def inc(name, value=1, label=None):
+    _counters[(name, label)] = _counters.get((name, label), 0) + value
+
+
+def get_histograms(name):
+    """Returns {label: Histogram} for a metric."""
+    return {label: histogram for (metric, label), histogram in _histograms.items()
+            if metric == name}
+
+
+def get_counter(name, label=None):
+    return _counters.get((name, label), 0)
@@ -36,7 +36,8 @@ async def get_chat_info(chat_id: str) -> Optional[dict]:
 
 async def send_web_message(
         chat_id: str, text: str, parse_mode: str = 'HTML',
-        disable_web_page_preview: bool = False, retry: bool = False) -> bool:
+        disable_web_page_preview: bool = False,
+        retry: bool = False) -> Optional[int]:
     """
     Send a message to a chat using Telegram Bot API via web.
 
@@ -48,7 +49,7 @@ async def send_web_message(
         retry: Whether to retry sending the message
 
     Returns:
-        bool: True if message was sent successfully, False otherwise
+        int: message_id of the sent message (truthy), None if sending failed
     """
     url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
 
@@ -67,13 +68,14 @@ async def send_web_message(
         async with httpx.AsyncClient(timeout=30.0) as client:
             response = await client.post(url, json=payload)
             response.raise_for_status()
+            message_id = response.json()['result']['message_id']
             logger.info(f"Message sent successfully to {chat_id}")
             await asyncio.sleep(5)
-            return True
+            return message_id
     except Exception as e:
         logger.error(f"Error sending message to {chat_id}: {e}")
         await asyncio.sleep(5)
-        result = False
+        result = None
         if not retry:
             result = await send_web_message(
                 chat_id, text, parse_mode, disable_web_page_preview, True)